@@ -0,0 +1,307 @@
+import argparse
+import asyncio
+import csv
+import getpass
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from model.card import Card
+from model.purchase import PurchaseResult, STAGE_SETUP, STAGE_SUBMITTED, STATUS_ERROR
+from model.receipt import Receipt
+from model.settings import ENGINES, Settings
+from service.artifact_store import FailureArtifactStore
+from service.async_automator import purchase_batch_async
+from service.card_router import CardRouter, NoCardAvailableError
+from service.customer_cache import CustomerCache
+from service.offline_queue import OfflineQueue
+from service.outbox import FileOutbox
+from service.profiler import ProfileSession
+from service.purchase_coordinator import PurchaseCoordinator
+from service.purchase_flow import purchase_in_new_session
+from service.receipts import ReceiptError, ReceiptPipeline, ReceiptRenderer, enable_images
+from service.resource_governor import ResourceGovernor
+from service.settings import SettingsError, SettingsStore, purchase_plan
+from service.validate import Validate
+from service.wallet import Wallet, WalletError
+from static.constants import *
+
+
+class PurchaseCli:
+    """Command line and batch entry point sharing the GUI's purchase flow and coordinator."""
+    def __init__(self, wallet, settings=None, headless=True, profile=False, card_timeout=600):
+        self.logger = logging.getLogger("INFO Logger")
+        # receipts are rendered and sent off the purchase threads
+        self.receipts = ReceiptPipeline(ReceiptRenderer(RECEIPT_TEMPLATE_DIR), RECEIPT_DIR, RECEIPT_FORMATS,
+                                        FileOutbox(OUTBOX_DIR, logger=self.logger), recipient=RECEIPT_RECIPIENT,
+                                        batch_size=RECEIPT_BATCH_SIZE, logger=self.logger)
+        self.settings = settings or Settings()
+        # compiled once; a CLI run does not reload its settings
+        self.plan = purchase_plan(self.settings)
+        self.headless = headless
+        self.card_timeout = card_timeout
+        self.card_router = CardRouter.from_wallet(wallet, CARD_CHARGES_FILE, ENV_CARD_MAX_PER_HOUR,
+                                                  ENV_CARD_MAX_CONCURRENT, logger=self.logger)
+        self.customer_cache = CustomerCache(CUSTOMER_CACHE_FILE, CUSTOMER_CACHE_TTL, logger=self.logger)
+        self.governor = ResourceGovernor(DRIVER_PID_DIR, BROWSER_MAX_RSS_MB, BROWSER_MAX_CPU_PERCENT,
+                                         logger=self.logger)
+        self.coordinator = PurchaseCoordinator(PURCHASE_LOCK_DIR, logger=self.logger)
+        self.artifacts = FailureArtifactStore(ARTIFACT_DIR, ARTIFACT_MAX_COUNT, ARTIFACT_MAX_BYTES, logger=self.logger)
+        self.offline_queue = OfflineQueue(OFFLINE_QUEUE_FILE, logger=self.logger)
+        self.profiler = None
+        if profile or PROFILE_ENABLED:
+            self.profiler = ProfileSession(PROFILE_DIR, label="cli", logger=self.logger)
+
+    def __enter__(self):
+        self.governor.start()
+        if self.profiler:
+            self.profiler.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.profiler:
+            self.profiler.stop()
+        # pending captures quit their browsers when done; the governor kills whatever is left
+        self.artifacts.close()
+        self.governor.shutdown()
+        self.receipts.close()
+        self.customer_cache.close()
+        self.offline_queue.close()
+        self.card_router.close()
+
+    def purchase(self, meter, amount, confirm=None):
+        """Runs one purchase, deduplicated against every other in-flight purchase."""
+        def start():
+            try:
+                lease = self.card_router.acquire(amount, timeout=self.card_timeout)
+            except NoCardAvailableError as e:
+                return PurchaseResult(meter, amount, STATUS_ERROR, str(e), STAGE_SETUP)
+
+            result = None
+            try:
+                if not self.profiler:
+                    result = self._purchase(meter, amount, lease.card, confirm)
+                else:
+                    with self.profiler.profile_thread():
+                        result = self._purchase(meter, amount, lease.card,
+                                                confirm and self.profiler.unprofiled(confirm))
+                self.receipts.submit(Receipt.from_result(result))
+                return result
+            finally:
+                self.card_router.release(lease, result)
+
+        try:
+            return self.coordinator.run(meter, amount, start)
+        except Exception as e:
+            # an unexpected error may have happened after the payment was submitted
+            self.logger.error(f"Purchase for meter {meter} failed: {e}")
+            return PurchaseResult(meter, amount, STATUS_ERROR, str(e), STAGE_SUBMITTED)
+
+    def _purchase(self, meter, amount, card, confirm):
+        result = purchase_in_new_session(meter, amount, card, headless=self.headless,
+                                         confirm=confirm, customer_cache=self.customer_cache, logger=self.logger,
+                                         plan=self.plan, governor=self.governor, profiler=self.profiler,
+                                         artifacts=self.artifacts, **self.settings.automator_options())
+        if result.stage == STAGE_SETUP:
+            self._queue_offline(result, confirm=confirm is not None)
+        return result
+
+    def batch(self, rows, workers, engine="selenium"):
+        """
+        Runs purchases concurrently, spread across the wallet's cards.
+        :param rows: (list) (meter, amount) tuples
+        :param engine: (str) "selenium" runs a browser per worker thread, "async" runs every purchase
+                       from one event loop on one browser over the DevTools protocol
+        :return: (list) (meter, amount, PurchaseResult or None) in input order
+        """
+        if engine == "async":
+            return self._batch_async(rows, workers)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(self.purchase, meter, amount) for meter, amount in rows]
+            return [(meter, amount, future.result()) for (meter, amount), future in zip(rows, futures)]
+
+    def _batch_async(self, rows, concurrency):
+        # the async engine has no WebDriver session to profile or capture failure artifacts from
+        if self.profiler:
+            self.logger.warning("UTA_PROFILE is ignored by the async engine, the batch is not profiled")
+        self.logger.info("Failure artifacts are not captured by the async engine")
+        results = asyncio.run(purchase_batch_async(
+            rows, self.card_router, concurrency, headless=self.headless,
+            coordinator=self.coordinator, customer_cache=self.customer_cache, governor=self.governor,
+            chrome_path=self.settings.chrome_path, card_timeout=self.card_timeout, on_setup_failed=self._queue_offline,
+            plan=self.plan, lean_profile=self.settings.lean_profile, logger=self.logger))
+        # duplicate rows share one result, and get one receipt
+        for result in {id(result): result for _, _, result in results if result}.values():
+            self.receipts.submit(Receipt.from_result(result))
+        return results
+
+    def _queue_offline(self, result, confirm=False):
+        # the portal could not be reached; keep the purchase for the GUI or daemon to replay
+        self.offline_queue.enqueue(result.meter, result.amount, confirm=confirm)
+        result.message = f"{result.message}. Queued for retry when the portal is back."
+
+
+def read_batch(path):
+    """Reads meter,amount rows from a CSV file, validating each one."""
+    validate = Validate()
+    rows = []
+    with open(path, newline="") as f:
+        for line_no, row in enumerate(csv.reader(f), start=1):
+            if not row or row[0].strip().lower() in ("", "meter"):
+                continue
+            meter = row[0].strip()
+            valid, msg = validate.meterNo(meter)
+            if not valid:
+                raise ValueError(f"Line {line_no}: {msg}")
+            valid, amount, msg = validate.amount(row[1].strip() if len(row) > 1 else "")
+            if not valid:
+                raise ValueError(f"Line {line_no}: {msg}")
+            rows.append((meter, amount))
+    return rows
+
+
+def confirm_on_console(customer_name, meter, amount):
+    answer = input(f"Customer: {customer_name}, Meter No.: {meter}, Amount: ${amount:.2f}. Submit payment? [y/N] ")
+    return answer.strip().lower() in ("y", "yes")
+
+
+def print_result(meter, amount, result):
+    if result is None:
+        print(f"{meter}\t{amount:.2f}\tskipped\tAlready in progress in another process")
+        return
+    print(f"{meter}\t{amount:.2f}\t{result.status}\t{result.customer_name or ''}\t{result.message}")
+
+
+def wallet_command(wallet, args):
+    if args.wallet_command == "list":
+        for entry in wallet.cards():
+            limits = ", ".join(f"{name}={value}" for name, value in (
+                ("per hour", entry.max_per_hour), ("max", entry.max_amount), ("daily", entry.max_daily_amount),
+                ("concurrent", entry.max_concurrent)) if value is not None)
+            state = "" if entry.enabled else " (disabled)"
+            expiry = f"{entry.card.exp_month:02d}/{entry.card.exp_year}"
+            print(f"{entry.id}\t{entry.display_name}\t{expiry}\t{limits}{state}")
+        return 0
+
+    if args.wallet_command == "remove":
+        if not wallet.remove(args.id):
+            print(f"No card {args.id}", file=sys.stderr)
+            return 1
+        return 0
+
+    number = getpass.getpass("Card number: ").replace(" ", "").replace("-", "")
+    name = input("Cardholder name: ").strip()
+    code = getpass.getpass("Card code: ").strip()
+    month, _, year = input("Expiry (MM/YYYY): ").strip().partition("/")
+    valid, msg = Validate().card(number, name, code, month, year)
+    if not valid:
+        print(msg, file=sys.stderr)
+        return 2
+    entry = wallet.add(Card(number, name, code, int(month), int(year)), label=args.label,
+                       max_per_hour=args.max_per_hour, max_amount=args.max_amount,
+                       max_daily_amount=args.max_daily, max_concurrent=args.max_concurrent)
+    print(f"Added {entry.display_name} ({entry.id})")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Purchase prepaid power / water tokens")
+    parser.add_argument("--show-browser", action="store_true", help="Run the browser with a visible window")
+    parser.add_argument("--profile", action="store_true", help="Profile the purchase or the whole batch")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    purchase_parser = commands.add_parser("purchase", help="Purchase a single token")
+    purchase_parser.add_argument("meter")
+    purchase_parser.add_argument("amount")
+    purchase_parser.add_argument("--yes", action="store_true", help="Submit without asking for confirmation")
+
+    batch_parser = commands.add_parser("batch", help="Purchase tokens for every meter,amount row of a CSV file")
+    batch_parser.add_argument("file")
+    batch_parser.add_argument("--workers", type=int,
+                              help="Purchases running at the same time, the batch_workers setting by default")
+    batch_parser.add_argument("--engine", choices=ENGINES,
+                              help="async drives every session from one event loop over the DevTools protocol; "
+                                   "the engine setting by default")
+    batch_parser.add_argument("--yes", action="store_true",
+                              help="Submit the payments. Without it the batch is only checked")
+
+    wallet_parser = commands.add_parser("wallet", help="Manage the encrypted card wallet")
+    wallet_commands = wallet_parser.add_subparsers(dest="wallet_command", required=True)
+    wallet_commands.add_parser("list", help="List the cards")
+    add_parser = wallet_commands.add_parser("add", help="Add a card (details are prompted for)")
+    add_parser.add_argument("--label", default="")
+    add_parser.add_argument("--max-per-hour", type=int, default=CARD_MAX_PER_HOUR, help="Purchases per hour")
+    add_parser.add_argument("--max-amount", type=float, help="Largest single purchase")
+    add_parser.add_argument("--max-daily", type=float, help="Total purchases per 24 hours")
+    add_parser.add_argument("--max-concurrent", type=int, default=CARD_MAX_CONCURRENT,
+                            help="Purchases running on the card at the same time")
+    remove_parser = wallet_commands.add_parser("remove", help="Remove a card")
+    remove_parser.add_argument("id")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    try:
+        wallet = Wallet(WALLET_FILE, WALLET_KEY_FILE)
+    except WalletError as e:
+        print(e, file=sys.stderr)
+        return 2
+    if args.command == "wallet":
+        return wallet_command(wallet, args)
+
+    try:
+        settings = SettingsStore(SETTINGS_FILE).current
+    except SettingsError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    engine = getattr(args, "engine", None) or settings.engine
+    if args.command == "batch" and args.profile and engine == "async":
+        print("--profile is not supported by the async engine, use --engine selenium", file=sys.stderr)
+        return 2
+
+    validate = Validate()
+    if "png" in RECEIPT_FORMATS:
+        enable_images()
+    try:
+        cli = PurchaseCli(wallet, settings, headless=settings.headless and not args.show_browser,
+                          profile=args.profile)
+    except ReceiptError as e:
+        print(e, file=sys.stderr)
+        return 2
+    with cli:
+        if not cli.card_router.has_cards():
+            print("No payment card. Add one with 'wallet add' or set the CC environment variables", file=sys.stderr)
+            return 2
+
+        if args.command == "purchase":
+            valid, msg = validate.meterNo(args.meter)
+            valid_amount, amount, amount_msg = validate.amount(args.amount)
+            if not valid or not valid_amount:
+                print(msg if not valid else amount_msg, file=sys.stderr)
+                return 2
+            result = cli.purchase(args.meter, amount, confirm=None if args.yes else confirm_on_console)
+            print_result(args.meter, amount, result)
+            return 0 if result and result.success else 1
+
+        try:
+            rows = read_batch(args.file)
+        except (OSError, ValueError) as e:
+            print(e, file=sys.stderr)
+            return 2
+
+        # flag meters that have never been looked up before spending a browser session on them
+        for meter in cli.customer_cache.unknown(meter for meter, _ in rows):
+            print(f"{meter}\tunknown meter (not in customer cache)")
+        if not args.yes:
+            print(f"{len(rows)} purchase(s) checked. Re-run with --yes to submit them.")
+            return 0
+
+        results = cli.batch(rows, workers=max(1, args.workers or settings.batch_workers), engine=engine)
+        for meter, amount, result in results:
+            print_result(meter, amount, result)
+        return 0 if all(result and result.success for _, _, result in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,149 @@
+import argparse
+import logging
+import os
+import signal
+import sys
+import threading
+
+from service.artifact_store import FailureArtifactStore
+from service.card_router import CardRouter
+from service.customer_cache import CustomerCache
+from service.offline_queue import OfflineQueue, PortalHealthProbe, QueueDrainer
+from service.purchase_api import PurchaseApiServer
+from service.purchase_coordinator import PurchaseCoordinator
+from service.outbox import FileOutbox
+from service.purchase_service import DuplicatePurchaseError, PurchaseService, QueueFullError
+from service.receipts import ReceiptError, ReceiptPipeline, ReceiptRenderer, enable_images
+from service.resource_governor import ResourceGovernor
+from service.session_pool import SessionPool
+from service.settings import SettingsError, SettingsStore, purchase_plan
+from service.wallet import Wallet, WalletError
+from static.constants import *
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local purchase service with an HTTP/JSON API")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to bind, localhost by default")
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--workers", type=int, help="Concurrent purchases / warm sessions, the pool_size setting "
+                                                    "by default")
+    parser.add_argument("--max-queue", type=int, default=SERVICE_MAX_QUEUE, help="Queued jobs before returning 429")
+    parser.add_argument("--show-browser", action="store_true", help="Run the browsers with a visible window")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(threadName)s %(message)s")
+    logger = logging.getLogger("INFO Logger")
+
+    # SIGHUP or saving the settings file applies new settings without a restart
+    try:
+        settings_store = SettingsStore(SETTINGS_FILE, logger=logger)
+    except SettingsError as e:
+        print(e, file=sys.stderr)
+        return 2
+    settings = settings_store.current
+    workers = args.workers or settings.pool_size
+
+    try:
+        wallet = Wallet(WALLET_FILE, WALLET_KEY_FILE, logger=logger)
+    except WalletError as e:
+        print(e, file=sys.stderr)
+        return 2
+    card_router = CardRouter.from_wallet(wallet, CARD_CHARGES_FILE, ENV_CARD_MAX_PER_HOUR, ENV_CARD_MAX_CONCURRENT,
+                                         logger=logger)
+    if not card_router.has_cards():
+        print("No payment card. Add one with 'cli.py wallet add' or set the CC environment variables",
+              file=sys.stderr)
+        return 2
+
+    # receipts are rendered and sent off the worker threads
+    if "png" in RECEIPT_FORMATS:
+        enable_images()
+    try:
+        receipts = ReceiptPipeline(ReceiptRenderer(RECEIPT_TEMPLATE_DIR), RECEIPT_DIR, RECEIPT_FORMATS,
+                                   FileOutbox(OUTBOX_DIR, logger=logger), recipient=RECEIPT_RECIPIENT,
+                                   batch_size=RECEIPT_BATCH_SIZE, logger=logger)
+    except ReceiptError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    customer_cache = CustomerCache(CUSTOMER_CACHE_FILE, CUSTOMER_CACHE_TTL, logger=logger)
+    governor = ResourceGovernor(DRIVER_PID_DIR, BROWSER_MAX_RSS_MB, BROWSER_MAX_CPU_PERCENT, logger=logger)
+    governor.start()
+    artifacts = FailureArtifactStore(ARTIFACT_DIR, ARTIFACT_MAX_COUNT, ARTIFACT_MAX_BYTES, logger=logger)
+    plan = purchase_plan(settings)
+    pool = SessionPool(plan, size=workers, headless=settings.headless and not args.show_browser,
+                       governor=governor, artifacts=artifacts, logger=logger, **settings.automator_options())
+    # purchases that could not start are queued and replayed when the portal is back, here or by the GUI or CLI
+    offline_queue = OfflineQueue(OFFLINE_QUEUE_FILE, logger=logger)
+
+    def queue_offline(result):
+        # API purchases are never confirmed by a person, so neither is their replay
+        offline_queue.enqueue(result.meter, result.amount, confirm=False)
+        drainer.refresh()
+        result.message = f"{result.message}. Queued for retry when the portal is back."
+
+    service = PurchaseService(pool, PurchaseCoordinator(PURCHASE_LOCK_DIR, logger=logger), card_router,
+                              workers=workers, max_queue=args.max_queue, customer_cache=customer_cache,
+                              receipts=receipts, plan=plan, on_setup_failed=queue_offline,
+                              logger=logger)
+    server = PurchaseApiServer(service, host=args.host, port=args.port, token=os.getenv("UTA_API_TOKEN"),
+                               logger=logger)
+
+    def replay(meter, amount, confirm):
+        # confirm is always False: purchases queued for a confirmation are left to the GUI
+        try:
+            job, _ = service.submit(meter, amount, priority=20)
+        except (QueueFullError, DuplicatePurchaseError):
+            return None
+        job.done.wait()
+        return job.result
+
+    probe = PortalHealthProbe(settings.url)
+    drainer = QueueDrainer(offline_queue, probe, replay, concurrency=settings.offline_concurrency,
+                           interval=PORTAL_PROBE_INTERVAL, logger=logger)
+
+    def apply_settings(settings, changed):
+        plan = purchase_plan(settings) if changed & {"url", "timeout", "step_timeouts"} else None
+        # warm sessions are kept; see SessionPool.configure()
+        pool.configure(plan, settings.headless and not args.show_browser, **settings.automator_options())
+        if plan:
+            service.plan = plan
+        if "pool_size" in changed:
+            service.resize(settings.pool_size)
+        probe.url = settings.url
+        drainer.concurrency = settings.offline_concurrency
+
+    def shutdown(*_):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    def reload_settings(*_):
+        threading.Thread(target=settings_store.reload, daemon=True).start()
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, reload_settings)
+
+    service.start()
+    drainer.start()
+    settings_store.subscribe(apply_settings)
+    settings_store.watch(SETTINGS_POLL_INTERVAL)
+    logger.info(f"Purchase service listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        settings_store.stop()
+        drainer.stop()
+        service.stop()
+        receipts.close()
+        offline_queue.close()
+        artifacts.close()
+        governor.shutdown()
+        customer_cache.close()
+        card_router.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
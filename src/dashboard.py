@@ -0,0 +1,91 @@
+from PySide6 import QtCore as qtc
+from PySide6 import QtWidgets as qtw
+
+from service.dashboard_stats import DashboardStats
+from static.constants import DASHBOARD_REFRESH_MS, DASHBOARD_WINDOW
+
+
+def _seconds(value):
+    return "-" if value is None else f"{value:.2f}s"
+
+
+class DashboardWindow(qtw.QWidget):
+    """
+    Live view of queue depth, sessions, success rate, step latency and browser memory.
+    Refreshed by a timer on the GUI thread at a fixed low rate, and only while shown; the
+    automation threads never wait on it.
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent, qtc.Qt.Window)
+        self.setWindowTitle("Dashboard")
+        self.resize(560, 620)
+        self.stats = DashboardStats(window=DASHBOARD_WINDOW)
+
+        self.lb_dashSummary = qtw.QLabel()
+        self.fl_dashGauges = qtw.QFormLayout()
+        self._gauge_labels = {}
+
+        self.tw_stepLatency = qtw.QTableWidget(0, 4)
+        self.tw_stepLatency.setHorizontalHeaderLabels(["Step", "Count", "p50", "p95"])
+        self.tw_stepLatency.horizontalHeader().setSectionResizeMode(0, qtw.QHeaderView.Stretch)
+        self.tw_stepLatency.verticalHeader().setVisible(False)
+        self.tw_stepLatency.setEditTriggers(qtw.QAbstractItemView.NoEditTriggers)
+        self._step_rows = {}
+
+        self.lw_errors = qtw.QListWidget()
+
+        layout = qtw.QVBoxLayout(self)
+        layout.addWidget(self.lb_dashSummary)
+        layout.addLayout(self.fl_dashGauges)
+        layout.addWidget(qtw.QLabel("Step latency"))
+        layout.addWidget(self.tw_stepLatency, stretch=2)
+        layout.addWidget(qtw.QLabel("Errors"))
+        layout.addWidget(self.lw_errors, stretch=1)
+
+        self.timer = qtc.QTimer(self)
+        self.timer.setInterval(DASHBOARD_REFRESH_MS)
+        self.timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        self.refresh()
+        self.timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        summary = self.stats.update()
+
+        success_rate = summary["success_rate"]
+        self.lb_dashSummary.setText(
+            f"Purchases: {summary['purchases']}   "
+            f"Success: {'-' if success_rate is None else f'{success_rate:.0%}'}   "
+            f"Throughput: {summary['throughput']:.1f}/min   "
+            f"Latency p50/p95: {_seconds(summary['latency_p50'])} / {_seconds(summary['latency_p95'])}")
+
+        for label, value in summary["gauges"]:
+            if label not in self._gauge_labels:
+                self._gauge_labels[label] = qtw.QLabel()
+                self.fl_dashGauges.addRow(label, self._gauge_labels[label])
+            self._gauge_labels[label].setText(f"{value:.0f}" if isinstance(value, float) else str(value))
+
+        # rows are updated in place so the table keeps its scroll position and selection
+        steps = {name: (0, None, None) for name in self._step_rows}
+        steps.update(summary["steps"])
+        for name, (count, p50, p95) in steps.items():
+            row = self._step_rows.get(name)
+            if row is None:
+                row = self._step_rows[name] = self.tw_stepLatency.rowCount()
+                self.tw_stepLatency.insertRow(row)
+                self.tw_stepLatency.setItem(row, 0, qtw.QTableWidgetItem(name))
+                for column in (1, 2, 3):
+                    self.tw_stepLatency.setItem(row, column, qtw.QTableWidgetItem())
+            for column, text in ((1, str(count)), (2, _seconds(p50)), (3, _seconds(p95))):
+                self.tw_stepLatency.item(row, column).setText(text)
+
+        errors = [f"{count} x {status} at {stage}" for (status, stage), count in summary["errors"]]
+        if errors != [self.lw_errors.item(i).text() for i in range(self.lw_errors.count())]:
+            self.lw_errors.clear()
+            self.lw_errors.addItems(errors)
@@ -0,0 +1,155 @@
+import argparse
+import json
+import logging
+import os
+import sys
+from datetime import datetime
+
+from service.load_test import LoadTest, recommend, replay_check
+from service.portal_standin import PortalStandIn
+from service.replay_server import ReplayServer
+from service.resource_governor import ResourceGovernor
+from service.settings import SettingsError, SettingsStore
+from static.constants import *
+
+
+def _seconds(value):
+    return "-" if value is None else f"{value:.2f}s"
+
+
+def print_levels(levels):
+    print(f"{'Level':>5} {'Per min':>8} {'p50':>7} {'p95':>7} {'p99':>7} {'OK':>4} {'Fail':>4} "
+          f"{'Timeout':>7} {'False':>5} {'Setup':>5} {'RSS MB':>7}")
+    for level in levels:
+        rss = level["browser_rss_mb"]
+        print(f"{level['concurrency']:>5} {level['throughput']:>8.1f} {_seconds(level['latency_p50']):>7} "
+              f"{_seconds(level['latency_p95']):>7} {_seconds(level['latency_p99']):>7} {level['success']:>4} "
+              f"{level['failure']:>4} {level['timeout']:>7} {level['false_failure']:>5} {level['setup']:>5} "
+              f"{'-' if rss is None else f'{rss:.0f}':>7}")
+
+
+def print_recommendation(advice):
+    print()
+    print(f"Pool size / workers: {advice['pool_size'] or '-'}")
+    print(f"Step timeout:        {_seconds(advice['timeout'])}")
+    print(f"Page load timeout:   {_seconds(advice['element_timeout'])}")
+    for name, seconds in advice["step_timeouts"].items():
+        print(f"  {name:<28} {_seconds(seconds)}")
+    for note in advice["notes"]:
+        print(f"Note: {note}")
+    print(f"Settings file: {json.dumps(recommended_settings(advice))}")
+
+
+def recommended_settings(advice) -> dict:
+    """:return: (dict) The recommendation as settings file values, see model/settings.py"""
+    settings = {"pool_size": advice["pool_size"], "timeout": advice["timeout"],
+                "element_timeout": advice["element_timeout"], "step_timeouts": advice["step_timeouts"]}
+    return {name: value for name, value in settings.items() if value}
+
+
+def print_replay(check):
+    result = check["result"]
+    print(f"Result: {result.status} at {result.stage}: {result.message}")
+    print(f"Recorded steps: {', '.join(check['recorded_steps'])}")
+    print(f"Replayed steps: {', '.join(check['steps'])}")
+    for method, path in check["misses"]:
+        print(f"Not recorded: {method} {path}")
+    print("Replay passed" if check["passed"] else "Replay failed")
+
+
+def main(argv=None):
+    try:
+        settings = SettingsStore(SETTINGS_FILE).current
+    except SettingsError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    parser = argparse.ArgumentParser(description="Ramp purchase concurrency against a local portal stand-in and "
+                                                 "recommend timeout and pool-size settings")
+    parser.add_argument("--levels", default=",".join(map(str, LOADTEST_LEVELS)),
+                        help="Comma separated concurrency levels to ramp through")
+    parser.add_argument("--purchases", type=int, default=LOADTEST_PURCHASES, help="Purchases per level")
+    parser.add_argument("--engine", choices=("selenium", "async"), default="selenium")
+    parser.add_argument("--timeout", type=float, default=settings.timeout, help="Seconds each step waits for the page")
+    parser.add_argument("--element-timeout", type=float, default=settings.element_timeout,
+                        help="Seconds to wait for a page to load")
+    parser.add_argument("--max-error-rate", type=float, default=0.01,
+                        help="Timeouts and false failures a level may have to count as healthy")
+    parser.add_argument("--show-browser", action="store_true", help="Run the browsers with a visible window")
+    parser.add_argument("--replay", metavar="RECORDING",
+                        help="Instead of ramping, run one purchase against a recorded session (see UTA_RECORD_DIR) "
+                             "and check it takes the recorded steps")
+
+    portal_args = parser.add_argument_group("portal stand-in")
+    portal_args.add_argument("--latency", type=float, default=0.2, help="Seconds added to every response")
+    portal_args.add_argument("--jitter", type=float, default=0.1, help="Up to this many more seconds at random")
+    portal_args.add_argument("--slow-rate", type=float, default=0.0, help="Share of postbacks that are slow")
+    portal_args.add_argument("--slow-seconds", type=float, default=5.0, help="Extra seconds for a slow postback")
+    portal_args.add_argument("--meter-error-rate", type=float, default=0.0)
+    portal_args.add_argument("--server-error-rate", type=float, default=0.0)
+    portal_args.add_argument("--decline-rate", type=float, default=0.0)
+    portal_args.add_argument("--seed", type=int, help="Seed for the injected delays and failures")
+    args = parser.parse_args(argv)
+
+    try:
+        levels = [int(level) for level in args.levels.split(",")]
+    except ValueError:
+        levels = []
+    if not levels or min(levels) < 1:
+        parser.error("--levels must be comma separated numbers from 1 up")
+    if args.purchases < 1:
+        parser.error("--purchases must be at least 1")
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(threadName)s %(message)s")
+    logger = logging.getLogger("INFO Logger")
+
+    # its own pid files, so the test never reaps or is reaped by a GUI, CLI or daemon run
+    governor = ResourceGovernor(os.path.join(LOADTEST_DIR, "drivers"), BROWSER_MAX_RSS_MB, BROWSER_MAX_CPU_PERCENT,
+                                logger=logger)
+    governor.start()
+    if args.replay:
+        try:
+            with ReplayServer(args.replay, logger=logger) as server:
+                check = replay_check(server, engine=args.engine, timeout=args.timeout,
+                                     element_timeout=args.element_timeout, headless=not args.show_browser,
+                                     governor=governor, chrome_path=settings.chrome_path, logger=logger)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Unable to read the recording: {e}", file=sys.stderr)
+            return 2
+        except KeyboardInterrupt:
+            return 130
+        finally:
+            governor.shutdown()
+        print_replay(check)
+        return 0 if check["passed"] else 1
+
+    portal = PortalStandIn(latency=args.latency, jitter=args.jitter, slow_rate=args.slow_rate,
+                           slow_seconds=args.slow_seconds, meter_error_rate=args.meter_error_rate,
+                           server_error_rate=args.server_error_rate, decline_rate=args.decline_rate,
+                           seed=args.seed, logger=logger)
+    try:
+        with portal:
+            load_test = LoadTest(portal, engine=args.engine, timeout=args.timeout,
+                                 element_timeout=args.element_timeout, headless=not args.show_browser,
+                                 governor=governor, chrome_path=settings.chrome_path, logger=logger)
+            results = load_test.run(levels, args.purchases)
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        governor.shutdown()
+
+    advice = recommend(results, max_error_rate=args.max_error_rate)
+    print_levels(results)
+    print_recommendation(advice)
+
+    os.makedirs(LOADTEST_DIR, exist_ok=True)
+    path = os.path.join(LOADTEST_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{args.engine}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"settings": vars(args), "levels": results, "recommendation": advice,
+                   "settings_file": recommended_settings(advice)}, f, indent=2)
+    print(f"\nReport: {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
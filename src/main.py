@@ -1,22 +1,102 @@
 import logging
 import sys
+import threading
 from PySide6 import QtCore as qtc
 from PySide6 import QtWidgets as qtw
 from PySide6 import QtGui as qtg
 
 from mainwindow_ui import Ui_MainWindow
 from service.validate import Validate
+from model.purchase import PurchaseResult, STAGE_METER, STAGE_RESULT, STAGE_SETUP, STATUS_ERROR
+from model.receipt import Receipt
+from service.artifact_store import FailureArtifactStore
 from service.browser_automator import BrowserAutomator
+from service.card_router import CardRouter, NoCardAvailableError, wallet_cards
+from service.customer_cache import CustomerCache
 from service.log_handler import LogHandler
+from service.offline_queue import OfflineQueue, PortalHealthProbe, QueueDrainer
+from service.outbox import FileOutbox
+from service.profiler import ProfileSession
+from service.purchase_coordinator import PurchaseCoordinator
+from service.purchase_flow import purchase_in_new_session, run_purchase
+from service.receipts import ReceiptError, ReceiptPipeline, ReceiptRenderer
+from service.resource_governor import ResourceGovernor
+from service.settings import SettingsError, SettingsStore, purchase_plan
 from service.setup_worker import SetupWorker
+from service.wallet import Wallet, WalletError
 from static.constants import *
+from dashboard import DashboardWindow
+from wallet_dialog import WalletDialog
 
 
 class MainWindow(qtw.QMainWindow, Ui_MainWindow):
-    def __init__(self):
+    offline_queue_changed = qtc.Signal(int)
+    settings_changed = qtc.Signal(object, object)
+    replay_confirmation_requested = qtc.Signal(object)
+
+    def __init__(self, profile=False):
         super().__init__()
         self.setupUi(self)
         self.set_logging()
+        self.set_menu(profile)
+        self.profiler = None
+
+        # receipts for successful purchases are rendered and sent off the GUI thread; created first
+        # since unknown receipt formats stop the start, as in the CLI and daemon
+        self.receipts = ReceiptPipeline(ReceiptRenderer(RECEIPT_TEMPLATE_DIR), RECEIPT_DIR, RECEIPT_FORMATS,
+                                        FileOutbox(OUTBOX_DIR, logger=self.logger), recipient=RECEIPT_RECIPIENT,
+                                        batch_size=RECEIPT_BATCH_SIZE, logger=self.logger)
+
+        # an invalid settings file is reported in the status bar and the defaults are used
+        self.settings = SettingsStore(SETTINGS_FILE, strict=False, logger=self.logger)
+        self.plan = purchase_plan(self.settings.current)
+        self.customer_cache = CustomerCache(CUSTOMER_CACHE_FILE, CUSTOMER_CACHE_TTL, logger=self.logger)
+
+        # purchases are paid with the wallet's cards, spread across them by the card router
+        try:
+            self.wallet = Wallet(WALLET_FILE, WALLET_KEY_FILE, logger=self.logger)
+        except WalletError as e:
+            self.wallet = None
+            qtw.QMessageBox.critical(self, "Wallet", str(e))
+        self.action_wallet.setEnabled(self.wallet is not None)
+        self.card_router = CardRouter.from_wallet(self.wallet, CARD_CHARGES_FILE, ENV_CARD_MAX_PER_HOUR,
+                                                  ENV_CARD_MAX_CONCURRENT, logger=self.logger)
+
+        # track browser memory/CPU and reap orphaned drivers from earlier runs
+        self.governor = ResourceGovernor(DRIVER_PID_DIR, BROWSER_MAX_RSS_MB, BROWSER_MAX_CPU_PERCENT,
+                                         logger=self.logger)
+        self.governor.start()
+
+        self.artifacts = FailureArtifactStore(ARTIFACT_DIR, ARTIFACT_MAX_COUNT, ARTIFACT_MAX_BYTES, logger=self.logger)
+
+        # shared with the CLI and batch runs through per-purchase lock files
+        self.coordinator = PurchaseCoordinator(PURCHASE_LOCK_DIR, logger=self.logger)
+
+        # purchases that could not start are queued and replayed when the portal is back
+        self.lb_offlineQueue = qtw.QLabel()
+        self.statusbar.addPermanentWidget(self.lb_offlineQueue)
+        self.offline_queue_changed.connect(self.show_offline_queue)
+        self.offline_queue = OfflineQueue(OFFLINE_QUEUE_FILE, logger=self.logger)
+        # replays of purchases queued from here stop at the confirmation dialog, one at a time
+        self.replay_confirmation_requested.connect(self.ask_replay_confirmation)
+        self.replay_confirmation_lock = threading.Lock()
+        self.closing = threading.Event()
+        self.probe = PortalHealthProbe(self.settings.current.url)
+        self.drainer = QueueDrainer(self.offline_queue, self.probe, self.replay_purchase,
+                                    concurrency=self.settings.current.offline_concurrency,
+                                    interval=PORTAL_PROBE_INTERVAL, can_confirm=True,
+                                    on_change=self.offline_queue_changed.emit, logger=self.logger)
+        self.drainer.start()
+
+        # saving the settings file applies it right away; reloads arrive on the watcher thread
+        self.settings_changed.connect(self.apply_settings)
+        self.settings.subscribe(self.settings_changed.emit)
+        self.settings.watch(SETTINGS_POLL_INTERVAL)
+
+        self.receipt = None
+        self.pb_shareReceipt = qtw.QPushButton(qtg.QIcon(":/main/receipt-share.png"), "Share Receipt")
+        self.pb_shareReceipt.setVisible(False)
+        self.gridLayout.addWidget(self.pb_shareReceipt, 1, 0, 1, 1, qtc.Qt.AlignRight)
 
         # clear message and token label
         self.lb_token.setText("")
@@ -26,13 +106,18 @@ class MainWindow(qtw.QMainWindow, Ui_MainWindow):
         self.le_meterNo.returnPressed.connect(self.validate_input)
         self.le_amount.returnPressed.connect(self.validate_input)
 
+        # show the likely customer as the meter number is typed
+        self.le_meterNo.textChanged.connect(self.show_cached_customer)
+
         # connect buttons
         self.pb_clear.clicked.connect(self.clear_input)
         self.pb_submit.clicked.connect(self.validate_input)
+        self.pb_shareReceipt.clicked.connect(self.share_receipt)
 
     def handle_error(self, message):
         self.logger.error(message)
         self.statusbar.showMessage(message, 5000)
+        self.stop_profiling()
 
     def set_logging(self):
         self.logger = logging.getLogger("INFO Logger")
@@ -42,6 +127,129 @@ class MainWindow(qtw.QMainWindow, Ui_MainWindow):
         handler.setLevel(logging.INFO)
         self.logger.addHandler(handler)
 
+    def set_menu(self, profile):
+        self.menubar.setEnabled(True)
+        tools_menu = self.menubar.addMenu("Tools")
+
+        # profile every purchase while checked
+        self.action_profile = qtg.QAction("Profile Purchases", self)
+        self.action_profile.setCheckable(True)
+        self.action_profile.setChecked(profile)
+        tools_menu.addAction(self.action_profile)
+
+        self.dashboard = None
+        self.action_dashboard = qtg.QAction("Dashboard", self)
+        self.action_dashboard.triggered.connect(self.show_dashboard)
+        tools_menu.addAction(self.action_dashboard)
+
+        self.action_wallet = qtg.QAction("Wallet...", self)
+        self.action_wallet.triggered.connect(self.show_wallet)
+        tools_menu.addAction(self.action_wallet)
+
+        self.action_reload_settings = qtg.QAction("Reload Settings", self)
+        self.action_reload_settings.triggered.connect(self.reload_settings)
+        tools_menu.addAction(self.action_reload_settings)
+
+    def show_dashboard(self):
+        if not self.dashboard:
+            self.dashboard = DashboardWindow(self)
+        self.dashboard.show()
+        self.dashboard.raise_()
+
+    def show_wallet(self):
+        dialog = WalletDialog(self.wallet, self.card_router, self)
+        dialog.wallet_changed.connect(self.reload_cards)
+        dialog.exec()
+
+    def reload_cards(self):
+        self.card_router.reload(wallet_cards(self.wallet, ENV_CARD_MAX_PER_HOUR, ENV_CARD_MAX_CONCURRENT))
+
+    def reload_settings(self):
+        try:
+            changed = self.settings.reload(raise_errors=True)
+        except SettingsError as e:
+            qtw.QMessageBox.warning(self, "Settings", f"{e}\n\nThe current settings are kept.")
+            return
+        if not changed:
+            self.statusbar.showMessage("Settings unchanged", 5000)
+
+    def apply_settings(self, settings, changed):
+        if changed & {"url", "timeout", "step_timeouts"}:
+            self.plan = purchase_plan(settings)
+        self.probe.url = settings.url
+        self.drainer.concurrency = settings.offline_concurrency
+        self.statusbar.showMessage(f"Settings applied: {', '.join(sorted(changed))}", 5000)
+
+    def stop_profiling(self):
+        if self.profiler:
+            self.profiler.stop()
+            self.profiler = None
+
+    def show_offline_queue(self, pending):
+        self.lb_offlineQueue.setText(f"Queued: {pending}" if pending else "")
+
+    def replay_purchase(self, meter_number, amount, confirm):
+        """
+        Runs a queued purchase in the background. Called from the drainer thread.
+        :param confirm: (bool) Ask the user before the payment is submitted, as the original purchase did
+        """
+        def purchase():
+            try:
+                lease = self.card_router.acquire(amount, timeout=PORTAL_PROBE_INTERVAL)
+            except NoCardAvailableError as e:
+                # nothing was entered on the portal, so the drainer may try again later
+                return PurchaseResult(meter_number, amount, STATUS_ERROR, str(e), STAGE_SETUP)
+            result = None
+            settings = self.settings.current
+            try:
+                result = purchase_in_new_session(meter_number, amount, lease.card,
+                                                 headless=settings.headless,
+                                                 confirm=self.confirm_replay if confirm else None,
+                                                 customer_cache=self.customer_cache,
+                                                 logger=self.logger, plan=self.plan, governor=self.governor,
+                                                 artifacts=self.artifacts, **settings.automator_options())
+                self.receipts.submit(Receipt.from_result(result))
+                return result
+            finally:
+                self.card_router.release(lease, result)
+
+        return self.coordinator.run(meter_number, amount, purchase)
+
+    def confirm_replay(self, customer_name, meter_number, amount):
+        """Asks for confirmation on the GUI thread and waits for the answer. Called from the drainer thread."""
+        request = {"details": (customer_name, meter_number, amount), "confirmed": False, "done": threading.Event()}
+        with self.replay_confirmation_lock:
+            self.replay_confirmation_requested.emit(request)
+            while not request["done"].wait(1):
+                if self.closing.is_set():
+                    return False
+        return request["confirmed"]
+
+    def ask_replay_confirmation(self, request):
+        try:
+            self.statusbar.showMessage("Portal available again, confirm the queued purchase")
+            request["confirmed"] = self.confirm_purchase(*request["details"])
+        finally:
+            self.statusbar.clearMessage()
+            request["done"].set()
+
+    def share_receipt(self):
+        if not self.receipt:
+            return
+        recipient, ok = qtw.QInputDialog.getText(self, "Share Receipt", "Phone number or email address:",
+                                                 text=RECEIPT_RECIPIENT or "")
+        recipient = recipient.strip()
+        if ok and recipient:
+            self.receipts.submit(self.receipt, recipient)
+            self.statusbar.showMessage(f"Receipt queued for {recipient}", 5000)
+
+    def show_cached_customer(self, meter_number):
+        customer_name = self.customer_cache.get_full_name(meter_number.strip())
+        if customer_name:
+            self.lb_message.setText(f"Customer: {customer_name}")
+        else:
+            self.lb_message.clear()
+
     def validate_input(self):
         meter_input = self.le_meterNo
         amount_input = self.le_amount
@@ -73,9 +281,8 @@ class MainWindow(qtw.QMainWindow, Ui_MainWindow):
             amount_input.selectAll()
             return
 
-        valid, msg = validate.cc_details(CC_NAME, CC_NUMBER, CC_CODE, CC_EXP_MONTH, CC_EXP_YEAR)
-        if not valid:
-            msg_display.setText(msg)
+        if not self.card_router.has_cards():
+            msg_display.setText("No payment card. Add one under Tools > Wallet or set the CC environment variables")
             return
 
         self.start_purchase()
@@ -87,77 +294,81 @@ class MainWindow(qtw.QMainWindow, Ui_MainWindow):
         self.statusbar.showMessage("Input cleared", timeout=5000)
 
     def start_purchase(self):
+        meter_number = self.le_meterNo.text().strip()
+        amount = float(self.le_amount.text())
+
+        # a double-click or repeated Enter must not start a second browser for the same purchase
+        job, created = self.coordinator.submit(meter_number, amount)
+        if not created:
+            self.statusbar.showMessage(f"Purchase for meter {meter_number} already in progress", 5000)
+            return
+
+        self.receipt = None
+        self.pb_shareReceipt.setVisible(False)
+
+        if self.action_profile.isChecked():
+            self.profiler = ProfileSession(PROFILE_DIR, label=f"purchase-{meter_number}",
+                                           logger=self.logger).start()
+
+        settings = self.settings.current
         self.thread = qtc.QThread()
-        self.worker = SetupWorker(url=URL, logger=self.logger)
+        self.worker = SetupWorker(plan=self.plan, logger=self.logger, governor=self.governor, record_dir=RECORD_DIR,
+                                  profiler=self.profiler, job=job, artifacts=self.artifacts,
+                                  headless=settings.gui_headless, automator_options=settings.automator_options(),
+                                  card_router=self.card_router, card_timeout=CARD_WAIT_TIMEOUT)
         self.worker.moveToThread(self.thread)
 
         self.thread.started.connect(self.worker.run)
         self.worker.finished.connect(self.setup_complete)
         self.worker.error.connect(self.handle_error)
+        self.worker.failed.connect(self.setup_failed)
+        self.worker.no_card.connect(self.no_card_available)
 
         self.worker.finished.connect(self.thread.quit)
         self.worker.finished.connect(self.worker.deleteLater)
+        self.worker.failed.connect(self.thread.quit)
+        self.worker.failed.connect(self.worker.deleteLater)
+        self.worker.no_card.connect(self.thread.quit)
+        self.worker.no_card.connect(self.worker.deleteLater)
         self.thread.finished.connect(self.thread.deleteLater)
 
         self.thread.start()
 
-    def setup_complete(self, automator):
-        self.automator = automator
-        self.statusbar.clearMessage()
-        self.logger.info("WebDriver Setup Complete")
-
-        meter_number = self.le_meterNo.text()
-        amount_str = self.le_amount.text()
-        msg_display = self.lb_message
-
-        # Entering payment details
-        self.statusbar.showMessage("Entering payment details")
-        if not self.automator.enter_payment_details(
-            meter_number, CC_NUMBER, CC_NAME, CC_CODE, int(CC_EXP_MONTH), int(CC_EXP_YEAR)
-        ):
-            msg_display.setText("Error entering payment details")
-            self.automator.close()
-            return
-
-        # click Next button
-        if not self.automator.click_next_button():
-            msg_display.setText("Error clicking next button")
-            self.automator.close()
+    def setup_failed(self, job, page_unavailable):
+        if not page_unavailable:
+            # the browser or driver did not start; a replay would fail the same way
+            self.coordinator.fail(job, RuntimeError("WebDriver setup failed"))
+            self.lb_message.setText("Unable to start the browser. Check the browser settings and try again.")
             return
-
-        # check for invalid meter number message
-        self.logger.info("Checking meter number")
-        invalid_meter = self.automator.check_meter_message()
-        if invalid_meter:
-            self.statusbar.clearMessage()
-            msg_display.setText(invalid_meter)
-            self.automator.close()
-            return
-
-        # Enter payment amount
-        amount = float(amount_str)
-        self.logger.info("Entering payment amount")
-        if not self.automator.enter_purchase_amount(amount):
-            msg_display.setText("Unable to continue with payment. Check meter number.")
-            self.automator.close()
-            return
-
-        # get customer name and display at successful payment
-        customer_name = self.automator.get_customer_name()
-        # self.lb_token.setText(f"Customer Name: {customer_name}")
-
-        # click Next button
-        if not self.automator.click_next_button():
-            msg_display.setText("Error clicking next button")
-            self.automator.close()
-            return
-
-        # Confirm Payment Popup
-        status, submit = self.automator.load_payment_popup()
-        if not status:
-            self.logger.error("Error with payment confirmation popup")
-            return
-
+        self.coordinator.fail(job, RuntimeError("Payment page unavailable"))
+
+        # nothing was entered on the portal yet, so the purchase is safe to replay later
+        self.offline_queue.enqueue(job.meter, job.amount, confirm=True)
+        self.drainer.refresh()
+        self.lb_message.setText("Payment page unavailable. Purchase queued and will be retried automatically.")
+
+    def no_card_available(self, job, message):
+        self.coordinator.fail(job, NoCardAvailableError(message))
+        self.stop_profiling()
+        self.lb_message.setText(message)
+
+    def setup_complete(self, automator, job, lease):
+        result = None
+        try:
+            if not self.profiler:
+                result = self.complete_purchase(automator, job, lease)
+                return
+            try:
+                with self.profiler.profile_thread():
+                    result = self.complete_purchase(automator, job, lease)
+            finally:
+                self.stop_profiling()
+        finally:
+            self.card_router.release(lease, result)
+            automator.close()
+            self.coordinator.complete(job, result)
+
+    def confirm_purchase(self, customer_name, meter_number, amount):
         # confirm meter and amount
         self.msg_box = qtw.QMessageBox()
         self.msg_box.setTextFormat(qtc.Qt.RichText)
@@ -169,24 +380,37 @@ class MainWindow(qtw.QMainWindow, Ui_MainWindow):
             f"<br>Amount: <span style=\"font-weight:bold;color:#1E90FF;\">${amount:.2f}</span>")
         self.msg_box.setStandardButtons(qtw.QMessageBox.Yes | qtw.QMessageBox.Abort)
         response = self.msg_box.exec()
+        return response != qtw.QMessageBox.Abort
 
-        if response == qtw.QMessageBox.Abort:
-            msg_display.setText("Payment aborted.")
-            self.automator.close()
-            return
+    def complete_purchase(self, automator, job, lease):
+        self.automator = automator
+        self.statusbar.clearMessage()
+        self.logger.info("WebDriver Setup Complete")
 
-        if not self.automator.confirm_payment(submit):
-            msg_display.setText("Payment submission failed.")
-            # self.automator.close()
-            return
+        msg_display = self.lb_message
 
-        payment_status, msg = self.automator.get_token_or_error()
+        self.statusbar.showMessage("Entering payment details")
+        # the profile leaves out the time the confirmation dialog is open
+        confirm = self.profiler.unprofiled(self.confirm_purchase) if self.profiler else self.confirm_purchase
+        result = run_purchase(self.automator, job.meter, job.amount, lease.card,
+                              confirm=confirm, customer_cache=self.customer_cache,
+                              logger=self.logger, plan=self.plan)
+
+        if result.stage != STAGE_RESULT:
+            if result.stage == STAGE_METER:
+                self.statusbar.clearMessage()
+            msg_display.setText(result.message)
+            return result
+
+        customer_name = result.customer_name
+        meter_number = result.meter
+        msg = result.message
 
         # =========== Message display formatting ===========
         stat_color = "rgb(34, 139, 34)" # default to 'Success' color --> ForestGreen
         # ================= End ============================
 
-        if not payment_status:
+        if not result.success:
             stat_color = "rgb(255, 62, 65)"
             self.statusbar.clearMessage()
             self.statusbar.showMessage(msg)
@@ -196,25 +420,43 @@ class MainWindow(qtw.QMainWindow, Ui_MainWindow):
                 f"Meter No.:</span> <span style=\"font-weight:bold;\">{meter_number}</span>"
                 f"<br><br><span style=\"font-weight:bold;color:{stat_color};font-size:18px;\">*** {msg} ***</span>"
                 f"<br>")
-            self.automator.close()
-            return
+            return result
 
-        if payment_status:
-            self.lb_token.setText(
-                f"<span style=\"color:{stat_color};font-weight:bold;font-size:18px;\">Payment Successful!!!</span><br><br>"
-                f"<span>Customer Name:</span> <span style=\"font-weight:bold;\">{customer_name}</span><br><span>"
-                f"Meter No.:</span> <span style=\"font-weight:bold;\">{meter_number}</span>"
-                f"<br><br><span style=\"font-weight:bold;color:{stat_color};font-size:18px;\">*** {msg} ***</span>"
-                f"<br>")
+        self.lb_token.setText(
+            f"<span style=\"color:{stat_color};font-weight:bold;font-size:18px;\">Payment Successful!!!</span><br><br>"
+            f"<span>Customer Name:</span> <span style=\"font-weight:bold;\">{customer_name}</span><br><span>"
+            f"Meter No.:</span> <span style=\"font-weight:bold;\">{meter_number}</span>"
+            f"<br><br><span style=\"font-weight:bold;color:{stat_color};font-size:18px;\">*** {msg} ***</span>"
+            f"<br>")
 
-        self.lb_message.setText("Process completed")
-        self.automator.close()
-        return
+        self.receipt = Receipt.from_result(result)
+        self.receipts.submit(self.receipt)
+        self.pb_shareReceipt.setVisible(True)
 
+        self.lb_message.setText("Process completed")
+        return result
+
+    def closeEvent(self, event):
+        # kill any browser still running so no chromedriver is left behind
+        self.settings.stop()
+        # a replay waiting for a confirmation gives up
+        self.closing.set()
+        self.drainer.stop()
+        self.artifacts.close()
+        self.governor.shutdown()
+        self.receipts.close()
+        self.customer_cache.close()
+        self.offline_queue.close()
+        self.card_router.close()
+        super().closeEvent(event)
 
 
 if __name__ == '__main__':
     app = qtw.QApplication(sys.argv)
-    window = MainWindow()
+    try:
+        window = MainWindow(profile=PROFILE_ENABLED or "--profile" in sys.argv)
+    except ReceiptError as e:
+        qtw.QMessageBox.critical(None, "Receipts", str(e))
+        sys.exit(2)
     window.show()
     sys.exit(app.exec())
\ No newline at end of file
@@ -0,0 +1,57 @@
+# src.model.card
+
+import os
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Card:
+    """Payment card used to pay for a purchase."""
+    number: str
+    name: str
+    code: str
+    exp_month: int
+    exp_year: int
+
+    @classmethod
+    def from_env(cls):
+        """
+        Builds the card from the CC_* environment variables, read when called.
+        :return: (Card) or None if any variable is missing or invalid
+        """
+        values = [os.getenv(name) for name in ("CC_NUMBER", "CC_NAME", "CC_CODE", "CC_EXP_MONTH", "CC_EXP_YEAR")]
+        if not all(values):
+            return None
+        number, name, code, exp_month, exp_year = values
+        try:
+            return cls(number, name, code, int(exp_month), int(exp_year))
+        except ValueError:
+            return None
+
+    @property
+    def last4(self) -> str:
+        return self.number[-4:]
+
+    def __repr__(self):
+        # never print the full card number or code
+        return f"Card(****{self.last4}, {self.exp_month:02d}/{self.exp_year})"
+
+
+@dataclass
+class WalletCard:
+    """
+    A card stored in the wallet, with the limits the card router keeps it under.
+    A limit of None means no limit.
+    """
+    id: str
+    card: Card
+    label: str = ""
+    max_per_hour: int = None
+    max_amount: float = None
+    max_daily_amount: float = None
+    max_concurrent: int = 1
+    enabled: bool = True
+
+    @property
+    def display_name(self) -> str:
+        return f"{self.label or self.card.name} ****{self.card.last4}"
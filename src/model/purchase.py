@@ -0,0 +1,61 @@
+# src.model.purchase
+
+from dataclasses import dataclass
+
+
+# purchase flow stages, in order
+STAGE_SETUP = "setup"
+STAGE_DETAILS = "details"
+STAGE_METER = "meter"
+STAGE_AMOUNT = "amount"
+STAGE_CONFIRM = "confirm"
+STAGE_SUBMITTED = "submitted"
+STAGE_RESULT = "result"
+
+# purchase outcomes
+STATUS_SUCCESS = "success"
+STATUS_FAILED = "failed"
+STATUS_ERROR = "error"
+STATUS_ABORTED = "aborted"
+STATUS_UNKNOWN = "unknown"
+
+# result page error details meaning the card issuer refused the payment, not the portal or the meter
+ISSUER_DECLINE_MARKERS = ("declined", "insufficient funds", "do not honor", "expired card", "card expired",
+                          "invalid card", "restricted card", "lost card", "stolen card", "pick up card")
+
+
+@dataclass
+class PurchaseResult:
+    """
+    Outcome of a purchase.
+    message holds the token on success, otherwise a user facing error message.
+    stage is the last stage the flow reached; once it is STAGE_SUBMITTED or later the payment
+    may have gone through and the purchase must never be retried automatically.
+    """
+    meter: str
+    amount: float
+    status: str
+    message: str
+    stage: str
+    customer_name: str = None
+    purchase_id: str = None
+
+    @property
+    def success(self) -> bool:
+        return self.status == STATUS_SUCCESS
+
+    @property
+    def token(self):
+        return self.message if self.success else None
+
+    @property
+    def submitted(self) -> bool:
+        return self.stage in (STAGE_SUBMITTED, STAGE_RESULT)
+
+    @property
+    def declined(self) -> bool:
+        """Whether the card issuer refused the payment; other failures say nothing about the card."""
+        if self.status != STATUS_FAILED or self.stage != STAGE_RESULT:
+            return False
+        message = (self.message or "").lower()
+        return any(marker in message for marker in ISSUER_DECLINE_MARKERS)
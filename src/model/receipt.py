@@ -0,0 +1,52 @@
+# src.model.receipt
+
+from dataclasses import asdict, dataclass
+from datetime import datetime
+
+
+@dataclass(frozen=True)
+class Receipt:
+    """Receipt for a successful purchase, built from its PurchaseResult."""
+    purchase_id: str
+    meter: str
+    amount: float
+    token: str
+    customer_name: str
+    issued_at: datetime
+
+    @classmethod
+    def from_result(cls, result, issued_at: datetime = None):
+        """
+        :param result: (PurchaseResult)
+        :return: (Receipt) or None if the purchase did not succeed
+        """
+        if not result.success:
+            return None
+        return cls(result.purchase_id or "", result.meter, result.amount, result.token,
+                   result.customer_name or "", issued_at or datetime.now())
+
+    @property
+    def name(self) -> str:
+        """File name stem, unique per purchase."""
+        return f"{self.issued_at:%Y%m%d-%H%M%S}-{self.meter}-{(self.purchase_id or 'receipt')[:8]}"
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["issued_at"] = self.issued_at.isoformat(timespec="seconds")
+        return data
+
+
+@dataclass(frozen=True)
+class OutboxMessage:
+    """A receipt addressed to a phone number (sms) or an email address (email)."""
+    recipient: str
+    channel: str
+    subject: str
+    body: str
+    attachments: tuple = ()
+    purchase_id: str = ""
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["attachments"] = list(self.attachments)
+        return data
@@ -0,0 +1,48 @@
+# src.model.settings
+
+from dataclasses import dataclass, field
+
+from static.constants import URL
+
+
+BROWSERS = ("auto", "chrome", "edge")
+ENGINES = ("selenium", "async")
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    Runtime settings, see service.settings.SettingsStore.
+    An instance is never changed; a reload replaces it as a whole, so whoever holds one reads a
+    consistent set. Field metadata (choices, min) drives validation.
+    """
+    # payment portal start page
+    url: str = URL
+    # "auto" tries Chrome, then Edge
+    browser: str = field(default="auto", metadata={"choices": BROWSERS})
+    # background sessions: daemon, CLI and queued replays
+    headless: bool = True
+    # the GUI's interactive purchase
+    gui_headless: bool = False
+    # no images, extensions or background networking in the browser
+    lean_profile: bool = False
+    # Chrome for the async engine, looked up on PATH when not set
+    chrome_path: str = None
+    # seconds a step waits for an element to be clickable or visible
+    timeout: float = field(default=10.0, metadata={"min": 0.5})
+    # seconds to wait for a page's key element, e.g. after loading the payment page
+    element_timeout: float = field(default=4.0, metadata={"min": 0.5})
+    # {plan step name: seconds}, overrides timeout for those steps
+    step_timeouts: dict = field(default_factory=dict, metadata={"min": 0.5})
+    # daemon workers and warm sessions
+    pool_size: int = field(default=2, metadata={"min": 1})
+    # CLI batch purchases running at the same time, and its engine
+    batch_workers: int = field(default=2, metadata={"min": 1})
+    engine: str = field(default="selenium", metadata={"choices": ENGINES})
+    # queued purchases replayed at the same time once the portal is back
+    offline_concurrency: int = field(default=2, metadata={"min": 1})
+
+    def automator_options(self) -> dict:
+        """:return: (dict) BrowserAutomator keyword arguments"""
+        return {"browser": self.browser, "lean_profile": self.lean_profile, "timeout": self.timeout,
+                "element_timeout": self.element_timeout}
@@ -0,0 +1,242 @@
+# src.service.artifact_store
+
+import base64
+import glob
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+import zipfile
+from datetime import datetime
+
+from .metrics import metrics
+
+
+REDACTED = "[REDACTED]"
+
+# one round-trip: returns [url, page source], then blanks the inputs given as [By, value] locators,
+# keeping their values in the page for RESTORE_INPUTS_JS
+SNAPSHOT_PAGE_JS = (
+    "const snapshot = [location.href, document.documentElement.outerHTML];"
+    "window.__blankedInputs = [];"
+    "for (const [by, value] of arguments[0]) {"
+    " const els = by === 'xpath' ? [document.evaluate(value, document, null, 9, null).singleNodeValue]"
+    "  : document.querySelectorAll(by === 'id' ? '[id^=\"' + value + '\"]'"
+    "   : by === 'name' ? '[name=\"' + value + '\"]' : value);"
+    " for (const el of els) {"
+    "  if (el && 'value' in el) { window.__blankedInputs.push([el, el.value]); el.value = ''; }"
+    " }"
+    "}"
+    "return snapshot;"
+)
+# puts back the values SNAPSHOT_PAGE_JS blanked, so the session is left as the purchase left it
+RESTORE_INPUTS_JS = (
+    "for (const [el, value] of window.__blankedInputs || []) el.value = value;"
+    "delete window.__blankedInputs;"
+)
+
+
+class Capture:
+    """
+    A failure capture waiting for the writer thread. The session must be neither navigated nor
+    quit before it is done: wait() for it, or hand the quit to then().
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._released = False
+        self._callbacks = []
+        self._done = threading.Event()
+
+    def wait(self, timeout: float = None) -> bool:
+        """:return: (bool) True when the capture is done with the driver"""
+        return self._done.wait(timeout)
+
+    def then(self, callback):
+        """Calls callback once the capture is done with the driver, right away when it already is."""
+        with self._lock:
+            if not self._released:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def _release(self, logger):
+        with self._lock:
+            self._released = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Error after failure capture: {e}")
+        # set last, so a waiter never sees the driver before the callbacks are through with it
+        self._done.set()
+
+
+class FailureArtifactStore:
+    """
+    Bounded on-disk ring buffer of failure artifacts.
+    A failure is queued with the driver, and the page source, screenshot (card inputs blanked,
+    then restored) and browser console log are grabbed from it on a background thread, which
+    also redacts, compresses and writes them, so the failing purchase makes no round-trip and
+    can clean up right away. Until the grab is done the session is not navigated or quit (see
+    Capture). The buffer is capped by count and by total size (oldest archives are deleted
+    first), captures are rate limited, and captures are skipped rather than queued when the
+    writer falls behind during a mass failure.
+    """
+    def __init__(self, directory: str, max_count: int = 200, max_bytes: int = 200 * 1024 * 1024,
+                 max_per_minute: int = 20, queue_size: int = 8, min_free_bytes: int = 500 * 1024 * 1024,
+                 logger=None):
+        self.directory = directory
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.max_per_minute = max_per_minute
+        self.min_free_bytes = min_free_bytes
+        self.logger = logger or logging.getLogger("INFO Logger")
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._recent = []
+        self._closed = False
+        self._thread = threading.Thread(target=self._write_loop, name="FailureArtifactStore", daemon=True)
+        self._thread.start()
+
+    def capture(self, driver, purchase_id: str, step: str, secrets=(), inputs=()):
+        """
+        Queues a capture of the driver's current page for the writer thread.
+        :param driver: (WebDriver) Driver of the failing session
+        :param purchase_id: (str) Purchase the artifacts are indexed by
+        :param step: (str) Automation step that failed
+        :param secrets: (iterable) Card values to redact
+        :param inputs: (iterable) Locators of the inputs holding them, blanked for the screenshot
+        :return: (Capture) None when the capture was skipped
+        """
+        if not driver or self._closed:
+            return None
+        if self._queue.full():
+            metrics.incr("artifacts.dropped")
+            return None
+        if not self._allow():
+            metrics.incr("artifacts.skipped")
+            return None
+
+        capture = Capture()
+        artifacts = {"purchase_id": purchase_id, "step": step, "time": time.time(), "secrets": list(secrets),
+                     "driver": driver, "inputs": [list(locator) for locator in inputs], "capture": capture}
+        try:
+            self._queue.put_nowait(artifacts)
+            return capture
+        except queue.Full:
+            metrics.incr("artifacts.dropped")
+            return None
+
+    def _allow(self) -> bool:
+        """Rate limits captures so a mass failure cannot flood the writer."""
+        now = time.time()
+        with self._lock:
+            self._recent = [t for t in self._recent if now - t < 60]
+            if len(self._recent) >= self.max_per_minute:
+                return False
+            self._recent.append(now)
+            return True
+
+    def find(self, purchase_id: str):
+        """Returns the archives captured for a purchase, oldest first."""
+        return sorted(glob.glob(os.path.join(self.directory, f"*-{purchase_id}-*.zip")))
+
+    # ------------------------- writer thread -------------------------
+
+    def _write_loop(self):
+        while True:
+            artifacts = self._queue.get()
+            if artifacts is None:
+                return
+            capture = artifacts.pop("capture")
+            try:
+                self._grab(artifacts, artifacts.pop("driver"), artifacts.pop("inputs"))
+            finally:
+                capture._release(self.logger)
+            try:
+                self._write(artifacts)
+                self._enforce_bounds()
+            except Exception as e:
+                self.logger.warning(f"Unable to save failure artifacts: {e}")
+
+    def _grab(self, artifacts, driver, inputs):
+        """Reads the page, screenshot and console log as raw blobs; nothing when the driver no longer answers."""
+        artifacts["console"] = []
+        try:
+            artifacts["url"], artifacts["page_source"] = driver.execute_script(SNAPSHOT_PAGE_JS, inputs)
+        except Exception as e:
+            # the session is gone; a screenshot or log request would only wait out its timeout
+            self.logger.debug(f"Failure capture skipped, driver not responding: {e}")
+            return
+        try:
+            artifacts["screenshot"] = driver.get_screenshot_as_base64()
+        except Exception as e:
+            self.logger.debug(f"Partial failure capture: {e}")
+        try:
+            driver.execute_script(RESTORE_INPUTS_JS)
+            artifacts["console"] = driver.get_log("browser")
+        except Exception as e:
+            self.logger.debug(f"Partial failure capture: {e}")
+
+    def close(self, timeout: float = 10):
+        """Lets the writer finish the captures already queued, waiting up to timeout seconds."""
+        self._closed = True
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def _redact(self, text: str, secrets) -> str:
+        for secret in sorted(secrets, key=len, reverse=True):
+            if secret and len(secret) >= 3:
+                text = text.replace(secret, REDACTED)
+        return text
+
+    def _write(self, artifacts):
+        os.makedirs(self.directory, exist_ok=True)
+        if shutil.disk_usage(self.directory).free < self.min_free_bytes:
+            metrics.incr("artifacts.dropped")
+            self.logger.warning("Low disk space, failure artifacts not saved")
+            return
+        secrets = [str(s) for s in artifacts.pop("secrets") if s]
+        stamp = datetime.fromtimestamp(artifacts["time"]).strftime("%Y%m%d-%H%M%S-%f")
+        name = f"{stamp}-{artifacts['purchase_id']}-{artifacts['step']}.zip"
+        path = os.path.join(self.directory, name)
+
+        console = [
+            {**entry, "message": self._redact(str(entry.get("message", "")), secrets)}
+            for entry in artifacts.get("console", [])
+        ]
+        meta = {key: artifacts.get(key) for key in ("purchase_id", "step", "time")}
+        meta["url"] = self._redact(artifacts.get("url") or "", secrets)
+
+        # write to a temporary name so a half-written archive is never picked up
+        with zipfile.ZipFile(path + ".tmp", "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("meta.json", json.dumps(meta, indent=1))
+            archive.writestr("console.json", json.dumps(console, indent=1))
+            if artifacts.get("page_source"):
+                archive.writestr("page.html", self._redact(artifacts["page_source"], secrets))
+            if artifacts.get("screenshot"):
+                archive.writestr("screenshot.png", base64.b64decode(artifacts["screenshot"]),
+                                 compress_type=zipfile.ZIP_STORED)
+        os.replace(path + ".tmp", path)
+        metrics.incr("artifacts.saved")
+        self.logger.info(f"Failure artifacts saved: {name}")
+
+    def _enforce_bounds(self):
+        archives = sorted(glob.glob(os.path.join(self.directory, "*.zip")))
+        sizes = {path: os.path.getsize(path) for path in archives}
+        total = sum(sizes.values())
+        while archives and (len(archives) > self.max_count or total > self.max_bytes):
+            oldest = archives.pop(0)
+            total -= sizes[oldest]
+            try:
+                os.remove(oldest)
+            except OSError:
+                pass
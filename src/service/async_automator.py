@@ -0,0 +1,612 @@
+# src.service.async_automator
+
+import asyncio
+import functools
+import itertools
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+
+from selenium.webdriver.common.by import By
+from websockets.asyncio.client import connect
+
+from model.purchase import PurchaseResult, STAGE_SETUP, STAGE_SUBMITTED, STATUS_ERROR
+from .card_router import NoCardAvailableError
+from .flow_plan import DETAIL_TIMEOUT, MONTHS, StepFailed, execute_plan_async
+from .metrics import metrics
+from .plans import DEFAULT_PLAN, PLANS
+
+
+CHROME_NAMES = ("google-chrome", "google-chrome-stable", "chromium", "chromium-browser", "chrome")
+CHROME_ARGS = (
+    "--remote-debugging-port=0",
+    "--no-first-run",
+    "--no-default-browser-check",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-sync",
+    "--disable-dev-shm-usage",
+)
+# lean_profile: the rest of BrowserAutomator's lean profile that CHROME_ARGS does not already cover
+LEAN_PROFILE_ARGS = (
+    "--blink-settings=imagesEnabled=false",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--mute-audio",
+)
+
+# resolves with the condition's value as soon as it is truthy, re-checking on DOM mutations
+# instead of polling; resolves null after the timeout
+WAIT_JS = """
+(condition, timeout) => new Promise(resolve => {
+    const check = () => { try { return condition(); } catch (e) { return null; } };
+    const value = check();
+    if (value) { resolve(value); return; }
+    const observer = new MutationObserver(() => {
+        const value = check();
+        if (value) { observer.disconnect(); clearTimeout(timer); resolve(value); }
+    });
+    observer.observe(document, {subtree: true, childList: true, attributes: true, characterData: true});
+    const timer = setTimeout(() => { observer.disconnect(); resolve(check() || null); }, timeout);
+})
+"""
+VISIBLE_JS = ("(el => el && el.getClientRects().length > 0"
+              " && getComputedStyle(el).visibility !== 'hidden' ? el : null)")
+CLICKABLE_JS = f"(el => {VISIBLE_JS}(el) && !el.disabled ? el : null)"
+
+# CDP errors raised while a postback replaces the page; the wait is retried on the new page
+NAVIGATION_ERRORS = ("Execution context was destroyed", "Cannot find default execution context",
+                     "Inspected target navigated or closed", "Cannot find context with specified id")
+
+
+class CdpError(Exception):
+    """Raised when a DevTools command fails."""
+
+
+class WaitTimeout(Exception):
+    """Raised when an element does not reach the expected state in time."""
+
+
+def find_js(locator) -> str:
+    """JS expression that evaluates to the element for a (By, value) locator, or null."""
+    by, value = locator
+    if by == By.ID:
+        return f"document.getElementById({json.dumps(value)})"
+    if by == By.XPATH:
+        return f"document.evaluate({json.dumps(value)}, document, null, 9, null).singleNodeValue"
+    if by == By.CSS_SELECTOR:
+        return f"document.querySelector({json.dumps(value)})"
+    raise ValueError(f"Unsupported locator {locator!r}")
+
+
+def find_chrome():
+    for name in CHROME_NAMES:
+        path = shutil.which(name)
+        if path:
+            return path
+    raise RuntimeError(f"Chrome not found on PATH (looked for {', '.join(CHROME_NAMES)}). "
+                       "Set the chrome_path setting")
+
+
+class CdpConnection:
+    """
+    One DevTools websocket to a browser. Every page session is multiplexed over it
+    (flattened sessions), so many sessions cost one connection and one reader task.
+    """
+    def __init__(self, websocket):
+        self._ws = websocket
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._listeners = defaultdict(list)
+        self._reader = asyncio.create_task(self._read())
+
+    @classmethod
+    async def connect(cls, url: str):
+        return cls(await connect(url, max_size=None, ping_interval=None))
+
+    async def send(self, method: str, params: dict = None, session_id: str = None, timeout: float = 30):
+        message_id = next(self._ids)
+        message = {"id": message_id, "method": method, "params": params or {}}
+        if session_id:
+            message["sessionId"] = session_id
+        future = asyncio.get_running_loop().create_future()
+        self._pending[message_id] = future
+        try:
+            await self._ws.send(json.dumps(message))
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(message_id, None)
+
+    def event(self, method: str, session_id: str = None) -> asyncio.Future:
+        """Returns a future for the next event of this type on the session."""
+        future = asyncio.get_running_loop().create_future()
+        self._listeners[(session_id, method)].append(future)
+        return future
+
+    async def _read(self):
+        try:
+            async for raw in self._ws:
+                message = json.loads(raw)
+                if "id" in message:
+                    future = self._pending.get(message["id"])
+                    if not future or future.done():
+                        continue
+                    if "error" in message:
+                        future.set_exception(CdpError(message["error"].get("message", "CDP error")))
+                    else:
+                        future.set_result(message.get("result", {}))
+                else:
+                    for future in self._listeners.pop((message.get("sessionId"), message.get("method")), []):
+                        if not future.done():
+                            future.set_result(message.get("params", {}))
+        except Exception:
+            pass
+        finally:
+            for future in list(self._pending.values()) + [f for fs in self._listeners.values() for f in fs]:
+                if not future.done():
+                    future.set_exception(CdpError("DevTools connection closed"))
+
+    async def close(self):
+        await self._ws.close()
+        await self._reader
+
+
+class AsyncBrowser:
+    """
+    A Chrome process driven over the DevTools protocol from one asyncio event loop.
+    Each purchase gets its own page in its own browser context (separate cookies and
+    storage), so one browser process serves many concurrent sessions.
+    """
+    def __init__(self, headless: bool = True, chrome_path: str = None, governor=None, lean_profile: bool = False,
+                 logger=None):
+        self.headless = headless
+        self.lean_profile = lean_profile
+        self.chrome_path = chrome_path
+        self.governor = governor
+        self.logger = logger or logging.getLogger("INFO Logger")
+        self.process = None
+        self.connection = None
+        self._profile_dir = None
+
+    @property
+    def browser_pid(self):
+        return self.process.pid if self.process else None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def start(self, timeout: float = 30):
+        self._profile_dir = tempfile.mkdtemp(prefix="uta-chrome-")
+        args = [self.chrome_path or find_chrome(), f"--user-data-dir={self._profile_dir}", *CHROME_ARGS]
+        if self.headless:
+            args += ["--headless=new", "--disable-gpu"]
+        if self.lean_profile:
+            args += LEAN_PROFILE_ARGS
+        args.append("about:blank")
+        self.process = await asyncio.create_subprocess_exec(
+            *args, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+
+        # Chrome writes the port it picked and the browser websocket path once it is listening
+        port_file = os.path.join(self._profile_dir, "DevToolsActivePort")
+        deadline = time.monotonic() + timeout
+        while not os.path.exists(port_file) or os.path.getsize(port_file) == 0:
+            if self.process.returncode is not None or time.monotonic() > deadline:
+                await self.close()
+                raise RuntimeError("Chrome did not start")
+            await asyncio.sleep(0.1)
+        with open(port_file) as f:
+            port, path = f.read().split()[:2]
+
+        self.connection = await CdpConnection.connect(f"ws://127.0.0.1:{port}{path}")
+        if self.governor:
+            self.governor.register(self)
+        self.logger.info("Chrome started for asyncio sessions")
+
+    async def new_session(self, url: str, **automator_options):
+        """
+        Opens a page in a fresh browser context.
+        :return: (AsyncBrowserAutomator)
+        """
+        context = await self.connection.send("Target.createBrowserContext", {"disposeOnDetach": True})
+        target = await self.connection.send(
+            "Target.createTarget", {"url": "about:blank", "browserContextId": context["browserContextId"]})
+        attached = await self.connection.send("Target.attachToTarget", {"targetId": target["targetId"], "flatten": True})
+        automator = AsyncBrowserAutomator(self, url, attached["sessionId"], target["targetId"],
+                                          context["browserContextId"], logger=self.logger, **automator_options)
+        await automator.send("Page.enable")
+        await automator.send("Runtime.enable")
+        return automator
+
+    async def close(self):
+        if self.connection:
+            try:
+                await self.connection.send("Browser.close", timeout=5)
+            except Exception:
+                pass
+            await self.connection.close()
+            self.connection = None
+        if self.process and self.process.returncode is None:
+            self.process.terminate()
+            try:
+                await asyncio.wait_for(self.process.wait(), 10)
+            except asyncio.TimeoutError:
+                self.process.kill()
+        if self.governor:
+            self.governor.unregister(self)
+        if self._profile_dir:
+            shutil.rmtree(self._profile_dir, ignore_errors=True)
+            self._profile_dir = None
+
+
+def async_automation_step(name):
+    """Coroutine counterpart of browser_automator.automation_step: records the step latency."""
+    def decorator(method):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await method(self, *args, **kwargs)
+            finally:
+                metrics.observe(f"step.{name}", time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+class AsyncBrowserAutomator:
+    """
+    Coroutine counterpart of BrowserAutomator for one page of an AsyncBrowser.
+    Waits are promises in the page that resolve on DOM mutations, so a waiting session costs
+    no thread and no polling round-trips. The purchase steps are run on it by AsyncPlanEngine.
+    """
+    def __init__(self, browser, url: str, session_id: str, target_id: str, context_id: str, logger=None,
+                 timeout: float = 10):
+        self.browser = browser
+        self.url = url
+        self.session_id = session_id
+        self.target_id = target_id
+        self.context_id = context_id
+        self.logger = logger or logging.getLogger("INFO Logger")
+        self.timeout = timeout
+        self.purchase_id = None
+
+    # ------------------------- DevTools primitives -------------------------
+
+    async def send(self, method: str, params: dict = None, timeout: float = 30):
+        return await self.browser.connection.send(method, params, self.session_id, timeout)
+
+    async def evaluate(self, expression: str, await_promise: bool = False, timeout: float = 30):
+        response = await self.send("Runtime.evaluate", {
+            "expression": expression, "awaitPromise": await_promise, "returnByValue": True,
+        }, timeout=timeout)
+        if "exceptionDetails" in response:
+            details = response["exceptionDetails"]
+            raise CdpError(details.get("exception", {}).get("description") or details.get("text"))
+        return response.get("result", {}).get("value")
+
+    async def wait_for(self, condition: str, timeout: float = None):
+        """
+        Waits until the JS condition expression is truthy and returns its value.
+        Survives postbacks: if the page is replaced mid-wait, the wait resumes on the new page.
+        :raises WaitTimeout: when the condition is still falsy after the timeout
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise WaitTimeout(f"Timed out waiting for {condition[:80]}")
+            try:
+                value = await self.evaluate(f"({WAIT_JS})(() => {condition}, {int(remaining * 1000)})",
+                                            await_promise=True, timeout=remaining + 5)
+            except CdpError as e:
+                if not any(error in str(e) for error in NAVIGATION_ERRORS):
+                    raise
+                await asyncio.sleep(0.05)
+                continue
+            if value:
+                return value
+
+    async def wait_visible(self, locator, timeout: float = None):
+        return await self.wait_for(f"!!{VISIBLE_JS}({find_js(locator)})", timeout)
+
+    async def wait_clickable(self, locator, timeout: float = None):
+        return await self.wait_for(f"!!{CLICKABLE_JS}({find_js(locator)})", timeout)
+
+    async def click_element(self, locator, timeout: float = None):
+        """Waits for the element to be clickable and clicks its centre with real mouse events."""
+        await self.wait_clickable(locator, timeout)
+        x, y = await self.evaluate(
+            f"(el => {{ el.scrollIntoView({{block: 'center'}}); const r = el.getBoundingClientRect();"
+            f" return [r.left + r.width / 2, r.top + r.height / 2]; }})({find_js(locator)})")
+        for event in ("mousePressed", "mouseReleased"):
+            await self.send("Input.dispatchMouseEvent",
+                            {"type": event, "x": x, "y": y, "button": "left", "clickCount": 1})
+
+    async def send_keys_to_element(self, locator, keys, timeout: float = None):
+        """Waits for the element, clears it and types keys into it."""
+        await self.wait_clickable(locator, timeout)
+        await self.evaluate(f"(el => {{ el.focus(); el.select && el.select(); }})({find_js(locator)})")
+        await self.send("Input.insertText", {"text": str(keys)})
+
+    async def get_element_text(self, locator, timeout: float = None) -> str:
+        await self.wait_visible(locator, timeout)
+        return await self.text(locator)
+
+    async def text(self, locator) -> str:
+        """Trimmed text of the element if it is shown, otherwise an empty string."""
+        return await self.evaluate(f"(el => el ? el.innerText.trim() : '')({VISIBLE_JS}({find_js(locator)}))") or ""
+
+    async def close(self):
+        try:
+            await self.browser.connection.send("Target.disposeBrowserContext", {"browserContextId": self.context_id})
+        except Exception as e:
+            self.logger.debug(f"Error closing session: {e}")
+
+    # ------------------------- page steps -------------------------
+
+    @async_automation_step("open_site")
+    async def open_site(self, url: str = None, ready=None):
+        """Navigates the page to the URL and waits for the ready element, see BrowserAutomator.open_site."""
+        self.url = url or self.url
+        try:
+            self.logger.info("Loading payment page. Please be patient.")
+            loaded = self.browser.connection.event("Page.loadEventFired", self.session_id)
+            await self.send("Page.navigate", {"url": self.url})
+            await asyncio.wait_for(loaded, 30)
+            if ready:
+                await self.wait_visible(ready, 4)
+            self.logger.info("Payment page loaded successfully")
+            return True
+        except Exception as e:
+            self.logger.critical(f"Error: {e}")
+            return None
+
+    async def select_expiry_date(self, exp_month: int, exp_year: int, popup, picker):
+        """
+        Selects the CC expiration month and year in a date picker popup.
+        :param popup: (tuple) Locator of the button that opens the popup
+        :param picker: (ExpiryPicker) Locators of the popup
+        """
+        await self.click_element(popup)
+        await self.click_element((By.XPATH, picker.month.format(month=MONTHS[exp_month - 1])))
+
+        # page forward until the target year is in the visible range
+        years_js = (f"(() => {{ const r = document.evaluate({json.dumps(picker.years)},"
+                    f" document, null, 7, null); const years = [];"
+                    f" for (let i = 0; i < r.snapshotLength; i++) {{ const y = parseInt(r.snapshotItem(i).innerText);"
+                    f" if (!isNaN(y)) years.push(y); }} return years; }})()")
+        while True:
+            years = await self.evaluate(years_js)
+            if not years or min(years) <= exp_year <= max(years):
+                break
+            if exp_year < min(years):
+                self.logger.error("Issue navigating year elements.")
+                break
+            await self.click_element(picker.next_years)
+            await self.wait_for(f"!{json.dumps(years)}.includes(parseInt(document.evaluate("
+                                f"{json.dumps(picker.years)}, document, null, 9, null)"
+                                f".singleNodeValue?.innerText))", 4)
+
+        await self.click_element((By.XPATH, picker.year.format(year=exp_year)))
+        if picker.ok:
+            await self.click_element(picker.ok)
+
+
+class AsyncPlanEngine:
+    """Runs flow plans (see service.flow_plan) on an AsyncBrowserAutomator."""
+    def __init__(self, automator):
+        self.automator = automator
+        self.logger = automator.logger
+        self._held = None
+
+    async def open(self, url: str, ready) -> bool:
+        """Loads a plan's start page, see PlanEngine.open."""
+        return bool(await self.automator.open_site(url, ready))
+
+    async def run(self, compiled, variables: dict):
+        step = compiled.step
+        try:
+            return await getattr(self, f"_{step.action}")(compiled, variables)
+        except StepFailed:
+            raise
+        except Exception as e:
+            self.logger.error(f"Step {step.name} failed: {e}")
+            raise StepFailed()
+
+    async def after_step(self, compiled):
+        pass
+
+    async def _fill(self, compiled, variables):
+        step = compiled.step
+        # one wait for every field, then type into each
+        await self.automator.wait_for(
+            " && ".join(f"!!{CLICKABLE_JS}({find_js(locator)})" for locator, _ in step.fields), step.timeout)
+        for locator, name in step.fields:
+            await self.automator.send_keys_to_element(locator, variables[name], step.timeout)
+
+    async def _pick_expiry(self, compiled, variables):
+        step = compiled.step
+        await self.automator.select_expiry_date(int(variables["exp_month"]), int(variables["exp_year"]), step.locator,
+                                                step.picker)
+
+    async def _click(self, compiled, variables):
+        await self.automator.click_element(compiled.step.locator, compiled.step.timeout)
+
+    async def _check(self, compiled, variables):
+        step = compiled.step
+        message = await self.automator.wait_for(
+            f"(() => {{ const e = {VISIBLE_JS}({find_js(step.fail)}); if (e && e.innerText.trim())"
+            f" return e.innerText.trim(); return {VISIBLE_JS}({find_js(step.proceed)}) ? ' ' : null; }})()",
+            step.timeout)
+        if message.strip():
+            raise StepFailed(message.strip())
+
+    async def _read(self, compiled, variables):
+        step = compiled.step
+        texts = await self.automator.wait_for(
+            f"(() => {{ const els = [{', '.join(f'{VISIBLE_JS}({find_js(locator)})' for locator, _ in step.fields)}];"
+            f" return els.every(el => el) ? els.map(el => el.innerText.trim()) : null; }})()", step.timeout)
+        return {name: text for (_, name), text in zip(step.fields, texts)}
+
+    async def _await_clickable(self, compiled, variables):
+        await self.automator.wait_clickable(compiled.step.locator, compiled.step.timeout)
+        self._held = compiled.step.locator
+
+    async def _press(self, compiled, variables):
+        locator, self._held = self._held, None
+        await self.automator.click_element(locator)
+        self.logger.info("Payment submitted.")
+
+    async def _outcome(self, compiled, variables):
+        step = compiled.step
+        automator = self.automator
+        self.logger.info("Please be patient as we process the payment.")
+        try:
+            await automator.wait_for(f"!!({VISIBLE_JS}({find_js(step.success)}) || {VISIBLE_JS}({find_js(step.fail)}))",
+                                     step.timeout)
+        except Exception as e:
+            return None, f"Automation error during result check: {e}"
+
+        token = await automator.text(step.success)
+        if token:
+            self.logger.info("Payment successful. Token received")
+            return True, token
+        title = await automator.text(step.fail)
+        if title and (not step.fail_text or step.fail_text in title):
+            # the detail may render after the title; without it the title is the message
+            detail = ""
+            if step.detail:
+                try:
+                    detail = await automator.get_element_text(step.detail, DETAIL_TIMEOUT)
+                except WaitTimeout:
+                    pass
+            detail = detail or title
+            self.logger.critical(f"Payment failed: {detail}")
+            return False, detail
+        return None, "Unknown outcome: Neither token nor explicit error found."
+
+
+async def run_purchase_async(automator, meter: str, amount: float, card, confirm=None, customer_cache=None,
+                             logger=None, purchase_id: str = None, plan=None):
+    """Coroutine counterpart of purchase_flow.run_purchase, on an AsyncBrowserAutomator on the plan's start page."""
+    purchase_id = purchase_id or uuid.uuid4().hex
+    automator.purchase_id = purchase_id
+    params = {
+        "meter": meter, "amount": amount, "card_number": card.number, "card_name": card.name,
+        "card_code": card.code, "exp_month": card.exp_month, "exp_year": card.exp_year,
+    }
+    started = time.perf_counter()
+    result = await execute_plan_async(plan or PLANS[DEFAULT_PLAN], AsyncPlanEngine(automator), params,
+                                      confirm=confirm, customer_cache=customer_cache, purchase_id=purchase_id,
+                                      logger=logger)
+    metrics.observe("purchase", time.perf_counter() - started, (result.status, result.stage))
+    return result
+
+
+async def purchase_batch_async(rows, card_router, concurrency: int, headless: bool = True,
+                               coordinator=None, customer_cache=None, governor=None, chrome_path: str = None,
+                               card_timeout: float = 600, on_setup_failed=None, plan=None, lean_profile: bool = False,
+                               logger=None):
+    """
+    Runs purchases concurrently from one event loop on one browser process, each in its own
+    browser context. Failure artifacts, session recording and profiling need a BrowserAutomator
+    and are not available here.
+    :param rows: (list) (meter, amount) tuples
+    :param card_router: (CardRouter) Hands out the card for each purchase
+    :param concurrency: (int) Purchases running at the same time
+    :param coordinator: (PurchaseCoordinator) Deduplicates against purchases in flight elsewhere
+    :param on_setup_failed: (callable) on_setup_failed(result) for purchases whose page did not load
+    :param plan: (CompiledPlan) Purchase plan, the default portal's plan if not given
+    :param lean_profile: (bool) Start the browser without images and background work
+    :return: (list) (meter, amount, PurchaseResult or None) in input order. None means the purchase
+             was in progress in another process.
+    """
+    logger = logger or logging.getLogger("INFO Logger")
+    semaphore = asyncio.Semaphore(concurrency)
+    browser = AsyncBrowser(headless=headless, chrome_path=chrome_path, governor=governor, lean_profile=lean_profile,
+                           logger=logger)
+    try:
+        await browser.start()
+    except Exception as e:
+        logger.error(f"Unable to start the browser: {e}")
+        await browser.close()
+        return [(meter, amount, PurchaseResult(meter, amount, STATUS_ERROR, str(e), STAGE_SETUP))
+                for meter, amount in rows]
+    session_options = {"customer_cache": customer_cache, "card_timeout": card_timeout,
+                       "on_setup_failed": on_setup_failed, "plan": plan, "logger": logger}
+
+    async def purchase(meter, amount):
+        async with semaphore:
+            return await _coordinated_purchase(browser, meter, amount, card_router, coordinator,
+                                               **session_options)
+
+    try:
+        results = await asyncio.gather(*(purchase(meter, amount) for meter, amount in rows))
+    finally:
+        await browser.close()
+    return [(meter, amount, result) for (meter, amount), result in zip(rows, results)]
+
+
+async def _coordinated_purchase(browser, meter, amount, card_router, coordinator, logger, **options):
+    job = None
+    if coordinator:
+        job, created = coordinator.submit(meter, amount)
+        if job is None:
+            return None
+        if not created:
+            return await asyncio.wrap_future(job.future)
+
+    result = None
+    try:
+        result = await _purchase_with_card(browser, meter, amount, card_router, logger=logger, **options)
+    except Exception as e:
+        # an unexpected error may have happened after the payment was submitted
+        logger.error(f"Purchase for meter {meter} failed: {e}")
+        result = PurchaseResult(meter, amount, STATUS_ERROR, str(e), STAGE_SUBMITTED)
+    finally:
+        if job:
+            coordinator.complete(job, result)
+    return result
+
+
+async def _purchase_with_card(browser, meter, amount, card_router, customer_cache, card_timeout,
+                              on_setup_failed, plan, logger):
+    try:
+        # the router blocks on a condition, so wait for a card off the event loop
+        lease = await asyncio.to_thread(card_router.acquire, amount, card_timeout)
+    except NoCardAvailableError as e:
+        return PurchaseResult(meter, amount, STATUS_ERROR, str(e), STAGE_SETUP)
+
+    plan = plan or PLANS[DEFAULT_PLAN]
+    result = None
+    session = None
+    try:
+        try:
+            session = await browser.new_session(plan.url)
+            opened = await AsyncPlanEngine(session).open(plan.url, plan.ready)
+        except Exception as e:
+            opened, error = False, str(e)
+        else:
+            error = "Unable to load payment page"
+        if not opened:
+            metrics.observe("purchase", 0, (STATUS_ERROR, STAGE_SETUP))
+            result = PurchaseResult(meter, amount, STATUS_ERROR, error, STAGE_SETUP)
+            if on_setup_failed:
+                on_setup_failed(result)
+            return result
+
+        result = await run_purchase_async(session, meter, amount, lease.card, customer_cache=customer_cache,
+                                          logger=logger, plan=plan)
+        return result
+    finally:
+        card_router.release(lease, result)
+        if session:
+            await session.close()
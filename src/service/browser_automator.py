@@ -1,7 +1,8 @@
+import functools
 import logging
+import time
 
 from selenium import webdriver
-from selenium.common import TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.options import Options as ChromeOptions
@@ -13,52 +14,136 @@ from selenium.webdriver.edge.options import Options as EdgeOptions
 from selenium.webdriver.edge.service import Service as EdgeService
 from webdriver_manager.microsoft import EdgeChromiumDriverManager
 
-from .locators import FirstPageLocators, DatePickerLocators, SecondPageLocators, ResultPageLocators
-
-from src.service.locators import DatePickerLocators
+from .flow_plan import MONTHS
+from .metrics import metrics
+from .profiler import TRACE_CATEGORIES
+
+# seconds a session waits for a failure capture still reading its page before it is reused
+CAPTURE_WAIT = 30
+
+# lean_profile: skip what a payment form does not need
+LEAN_PROFILE_ARGUMENTS = (
+    "--blink-settings=imagesEnabled=false",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--no-first-run",
+    "--mute-audio",
+)
+
+
+def automation_step(name):
+    """Marks a BrowserAutomator method as a purchase flow step so step hooks run after it."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                metrics.observe(f"step.{name}", time.perf_counter() - started)
+                self._after_step(name)
+        return wrapper
+    return decorator
 
 
 class BrowserAutomator:
     """
     Class BrowserAutomator.
     Automates the process of purchasing power and water tokens using Selenium.
+    Owns the browser session; the purchase steps are run on it by plan_engines.SeleniumEngine.
     """
-    def __init__(self, url: str, headless: bool = False, logger = None, skip_setup=False): # headless to True for background processing
+    def __init__(self, url: str, headless: bool = False, logger = None, skip_setup=False, governor=None,
+                 recorder=None, profiler=None, artifacts=None, timeout: float = 10, element_timeout: float = 4,
+                 browser: str = "auto", lean_profile: bool = False):
+        # headless to True for background processing
+        # timeout: seconds to wait for an element to be clickable or visible during the flow
+        # element_timeout: seconds to wait for a page's key element, e.g. after loading the payment page
+        # browser: "chrome", "edge", or "auto" for Chrome with Edge as the fallback
+        # lean_profile: start the browser without images, extensions and background networking
         self.url = url
+        # element that shows the page loaded, given by the plan on open_site()
+        self.ready = None
         self.headless = headless
+        self.browser = browser
+        self.lean_profile = lean_profile
+        self.timeout = timeout
+        self.element_timeout = element_timeout
         self.driver = None
         self.wait = None
         self.logger = logger or logging.getLogger("INFO Logger")
+        self.governor = governor
+        self.recorder = recorder
+        self.profiler = profiler
+        self.artifacts = artifacts
+        self.purchase_id = None
+        self._card_secrets = ()
+        self._card_inputs = ()
+        # failure capture still reading the page, see FailureArtifactStore
+        self._capture = None
         if not skip_setup:
             self.setup_driver()
 
     def setup_driver(self):
         """
         Sets up Chrome WebDriver by default.
-        Falls back to Microsoft Edge WebDriver if Chrome is not available
+        Falls back to Microsoft Edge WebDriver if Chrome is not available, unless the browser is set
         """
+        # the governor tracks one driver per automator; the old one must be gone first
+        self._settle()
         log = self.logger
-        log.info("Setting up Chrome WebDriver. Please be patient.")
-
-        self._setup_chrome()
-
-    def _setup_chrome(self):
-        options = ChromeOptions()
-
+        if self.browser == "edge":
+            log.info("Setting up Edge WebDriver. Please be patient.")
+            try:
+                self._setup_edge()
+            except Exception as edge_error:
+                log.critical(edge_error)
+                raise RuntimeError("WebDriver initiation failed") from edge_error
+        else:
+            log.info("Setting up Chrome WebDriver. Please be patient.")
+            self._setup_chrome()
+
+        if self.governor:
+            self.governor.register(self)
+
+    def _logging_prefs(self, options, capability):
+        """Enables the browser console log, and the performance log when recording or profiling."""
+        prefs = {"browser": "ALL"}
+        if self.recorder or self.profiler:
+            # network events and trace events are read back from the performance log
+            prefs["performance"] = "ALL"
+        options.set_capability(capability, prefs)
+        if self.profiler:
+            options.add_experimental_option("perfLoggingPrefs", {"traceCategories": TRACE_CATEGORIES})
+
+    def _add_arguments(self, options):
         if self.headless:
             options.add_argument("--headless")
             options.add_argument("--disable-gpu")
             options.add_argument("--no-sandbox")
             options.add_argument("--disable-dev-shm-usage")
+        if self.lean_profile:
+            for argument in LEAN_PROFILE_ARGUMENTS:
+                options.add_argument(argument)
+
+    def _setup_chrome(self):
+        options = ChromeOptions()
+        self._logging_prefs(options, "goog:loggingPrefs")
+        self._add_arguments(options)
 
         try:
             service = ChromeService(ChromeDriverManager().install())
             self.driver = webdriver.Chrome(service=service, options=options)
-            self.wait = WebDriverWait(self.driver, 10)
+            self.wait = WebDriverWait(self.driver, self.timeout)
             self.logger.info("Chrome initiated")
         except Exception as chrome_error:
             chrome_msg = f"Chrome WebDriver failed: {chrome_error}"
             self.logger.warning(chrome_msg)
+            if self.browser == "chrome":
+                self.logger.critical(chrome_error)
+                raise RuntimeError("WebDriver initiation failed") from chrome_error
             try:
                 self._setup_edge()
             except Exception as edge_error:
@@ -68,36 +153,109 @@ class BrowserAutomator:
 
     def _setup_edge(self):
         options = EdgeOptions()
-
-        if self.headless:
-            options.add_argument("--headless")
-            options.add_argument("--disable-gpu")
-            options.add_argument("--no-sandbox")
-            options.add_argument("--disable-dev-shm-usage")
+        self._logging_prefs(options, "ms:loggingPrefs")
+        self._add_arguments(options)
 
         service = EdgeService(EdgeChromiumDriverManager().install())
         self.driver = webdriver.Edge(service=service, options=options)
-        self.wait = WebDriverWait(self.driver, 10)
+        self.wait = WebDriverWait(self.driver, self.timeout)
         self.logger.info("Edge initiated")
 
 
+    def set_timeouts(self, timeout: float = None, element_timeout: float = None):
+        """Changes the wait timeouts, also of a running session."""
+        self.timeout = timeout or self.timeout
+        self.element_timeout = element_timeout or self.element_timeout
+        if self.driver:
+            self.wait = WebDriverWait(self.driver, self.timeout)
+
     def close(self):
         """
-        Closes the browser.
+        Closes the browser. While a failure capture is still reading the page, the browser is
+        quit once the capture is done, so the failing purchase does not wait for it.
         """
         if self.driver:
-            self.logger.info("Browser closed")
-            self.driver.quit()
+            if self.recorder:
+                self.recorder.finish()
+            driver = self.driver
             self.driver = None
             self.wait = None
+            self._card_secrets = ()
+            self._card_inputs = ()
+            if self._capture:
+                self._capture.then(lambda: self._quit(driver))
+            else:
+                self._quit(driver)
+
+    def _quit(self, driver):
+        try:
+            driver.quit()
+            self.logger.info("Browser closed")
+        except Exception as e:
+            self.logger.warning(f"Error closing browser: {e}")
+        finally:
+            # kills anything quit() left behind, unless a capture outlasted CAPTURE_WAIT and the
+            # governor already tracks the automator's next driver
+            if self.governor and not self.driver:
+                self.governor.unregister(self)
+
+    def _settle(self):
+        """Waits for a failure capture still reading the page, before the session is navigated or replaced."""
+        capture, self._capture = self._capture, None
+        if capture and not capture.wait(CAPTURE_WAIT):
+            self.logger.warning("Failure capture still running, continuing without waiting for it")
+
+    def _after_step(self, name):
+        """Runs after every automation step."""
+        if not self.driver or not (self.recorder or self.profiler):
+            return
+
+        # the performance log is drained on read, so read it once for every consumer
+        try:
+            log_entries = self.driver.get_log("performance")
+        except Exception as e:
+            self.logger.debug(f"Performance log unavailable: {e}")
+            log_entries = []
 
-    def open_site(self):
+        if self.profiler:
+            self.profiler.collect_performance_log(log_entries)
+        if self.recorder:
+            self.recorder.record_step(self.driver, name, log_entries)
+
+    def register_card_secrets(self, *values, inputs=()):
+        """
+        Registers card values that recordings and failure artifacts must redact.
+        :param inputs: (iterable) Locators of the inputs holding them, blanked in failure screenshots
+        """
+        self._card_secrets = values
+        self._card_inputs = tuple(inputs)
+        if self.recorder:
+            self.recorder.add_secrets(*values)
+
+    def _capture_failure(self, step):
+        """Hands the failing page to the failure artifact store, if one is configured."""
+        if self.artifacts and self.driver:
+            capture = self.artifacts.capture(self.driver, self.purchase_id or "unknown", step, self._card_secrets,
+                                             self._card_inputs)
+            self._capture = capture or self._capture
+
+    @automation_step("open_site")
+    def open_site(self, url: str = None, ready=None):
         """
-        Navigates the browser to the specified URL.
+        Navigates the browser to the URL and waits for the ready element. Plans open the session
+        through their engine, see PlanEngine.open(); without arguments the page of the last call
+        is loaded again, e.g. to park a recycled session on it.
+        :param url: (str) Start page
+        :param ready: (tuple) Locator of the element that shows the page loaded
         """
+        self.url = url or self.url
+        self.ready = ready or self.ready
+        self._settle()
         if not self.driver:
             self.logger.critical("WebDriver initiation failed")
             return False
+        if self.recorder:
+            self.recorder.start(self.url)
         try:
             self.logger.info("Loading payment page. Please be patient.")
             self.driver.get(self.url)
@@ -105,266 +263,83 @@ class BrowserAutomator:
                 self.driver.maximize_window()
 
             # wait for key element on the first page to ensure it's loaded correctly
-            self.wait_for_element(FirstPageLocators.METER_INPUT)
+            if self.ready:
+                self.wait_for_element(self.ready)
             self.logger.info("Payment page loaded successfully")
             return True
         except Exception as e:
             self.logger.critical(f"Error: {e}")
             return None
 
-    def wait_for_element(self, locator, timeout = 4):
-        """Waits for element to be visible."""
-        wait = WebDriverWait(self.driver, timeout)
+    def wait_for_element(self, locator, timeout = None):
+        """Waits for element to be visible, for element_timeout seconds unless timeout is given."""
+        wait = WebDriverWait(self.driver, timeout or self.element_timeout)
         return wait.until(EC.visibility_of_element_located(locator))
 
-    def enter_payment_details(self, meter: str, cc_number: str, cc_name: str, cc_code: str,
-                              exp_month: int, exp_year: int):
+    def select_expiry_date(self, exp_month: int, exp_year: int, popup, picker):
         """
-        Enters the meter number and CC details on the first page
-        :param meter: (str) The meter number for power or water
-        :param cc_number: (str) The CC number
-        :param cc_name: (str) The cardholder name
-        :param cc_code: (str) The CC code or CVV
+        Selects the CC expiration month and year in a date picker popup.
         :param exp_month: (int) The CC expiration month
         :param exp_year: (int) The CC expiration year
-        :return: (bool)
+        :param popup: (tuple) Locator of the button that opens the popup
+        :param picker: (ExpiryPicker) Locators of the popup
         """
-        self.logger.info("Initiating payment details.")
         try:
-            # input meter
-            self.send_keys_to_element(FirstPageLocators.METER_INPUT, meter)
-
-            # input CC number
-            self.send_keys_to_element(FirstPageLocators.CC_NUMBER_INPUT, cc_number)
-
-            # input cc holder name
-            self.send_keys_to_element(FirstPageLocators.CC_NAME_INPUT, cc_name)
+            # handle expiry date
+            self.click_element(popup)
 
-            # input CC code
-            self.send_keys_to_element(FirstPageLocators.CC_CODE_INPUT, cc_code)
-
-            try:
-                # handle expiry date
-                self.click_element(FirstPageLocators.EXPIRY_POPUP_BUTTON)
-
-                # month mapping for IDs
-                month_ids = {
-                    1: "rcMView_Jan", 2: "rcMView_Feb", 3: "rcMView_Mar", 4: "rcMView_Apr", 5: "rcMView_May",
-                    6:"rcMView_Jun", 7: "rcMView_Jul", 8: "rcMView_Aug", 9: "rcMView_Sep", 10: "rcMView_Oct",
-                    11: "rcMView_Nov", 12: "rcMView_Dec"
-                }
-
-                # select month
-                target_month_id = month_ids.get(exp_month)
-                if not target_month_id:
-                    raise ValueError(f"Invalid month: {exp_month}. Must be between 1 and 12.")
-
-                # find the <a> tag inside the <td> for the month
-                month_locator = (By.XPATH, DatePickerLocators.MONTH_XPATH_TEMPLATE.format(month_str=target_month_id))
-                self.click_element(month_locator)
-
-            except Exception as e:
-                self.logger.critical(f"Error with month picker: {e}")
-
-            # select year
-            # loop to navigate years until target year is visible
-            while True:
-                # get all visible year elements in the current view
-                year_elements = self.driver.find_elements(By.XPATH, DatePickerLocators.VISIBLE_YEARS_XPATH)
-
-                current_years = []
-                for el in year_elements:
-                    try:
-                        year_val = int(el.text)
-                        current_years.append(year_val)
-                    except ValueError:
-                        continue # skip elements that don't contain valid year numbers
-
-                if not current_years:
-                    break
-
-                min_current_year = min(current_years)
-                max_current_year = max(current_years)
-
-                if min_current_year <= exp_year <= max_current_year:
-                    break # exit loop when target year is visible
-
-                if exp_year > max_current_year:
-                    self.click_element(DatePickerLocators.NEXT_YEAR_BUTTON)
-
-                    # wait for UI to update
-                    self.wait_for_element(DatePickerLocators.NEXT_YEAR_BUTTON)
-                else:
-                    self.logger.error(f"Issue navigating year elements.")
-                    break
-
-            # click target year after loop
-            year_locator = (By.XPATH, DatePickerLocators.YEAR_XPATH_TEMPLATE.format(year=exp_year))
-            self.click_element(year_locator)
-
-            # click OK button in date picker
-            self.click_element(DatePickerLocators.OK_BUTTON)
-
-            self.logger.info("All payment details entered successfully.")
-            return True
-        except Exception as e:
-            self.logger.error(str(e))
-            return False
-
-    def click_element(self, locator):
-        """Finds clickable element and clicks it."""
-        element = self.wait.until(EC.element_to_be_clickable(locator))
-        element.click()
+            # select month
+            if not 1 <= exp_month <= 12:
+                raise ValueError(f"Invalid month: {exp_month}. Must be between 1 and 12.")
 
-    def send_keys_to_element(self, locator, keys):
-        """Finds element, clears it, and sends keys to it."""
-        element = self.wait.until(EC.element_to_be_clickable(locator))
-        element.clear()
-        element.send_keys(keys)
+            # find the link for the month
+            month_locator = (By.XPATH, picker.month.format(month=MONTHS[exp_month - 1]))
+            self.click_element(month_locator)
 
-    def click_next_button(self):
-        """
-        Clicks the 'Next' button on the current page.
-        """
-        try:
-            self.click_element(FirstPageLocators.NEXT_BUTTON)
-            logging.info("Clicked 'Next' button.")
-            return True
         except Exception as e:
-            logging.error(f"Error clicking 'Next' button: {e}")
-            return False
+            self.logger.critical(f"Error with month picker: {e}")
 
-    def check_meter_message(self):
-        try:
-            # find error message element with id
-            error_element = self.wait.until(
-                EC.visibility_of_element_located((
-                    By.ID, "ContentPlaceHolder1_lblmeter"
-                ))
-            )
-            # extract text
-            error_msg = error_element.text.strip()
-            return error_msg
-        except TimeoutException as te:
-            self.logger.error(f"Timeout error: {str(te)}")
-            return None
-
-    def get_element_text(self, locator) -> str:
-        """Finds element and returns its text."""
-        element = self.wait.until(EC.visibility_of_element_located(locator))
-        return element.text.strip()
-
-    def get_customer_name(self):
-        try:
-            # get parent element by xpath
-            self.wait_for_element(SecondPageLocators.CUSTOMER_NAME_FIRST)
+        # select year
+        # loop to navigate years until target year is visible
+        while True:
+            # get all visible year elements in the current view
+            year_elements = self.driver.find_elements(By.XPATH, picker.years)
 
-            # get first name row
-            first_name = self.get_element_text(SecondPageLocators.CUSTOMER_NAME_FIRST)
+            current_years = []
+            for el in year_elements:
+                try:
+                    year_val = int(el.text)
+                    current_years.append(year_val)
+                except ValueError:
+                    continue # skip elements that don't contain valid year numbers
 
-            # get last name row
-            last_name = self.get_element_text(SecondPageLocators.CUSTOMER_NAME_LAST)
+            if not current_years:
+                break
 
-            # combine name
-            full_name = f"{first_name} {last_name}"
-            return full_name
-        except Exception:
-            self.logger.error("Error getting customer name.")
-            return None
+            min_current_year = min(current_years)
+            max_current_year = max(current_years)
 
+            if min_current_year <= exp_year <= max_current_year:
+                break # exit loop when target year is visible
 
+            if exp_year > max_current_year:
+                self.click_element(picker.next_years)
 
-    def enter_purchase_amount(self, amount: float):
-        """
-        Selects the 'Other' radio button and enters the specified purchase amount.
+                # wait for UI to update
+                self.wait_for_element(picker.next_years)
+            else:
+                self.logger.error(f"Issue navigating year elements.")
+                break
 
-        Args:
-            amount (float): The amount of token to purchase.
-        """
-        try:
-            # Click the "Other" radio button
-            self.click_element(SecondPageLocators.OTHER_AMOUNT_RADIO)
+        # click target year after loop
+        year_locator = (By.XPATH, picker.year.format(year=exp_year))
+        self.click_element(year_locator)
 
-            # Wait for the amount input field to become visible and clickable
-            self.send_keys_to_element(SecondPageLocators.AMOUNT_INPUT, amount)
-            logging.info(f"Entered amount: {amount}")
-            return True
-        except Exception as e:
-            logging.error(f"Error entering purchase amount: {e}")
-            return False
+        # click OK button in date picker
+        if picker.ok:
+            self.click_element(picker.ok)
 
-    def load_payment_popup(self):
-        """
-        Waits for the payment confirmation modal dialog to appear and clicks the 'Submit' button.
-        """
-        try:
-            # Wait for the modal dialog's submit button to be clickable
-            submit_button = self.wait.until(
-                EC.element_to_be_clickable((By.ID, "ctl00_ContentPlaceHolder1_RadWindow1_C_rbtnSave_input")))
-            return "ready", submit_button
-        except Exception as e:
-            self.logger.error(f"Unable to load payment popup: {e}")
-            return None, None
-
-    def confirm_payment(self, element):
-        try:
-            # User interaction for confirmation (can be removed for full automation)
-            element.click()
-            self.logger.info("Payment submitted.")
-            return True
-        except Exception as e:
-            self.logger.error(f"Error confirming payment popup: {e}")
-            return False
-
-    def get_token_or_error(self):
-        """
-        Checks for the presence of the token or an error message on the final page.
-
-        Returns:
-            tuple: A tuple containing (success_status, message).
-                   success_status is True if token found, False if error, None if neither.
-                   message is the token string or the error message.
-        """
-        self.logger.info("Please be patient as we process the payment.")
-        try:
-            # Wait for either the token element or the error title to be present
-            # Using EC.any_of for more precise waiting
-            self.wait.until(
-                EC.any_of(
-                    EC.visibility_of_element_located(
-                        ResultPageLocators.TOKEN_LABEL),
-                    EC.visibility_of_element_located(ResultPageLocators.ERROR_TITLE)
-                )
-            )
-
-            # Check for token first
-            try:
-                token_text = self.get_element_text(ResultPageLocators.TOKEN_LABEL)
-                if token_text:
-                    self.logger.info(f"Payment successful. Token received")
-                    logging.info(f"Token found: {token_text}")
-                    return True, token_text
-            except:
-                pass  # Token element not found, proceed to check for error
-
-            # Check for error message
-            try:
-                error_title_text = self.get_element_text(ResultPageLocators.ERROR_TITLE)
-
-                # If "Error Message" is in the title, look for the detailed error
-                if "Error Message" in error_title_text:
-                    # Look for the specific error detail div
-                    error_detail_text = self.get_element_text((By.XPATH, ResultPageLocators.ERROR_DETAIL_XPATH))
-
-                    self.logger.critical(f"Payment failed: {error_detail_text}")
-                    logging.warning(f"Error detected: {error_detail_text}")
-                    return False, error_detail_text
-            except:
-                pass  # Error elements not found
-
-            logging.warning("Neither token nor a clear error message found.")
-            return None, "Unknown outcome: Neither token nor explicit error found."
-
-        except Exception as e:
-            logging.error(f"An error occurred while checking for token/error: {e}")
-            return None, f"Automation error during result check: {e}"
+    def click_element(self, locator):
+        """Finds clickable element and clicks it."""
+        element = self.wait.until(EC.element_to_be_clickable(locator))
+        element.click()
@@ -0,0 +1,230 @@
+# src.service.card_router
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from model.card import Card, WalletCard
+from .metrics import metrics
+
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+
+class NoCardAvailableError(Exception):
+    """Raised when no card can take a purchase within the timeout."""
+
+
+def wallet_cards(wallet, max_per_hour: int = None, max_concurrent: int = None):
+    """
+    Returns the wallet's enabled cards. An empty wallet falls back to the card in the CC_*
+    environment variables, if set, limited by max_per_hour and max_concurrent (no limit if None).
+    """
+    cards = wallet.cards(enabled_only=True) if wallet else []
+    if not cards:
+        card = Card.from_env()
+        if card:
+            cards = [WalletCard("env", card, "Environment", max_per_hour=max_per_hour, max_concurrent=max_concurrent)]
+    return cards
+
+
+class ChargeLedger:
+    """
+    Charges of the last day per card, in SQLite next to the wallet so the hourly and daily limits
+    hold across restarts and are shared by the GUI, CLI and daemon. The default in-memory ledger
+    lasts as long as the process.
+    """
+    def __init__(self, path: str = ":memory:", logger=None):
+        self.logger = logger or logging.getLogger("INFO Logger")
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS charges (card TEXT, charged REAL, amount REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS charges_card ON charges (card, charged)")
+        self._conn.commit()
+
+    def add(self, card_id: str, amount: float):
+        """Records a charge and forgets the ones older than a day."""
+        now = time.time()
+        with self._lock:
+            try:
+                self._conn.execute("INSERT INTO charges (card, charged, amount) VALUES (?, ?, ?)",
+                                   (card_id, now, amount))
+                self._conn.execute("DELETE FROM charges WHERE charged < ?", (now - DAY,))
+                self._conn.commit()
+            except sqlite3.Error as e:
+                self.logger.warning(f"Unable to record the card charge: {e}")
+
+    def since(self, card_id: str, since: float):
+        """:return: (tuple) (count, amount) of the card's charges since the given time"""
+        with self._lock:
+            count, amount = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(amount), 0) FROM charges WHERE card = ? AND charged >= ?",
+                (card_id, since)
+            ).fetchone()
+        return count, amount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CardLease:
+    """A card handed out for one purchase; give it back with CardRouter.release()."""
+    def __init__(self, entry: WalletCard, amount: float):
+        self.entry = entry
+        self.amount = amount
+
+    @property
+    def card(self) -> Card:
+        return self.entry.card
+
+
+class CardRouter:
+    """
+    Spreads concurrent purchases across the wallet's cards.
+    A card is handed out only while it stays under its concurrency, hourly purchase count,
+    per-purchase amount and daily amount limits; among the cards that qualify the least busy
+    one is picked. Hourly and daily usage comes from the ChargeLedger. A card its issuer
+    declines is dropped for the rest of the run.
+    """
+    def __init__(self, cards, ledger=None, logger=None):
+        """
+        :param cards: (list) WalletCard entries
+        :param ledger: (ChargeLedger) Charges the limits count, in memory for this process if not given
+        """
+        self.logger = logger or logging.getLogger("INFO Logger")
+        self.ledger = ledger or ChargeLedger(logger=self.logger)
+        self._cond = threading.Condition()
+        self._cards = {}
+        self._in_flight = defaultdict(list)
+        self._last_used = {}
+        self._declined = set()
+        self.reload(cards)
+
+    @classmethod
+    def from_wallet(cls, wallet, charges_file: str, max_per_hour: int = None, max_concurrent: int = None,
+                    logger=None):
+        """
+        Builds a router over the wallet's cards (see wallet_cards).
+        :param charges_file: (str) SQLite file of the ChargeLedger
+        """
+        return cls(wallet_cards(wallet, max_per_hour, max_concurrent), ChargeLedger(charges_file, logger=logger),
+                   logger=logger)
+
+    def reload(self, cards):
+        """Replaces the cards, keeping the usage of cards that stay."""
+        with self._cond:
+            self._cards = {entry.id: entry for entry in cards}
+            metrics.set_gauge("cards.available", len(self._cards) - len(self._declined & set(self._cards)))
+            self._cond.notify_all()
+
+    def has_cards(self) -> bool:
+        with self._cond:
+            return any(card_id not in self._declined for card_id in self._cards)
+
+    def reinstate(self, card_id: str):
+        """Puts a declined card back into rotation."""
+        with self._cond:
+            self._declined.discard(card_id)
+            self._cond.notify_all()
+
+    def acquire(self, amount: float, timeout: float = 0) -> CardLease:
+        """
+        Hands out the least busy card that can take the purchase, waiting up to timeout
+        seconds for one to come under its limits.
+        :raises NoCardAvailableError: when no card can take the purchase in time
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.time()
+                candidates = [entry for entry in self._cards.values() if self._usable(entry, amount)]
+                if not candidates:
+                    raise NoCardAvailableError(f"No card can pay ${amount:.2f}")
+
+                ready = [entry for entry in candidates if self._has_capacity(entry, amount, now)]
+                if ready:
+                    entry = min(ready, key=lambda e: (len(self._in_flight[e.id]), self._hourly_count(e.id, now),
+                                                      self._last_used.get(e.id, 0)))
+                    lease = CardLease(entry, amount)
+                    self._in_flight[entry.id].append(lease)
+                    self._last_used[entry.id] = now
+                    return lease
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise NoCardAvailableError("Every card is at its limit, try again later")
+                # hourly and daily windows free up with time as well as on release
+                self._cond.wait(min(remaining, 5))
+
+    def release(self, lease: CardLease, result=None):
+        """
+        Returns a card after the purchase.
+        A purchase that may have been submitted counts against the card's limits; a payment
+        the issuer declined drops the card.
+        :param result: (PurchaseResult) None when the outcome is unknown
+        """
+        card_id = lease.entry.id
+        with self._cond:
+            if lease in self._in_flight[card_id]:
+                self._in_flight[card_id].remove(lease)
+            if result is None or result.submitted:
+                self.ledger.add(card_id, lease.amount)
+            if result is not None and result.declined:
+                self._declined.add(card_id)
+                metrics.incr("cards.declined")
+                self.logger.warning(f"Card {lease.entry.display_name} declined, no longer used for this run")
+            metrics.set_gauge("cards.available", len(self._cards) - len(self._declined & set(self._cards)))
+            self._cond.notify_all()
+
+    def usage(self):
+        """:return: (list) Per-card usage for display"""
+        now = time.time()
+        with self._cond:
+            return [{
+                "id": entry.id,
+                "card": entry.display_name,
+                "in_flight": len(self._in_flight[entry.id]),
+                "last_hour": self._hourly_count(entry.id, now),
+                "today": round(self._daily_amount(entry.id, now), 2),
+                "declined": entry.id in self._declined,
+            } for entry in self._cards.values()]
+
+    def close(self):
+        self.ledger.close()
+
+    # ------------------------- limits (called with the lock held) -------------------------
+
+    def _usable(self, entry, amount) -> bool:
+        """Whether the card could ever take the purchase, however long we wait."""
+        if not entry.enabled or entry.id in self._declined:
+            return False
+        if entry.max_amount is not None and amount > entry.max_amount:
+            return False
+        return entry.max_daily_amount is None or amount <= entry.max_daily_amount
+
+    def _has_capacity(self, entry, amount, now) -> bool:
+        in_flight = self._in_flight[entry.id]
+        if entry.max_concurrent and len(in_flight) >= entry.max_concurrent:
+            return False
+        if entry.max_per_hour is not None and self._hourly_count(entry.id, now) + len(in_flight) >= entry.max_per_hour:
+            return False
+        if entry.max_daily_amount is not None:
+            committed = self._daily_amount(entry.id, now) + sum(lease.amount for lease in in_flight)
+            if committed + amount > entry.max_daily_amount:
+                return False
+        return True
+
+    def _hourly_count(self, card_id, now) -> int:
+        return self.ledger.since(card_id, now - HOUR)[0]
+
+    def _daily_amount(self, card_id, now) -> float:
+        return self.ledger.since(card_id, now - DAY)[1]
@@ -0,0 +1,99 @@
+# src.service.customer_cache
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+class CustomerCache:
+    """
+    Persistent TTL cache of meter number -> customer name.
+    Entries are kept in memory for instant lookups and written through to SQLite
+    so they survive restarts. Filled on every successful customer name lookup.
+    """
+    def __init__(self, path: str, ttl: int, logger=None):
+        self.path = path
+        self.ttl = ttl
+        self.logger = logger or logging.getLogger("INFO Logger")
+        self._lock = threading.Lock()
+        self._entries = {}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS customers ("
+            "meter TEXT PRIMARY KEY, first_name TEXT, last_name TEXT, updated REAL)"
+        )
+        self._conn.commit()
+        self._load()
+
+    def _load(self):
+        """Loads unexpired entries into memory and purges the expired ones."""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            self._conn.execute("DELETE FROM customers WHERE updated < ?", (cutoff,))
+            self._conn.commit()
+            rows = self._conn.execute("SELECT meter, first_name, last_name, updated FROM customers").fetchall()
+            self._entries = {meter: (first, last, updated) for meter, first, last, updated in rows}
+        self.logger.debug(f"Customer cache loaded {len(self._entries)} entries")
+
+    def get(self, meter: str):
+        """
+        Returns the cached customer name for a meter.
+        :param meter: (str) Meter number
+        :return: (tuple) (first_name, last_name) or None if unknown or expired
+        """
+        with self._lock:
+            entry = self._entries.get(meter)
+            if not entry:
+                return None
+            first, last, updated = entry
+            if time.time() - updated > self.ttl:
+                del self._entries[meter]
+                return None
+            return first, last
+
+    def get_full_name(self, meter: str):
+        """Returns the cached customer name as a single string, or None."""
+        name = self.get(meter)
+        if not name:
+            return None
+        return " ".join(part for part in name if part)
+
+    def put(self, meter: str, first_name: str, last_name: str):
+        """
+        Stores or refreshes the customer name for a meter.
+        :param meter: (str) Meter number
+        :param first_name: (str) Customer first name
+        :param last_name: (str) Customer last name
+        """
+        if not meter or not (first_name or last_name):
+            return
+        updated = time.time()
+        with self._lock:
+            self._entries[meter] = (first_name, last_name, updated)
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO customers (meter, first_name, last_name, updated) VALUES (?, ?, ?, ?)",
+                    (meter, first_name, last_name, updated)
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                self.logger.warning(f"Unable to persist customer cache entry: {e}")
+
+    def unknown(self, meters):
+        """
+        Returns the meters that have no cached customer name.
+        Used by batch jobs to pre-flag meters before spending a browser session on them.
+        :param meters: (iterable) Meter numbers
+        :return: (list) Meter numbers not found in the cache
+        """
+        return [meter for meter in meters if self.get(meter) is None]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
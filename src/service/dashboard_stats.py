@@ -0,0 +1,86 @@
+# src.service.dashboard_stats
+
+import time
+from collections import Counter, defaultdict, deque
+
+from model.purchase import STAGE_SETUP, STATUS_SUCCESS
+from .metrics import metrics, percentile
+
+
+# gauges shown on the dashboard, with their labels
+DASHBOARD_GAUGES = (
+    ("purchases.in_flight", "In flight"),
+    ("service.queue_depth", "Queued"),
+    ("offline_queue.pending", "Offline queue"),
+    ("browser.sessions", "Browser sessions"),
+    ("pool.idle", "Idle sessions"),
+    ("browser.rss_mb", "Browser memory (MB)"),
+    ("browser.cpu_percent", "Browser CPU (%)"),
+    ("cards.available", "Cards available"),
+)
+
+
+class DashboardStats:
+    """
+    Rolling view of the metrics ring buffer for the dashboard.
+    Each update() only reads the samples recorded since the previous one, so refreshing is
+    cheap however long the application has been running; samples older than window seconds
+    are dropped.
+    """
+    def __init__(self, source=metrics, window: float = 15 * 60):
+        self.source = source
+        self.window = window
+        self._sequence = 0
+        self._steps = defaultdict(deque)
+        self._purchases = deque()
+
+    def update(self, now: float = None) -> dict:
+        """
+        Reads new samples and returns the summary.
+        :return: (dict) See summary()
+        """
+        events, self._sequence = self.source.events_since(self._sequence)
+        for _, recorded, name, value, label in events:
+            if name.startswith("step."):
+                self._steps[name[5:]].append((recorded, value))
+            elif name == "purchase":
+                self._purchases.append((recorded, value) + tuple(label))
+
+        cutoff = (now or time.time()) - self.window
+        for samples in self._steps.values():
+            while samples and samples[0][0] < cutoff:
+                samples.popleft()
+        while self._purchases and self._purchases[0][0] < cutoff:
+            self._purchases.popleft()
+        return self.summary(now)
+
+    def summary(self, now: float = None) -> dict:
+        """
+        :return: (dict) steps: {name: (count, p50, p95)}, purchases, success_rate, throughput
+                 (purchases per minute over the last 5 minutes), latency_p50/p95, errors:
+                 [((status, stage), count)] most common first, gauges: [(label, value)]
+        """
+        now = now or time.time()
+        steps = {}
+        for name, samples in sorted(self._steps.items()):
+            if samples:
+                values = sorted(value for _, value in samples)
+                steps[name] = (len(values), percentile(values, 50), percentile(values, 95))
+
+        purchases = list(self._purchases)
+        succeeded = sum(1 for _, _, status, _ in purchases if status == STATUS_SUCCESS)
+        recent = sum(1 for recorded, *_ in purchases if now - recorded <= 5 * 60)
+        latencies = sorted(value for _, value, _, stage in purchases if stage != STAGE_SETUP)
+        errors = Counter((status, stage) for _, _, status, stage in purchases if status != STATUS_SUCCESS)
+
+        gauges = self.source.snapshot()["gauges"]
+        return {
+            "steps": steps,
+            "purchases": len(purchases),
+            "success_rate": succeeded / len(purchases) if purchases else None,
+            "throughput": recent / min(5.0, self.window / 60),
+            "latency_p50": percentile(latencies, 50),
+            "latency_p95": percentile(latencies, 95),
+            "errors": errors.most_common(),
+            "gauges": [(label, gauges[name]) for name, label in DASHBOARD_GAUGES if name in gauges],
+        }
@@ -0,0 +1,275 @@
+# src.service.flow_plan
+
+import logging
+import time
+from dataclasses import dataclass, replace
+
+from model.purchase import *
+from .metrics import metrics
+
+
+# actions an engine must implement, with the Step attributes each one requires
+ACTIONS = {
+    "fill": ("fields",),              # type each param into its input, all looked up in one round-trip
+    "pick_expiry": ("locator", "picker"),  # open the picker at locator, choose the card expiry month and year
+    "click": ("locator",),            # click an element
+    "check": ("fail", "proceed"),     # wait for fail or proceed; fail with the fail element's text
+    "read": ("fields",),              # read the text of each element into a variable
+    "await_clickable": ("locator",),  # wait for an element and keep it for the next "press"
+    "confirm": (),                    # ask the caller to confirm before the payment is submitted
+    "press": (),                      # click the element kept by "await_clickable"
+    "outcome": ("success", "fail"),   # wait for the token or the error (detail, when fail_text matches)
+}
+
+# card params, whose values recordings and failure artifacts redact
+CARD_PARAMS = ("card_number", "card_name", "card_code")
+# params every purchase supplies
+PURCHASE_PARAMS = frozenset({"meter", "amount", "exp_month", "exp_year", *CARD_PARAMS})
+
+MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+DEFAULT_TIMEOUT = 10
+# seconds an outcome's failure detail may take to show after the failure title
+DETAIL_TIMEOUT = 3
+
+
+class PlanError(Exception):
+    """Raised when a plan fails validation."""
+
+
+@dataclass(frozen=True)
+class ExpiryPicker:
+    """
+    Month and year calendar popup of a "pick_expiry" step. month and year are XPath templates of
+    the links to click, formatted with {month} (see MONTHS) and the four digit {year}. years is
+    the XPath of the year links in view, next_years pages them forward, ok closes the popup.
+    """
+    month: str
+    year: str
+    years: str
+    next_years: tuple
+    ok: tuple = None
+
+
+@dataclass(frozen=True)
+class Step:
+    """
+    One declarative step of a purchase flow.
+    Locators are (By, value) tuples; fields are ((locator, name), ...) pairs, where name is a
+    purchase param for "fill" and an output variable for "read". error is the user facing
+    message when the step fails, status the PurchaseResult status it fails with.
+    """
+    name: str
+    action: str
+    stage: str
+    locator: tuple = None
+    fields: tuple = ()
+    fail: tuple = None
+    fail_text: str = None
+    proceed: tuple = None
+    success: tuple = None
+    detail: tuple = None
+    picker: ExpiryPicker = None
+    timeout: float = DEFAULT_TIMEOUT
+    error: str = None
+    status: str = STATUS_ERROR
+    optional: bool = False
+
+
+@dataclass(frozen=True)
+class Plan:
+    """A named purchase flow for one portal. ready is the element that shows the start page loaded."""
+    name: str
+    url: str
+    ready: tuple
+    steps: tuple
+
+
+@dataclass(frozen=True)
+class CompiledStep:
+    step: Step
+    # element ids of the step's fields when every locator is By.ID, so engines can batch
+    # the lookups into a single script call
+    field_ids: tuple = None
+
+
+@dataclass(frozen=True)
+class CompiledPlan:
+    name: str
+    url: str
+    ready: tuple
+    steps: tuple
+
+
+def _element_id(locator):
+    by, value = locator
+    return value if by == "id" else None
+
+
+def with_timeouts(plan: Plan, timeout: float = None, timeouts: dict = None) -> Plan:
+    """
+    Returns a copy of the plan with other step timeouts, e.g. to try settings under load.
+    :param timeout: (float) Seconds for every step
+    :param timeouts: (dict) {step name: seconds}, takes precedence over timeout
+    """
+    timeouts = timeouts or {}
+    steps = tuple(replace(step, timeout=timeouts.get(step.name, timeout or step.timeout)) for step in plan.steps)
+    return replace(plan, steps=steps)
+
+
+def compile_plan(plan: Plan, params=PURCHASE_PARAMS) -> CompiledPlan:
+    """
+    Validates a plan and precomputes what engines need on the hot path.
+    :param plan: (Plan)
+    :param params: (set) Names the caller supplies to fill steps
+    :raises PlanError: when the plan is invalid
+    """
+    if not plan.steps:
+        raise PlanError(f"Plan {plan.name} has no steps")
+    if not plan.url or not plan.ready:
+        raise PlanError(f"Plan {plan.name} needs a url and a ready locator")
+
+    compiled = []
+    variables = set(params)
+    awaited = False
+    for index, step in enumerate(plan.steps):
+        where = f"Plan {plan.name}, step {index} ({step.name})"
+        if step.action not in ACTIONS:
+            raise PlanError(f"{where}: unknown action {step.action!r}")
+        for attribute in ACTIONS[step.action]:
+            if not getattr(step, attribute):
+                raise PlanError(f"{where}: {step.action} needs {attribute}")
+        locators = [step.locator, step.fail, step.proceed, step.success, step.detail]
+        if step.picker:
+            locators += [step.picker.next_years, step.picker.ok]
+            if "{month}" not in step.picker.month or "{year}" not in step.picker.year:
+                raise PlanError(f"{where}: picker templates need {{month}} and {{year}}")
+        for locator in locators:
+            if locator is not None and (len(locator) != 2 or not all(locator)):
+                raise PlanError(f"{where}: invalid locator {locator!r}")
+        if step.timeout <= 0:
+            raise PlanError(f"{where}: timeout must be positive")
+
+        if step.action == "fill":
+            unknown = {name for _, name in step.fields} - variables
+            if unknown:
+                raise PlanError(f"{where}: unknown params {sorted(unknown)}")
+        if step.action == "read":
+            variables.update(name for _, name in step.fields)
+        if step.action == "await_clickable":
+            awaited = True
+        if step.action == "press" and not awaited:
+            raise PlanError(f"{where}: press without a preceding await_clickable")
+
+        field_ids = None
+        if step.fields:
+            ids = tuple(_element_id(locator) for locator, _ in step.fields)
+            field_ids = ids if all(ids) else None
+        compiled.append(CompiledStep(step, field_ids))
+
+    if plan.steps[-1].action != "outcome":
+        raise PlanError(f"Plan {plan.name} must end with an outcome step")
+    return CompiledPlan(plan.name, plan.url, plan.ready, tuple(compiled))
+
+
+class StepFailed(Exception):
+    """Raised by engines when a step does not reach its expected outcome."""
+    def __init__(self, message: str = None):
+        super().__init__(message)
+        self.message = message
+
+
+def plan_steps(plan: CompiledPlan, params: dict, confirm=None, customer_cache=None, purchase_id: str = None,
+               logger=None):
+    """
+    Walks a compiled plan, shared by execute_plan and execute_plan_async so every engine gets the
+    same stages, messages and metrics. Yields (compiled step, variables) for the engine to run;
+    the caller sends back the step output or throws StepFailed into the generator. Confirm steps
+    are handled here. The generator returns the PurchaseResult.
+    """
+    logger = logger or logging.getLogger("INFO Logger")
+    meter, amount = params["meter"], params["amount"]
+    variables = dict(params)
+    customer_name = None
+
+    def result(status, message, stage):
+        return PurchaseResult(meter, amount, status, message, stage, customer_name, purchase_id)
+
+    for compiled in plan.steps:
+        step = compiled.step
+        if step.action == "confirm":
+            if confirm and not confirm(customer_name, meter, amount):
+                return result(STATUS_ABORTED, "Payment aborted.", step.stage)
+            continue
+
+        started = time.perf_counter()
+        try:
+            output = yield compiled, variables
+        except StepFailed as e:
+            if step.optional:
+                logger.warning(f"Optional step {step.name} failed: {e.message}")
+                continue
+            return result(step.status, e.message or step.error or f"{step.name} failed", step.stage)
+        finally:
+            metrics.observe(f"step.{step.name}", time.perf_counter() - started)
+
+        if step.action == "outcome":
+            status, message = output
+            status = STATUS_SUCCESS if status else STATUS_FAILED if status is False else STATUS_UNKNOWN
+            return result(status, message, step.stage)
+
+        if step.action == "read" and output:
+            variables.update(output)
+            if "first_name" in output or "last_name" in output:
+                parts = (output.get("first_name", ""), output.get("last_name", ""))
+                customer_name = " ".join(parts)
+                if customer_cache:
+                    customer_cache.put(meter, *parts)
+
+    return result(STATUS_UNKNOWN, "Unknown outcome: plan ended without a result step.", plan.steps[-1].step.stage)
+
+
+def execute_plan(plan: CompiledPlan, engine, params: dict, confirm=None, customer_cache=None,
+                 purchase_id: str = None, logger=None) -> PurchaseResult:
+    """
+    Runs a compiled plan on an engine whose session is already on the plan's start page.
+    :param plan: (CompiledPlan)
+    :param engine: (PlanEngine)
+    :param params: (dict) Purchase params (see PURCHASE_PARAMS)
+    :param confirm: (callable) confirm(customer_name, meter, amount) -> bool. None submits without asking.
+    :param customer_cache: (CustomerCache) Filled with the customer name when found
+    :return: (PurchaseResult)
+    """
+    steps = plan_steps(plan, params, confirm, customer_cache, purchase_id, logger)
+    output = failure = None
+    try:
+        while True:
+            compiled, variables = steps.throw(failure) if failure else steps.send(output)
+            output = failure = None
+            try:
+                output = engine.run(compiled, variables)
+            except StepFailed as e:
+                failure = e
+            finally:
+                engine.after_step(compiled)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def execute_plan_async(plan: CompiledPlan, engine, params: dict, confirm=None, customer_cache=None,
+                             purchase_id: str = None, logger=None) -> PurchaseResult:
+    """Same as execute_plan, for engines whose run() and after_step() are coroutines."""
+    steps = plan_steps(plan, params, confirm, customer_cache, purchase_id, logger)
+    output = failure = None
+    try:
+        while True:
+            compiled, variables = steps.throw(failure) if failure else steps.send(output)
+            output = failure = None
+            try:
+                output = await engine.run(compiled, variables)
+            except StepFailed as e:
+                failure = e
+            finally:
+                await engine.after_step(compiled)
+    except StopIteration as stop:
+        return stop.value
@@ -0,0 +1,261 @@
+# src.service.load_test
+
+import asyncio
+import itertools
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from datetime import date
+
+from model.card import Card, WalletCard
+from model.purchase import *
+from .async_automator import purchase_batch_async
+from .card_router import CardRouter
+from .flow_plan import compile_plan, with_timeouts
+from .metrics import metrics, percentile
+from .plans import PUC_PLAN
+from .portal_standin import INJECTED_FAILURES, OUTCOME_TOKEN
+from .purchase_flow import purchase_in_new_session, run_purchase
+from .session_pool import SessionPool
+
+
+# how a reported result compares with what the stand-in actually did
+RESULT_SUCCESS = "success"              # token reported
+RESULT_FAILURE = "failure"              # injected failure reported as a failure
+RESULT_TIMEOUT = "timeout"              # we gave up although the portal never failed the purchase
+RESULT_FALSE_FAILURE = "false_failure"  # reported as failed or unknown although the portal issued a token
+RESULT_SETUP = "setup"                  # no session or page to run the purchase on
+
+# steps whose duration is not bounded by a wait timeout
+UNTIMED_STEPS = {"confirm", "open_site"}
+
+
+def classify(result, outcome) -> str:
+    """
+    :param result: (PurchaseResult) What the automation reported
+    :param outcome: (str) What the stand-in did with the meter, see portal_standin.OUTCOME_*
+    """
+    if result.status == STATUS_SUCCESS:
+        return RESULT_SUCCESS
+    if result.stage == STAGE_SETUP:
+        return RESULT_SETUP
+    if outcome == OUTCOME_TOKEN:
+        return RESULT_FALSE_FAILURE
+    if outcome in INJECTED_FAILURES:
+        return RESULT_FAILURE
+    return RESULT_TIMEOUT
+
+
+def _round_up(seconds: float, step: float = 0.5) -> float:
+    return math.ceil(seconds / step) * step
+
+
+class LoadTest:
+    """
+    Ramps purchase concurrency against a PortalStandIn and measures each level.
+    Every purchase uses a new meter number so its reported result can be checked against what
+    the stand-in did with it. Levels run the purchase plan with the given step timeout; the
+    selenium engine runs a SessionPool the size of the level, the async engine one browser
+    with a context per purchase.
+    """
+    def __init__(self, portal, engine: str = "selenium", timeout: float = 10, element_timeout: float = 4,
+                 headless: bool = True, governor=None, chrome_path: str = None, amount: float = 10.0, logger=None):
+        self.portal = portal
+        self.engine = engine
+        self.timeout = timeout
+        self.element_timeout = element_timeout
+        self.headless = headless
+        self.governor = governor
+        self.chrome_path = chrome_path
+        self.amount = amount
+        self.logger = logger or logging.getLogger("INFO Logger")
+
+        self.plan = compile_plan(with_timeouts(replace(PUC_PLAN, url=portal.start_url), timeout))
+        # a test card only ever submitted to the local stand-in, with no limits
+        self.card = Card("4111111111111111", "Load Test", "123", 12, date.today().year + 3)
+        self.card_router = CardRouter([WalletCard("loadtest", self.card, "Load test", max_concurrent=None)],
+                                      logger=self.logger)
+        self._meters = itertools.count(1)
+        _, self._sequence = metrics.events_since(0)
+
+    def run(self, levels, purchases: int, stop_error_rate: float = 0.25):
+        """
+        Runs each concurrency level in turn. Ramping stops after a level where more than
+        stop_error_rate of the purchases timed out or failed falsely.
+        :return: (list) Level summaries, see run_level()
+        """
+        results = []
+        for concurrency in levels:
+            level = self.run_level(concurrency, purchases)
+            results.append(level)
+            if level["timeout_rate"] + level["false_failure_rate"] > stop_error_rate:
+                self.logger.warning(f"Stopping the ramp at {concurrency} concurrent purchases")
+                break
+        return results
+
+    def run_level(self, concurrency: int, purchases: int) -> dict:
+        """
+        Runs purchases with concurrency of them at a time.
+        :return: (dict) concurrency, purchases, elapsed, throughput (per minute), latency_p50/p95/p99,
+                 one count per RESULT_* value, timeout_rate, false_failure_rate, browser_rss_mb and
+                 steps: {name: {count, p50, p95, p99, max}}
+        """
+        self.logger.info(f"Load test: {purchases} purchases, {concurrency} at a time")
+        rows = [(f"{next(self._meters):011d}", self.amount) for _ in range(purchases)]
+        _, self._sequence = metrics.events_since(self._sequence)
+
+        if self.engine == "async":
+            results, elapsed = self._run_async(rows, concurrency)
+        else:
+            results, elapsed = self._run_selenium(rows, concurrency)
+
+        # postbacks the automation gave up on still decide the outcome
+        self.portal.wait_idle(timeout=self.portal.slow_seconds + self.portal.latency + self.portal.jitter + 5)
+        events, self._sequence = metrics.events_since(self._sequence)
+
+        counts = dict.fromkeys((RESULT_SUCCESS, RESULT_FAILURE, RESULT_TIMEOUT, RESULT_FALSE_FAILURE, RESULT_SETUP), 0)
+        for (meter, _), result in zip(rows, results):
+            counts[classify(result, self.portal.outcome(meter))] += 1
+
+        steps = {}
+        latencies = []
+        for _, _, name, value, label in events:
+            if name.startswith("step."):
+                steps.setdefault(name[5:], []).append(value)
+            elif name == "purchase" and label and label[1] != STAGE_SETUP:
+                latencies.append(value)
+        latencies.sort()
+
+        return {
+            "concurrency": concurrency,
+            "purchases": purchases,
+            "elapsed": round(elapsed, 2),
+            "throughput": round(purchases / elapsed * 60, 2) if elapsed else 0.0,
+            "latency_p50": percentile(latencies, 50),
+            "latency_p95": percentile(latencies, 95),
+            "latency_p99": percentile(latencies, 99),
+            **counts,
+            "timeout_rate": counts[RESULT_TIMEOUT] / purchases,
+            "false_failure_rate": counts[RESULT_FALSE_FAILURE] / purchases,
+            "browser_rss_mb": metrics.gauge("browser.rss_mb"),
+            "steps": {name: self._step_summary(values) for name, values in sorted(steps.items())},
+        }
+
+    @staticmethod
+    def _step_summary(values) -> dict:
+        values = sorted(values)
+        return {"count": len(values), "p50": percentile(values, 50), "p95": percentile(values, 95),
+                "p99": percentile(values, 99), "max": values[-1]}
+
+    def _run_selenium(self, rows, concurrency):
+        """:return: (tuple) (results in row order, seconds taken)"""
+        pool = SessionPool(self.plan, size=concurrency, headless=self.headless, governor=self.governor,
+                           logger=self.logger, timeout=self.timeout, element_timeout=self.element_timeout)
+        # sessions are warmed before the clock starts, as the daemon does at startup
+        pool.warm()
+
+        def purchase(row):
+            meter, amount = row
+            try:
+                automator = pool.acquire(timeout=300)
+            except Exception as e:
+                metrics.observe("purchase", 0, (STATUS_ERROR, STAGE_SETUP))
+                return PurchaseResult(meter, amount, STATUS_ERROR, str(e), STAGE_SETUP)
+            reusable = False
+            try:
+                result = run_purchase(automator, meter, amount, self.card, logger=self.logger, plan=self.plan)
+                reusable = True
+                return result
+            except Exception as e:
+                return PurchaseResult(meter, amount, STATUS_ERROR, str(e), STAGE_SUBMITTED)
+            finally:
+                pool.release(automator, reusable=reusable)
+
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="LoadTest") as executor:
+                results = list(executor.map(purchase, rows))
+            return results, time.perf_counter() - started
+        finally:
+            pool.close()
+
+    def _run_async(self, rows, concurrency):
+        started = time.perf_counter()
+        results = asyncio.run(purchase_batch_async(
+            rows, self.card_router, concurrency, headless=self.headless,
+            governor=self.governor, chrome_path=self.chrome_path, plan=self.plan, logger=self.logger))
+        return [result for _, _, result in results], time.perf_counter() - started
+
+
+def replay_check(server, engine: str = "selenium", timeout: float = 10, element_timeout: float = 4,
+                 headless: bool = True, governor=None, chrome_path: str = None, logger=None) -> dict:
+    """
+    Runs one purchase against a started ReplayServer and checks that it takes the steps of the
+    recorded session, e.g. after a plan or engine change. The replayed portal answers whatever
+    is posted, so the meter, amount and card are placeholders.
+    :param server: (ReplayServer)
+    :return: (dict) result (PurchaseResult), steps and recorded_steps (step names in order), misses
+             (requests the recording has no response for) and passed (bool)
+    """
+    logger = logger or logging.getLogger("INFO Logger")
+    plan = compile_plan(with_timeouts(replace(PUC_PLAN, url=server.start_url), timeout))
+    card = Card("4111111111111111", "Replay", "123", 12, date.today().year + 3)
+    meter, amount = "00000000000", 10.0
+    server.reset()
+    _, sequence = metrics.events_since(0)
+
+    if engine == "async":
+        card_router = CardRouter([WalletCard("replay", card, "Replay", max_concurrent=None)], logger=logger)
+        [(_, _, result)] = asyncio.run(purchase_batch_async(
+            [(meter, amount)], card_router, 1, headless=headless, governor=governor, chrome_path=chrome_path,
+            plan=plan, logger=logger))
+    else:
+        result = purchase_in_new_session(meter, amount, card, headless=headless, logger=logger, plan=plan,
+                                         governor=governor, timeout=timeout, element_timeout=element_timeout)
+
+    events, _ = metrics.events_since(sequence)
+    steps = [name[5:] for _, _, name, _, _ in events if name.startswith("step.")]
+    recorded_steps = [step["name"] for step in server.steps["steps"]]
+    misses = list(server.misses)
+    return {"result": result, "steps": steps, "recorded_steps": recorded_steps, "misses": misses,
+            "passed": steps == recorded_steps and not misses}
+
+
+def recommend(levels, max_error_rate: float = 0.01, margin: float = 2.0, knee: float = 0.9) -> dict:
+    """
+    Recommends settings from load test levels.
+    The pool size is the smallest concurrency that reaches knee of the best throughput among the
+    levels with at most max_error_rate timeouts and false failures and no setup errors. Timeouts
+    are the p99 step durations at that level times margin, rounded up to half a second.
+    :param levels: (list) Level summaries from LoadTest.run()
+    :return: (dict) pool_size, timeout, element_timeout, step_timeouts: {name: seconds}, notes: [str]
+    """
+    notes = []
+    healthy = [level for level in levels
+               if level["timeout_rate"] + level["false_failure_rate"] <= max_error_rate and not level[RESULT_SETUP]]
+    if healthy:
+        best = max(level["throughput"] for level in healthy)
+        chosen = min((level for level in healthy if level["throughput"] >= knee * best),
+                     key=lambda level: level["concurrency"])
+    else:
+        chosen = min(levels, key=lambda level: level["concurrency"])
+        notes.append(f"No level stayed under {max_error_rate:.0%} timeouts and false failures; "
+                     f"raise the timeouts and run again")
+
+    step_timeouts = {name: _round_up(max(step["p99"] * margin, 1.0))
+                     for name, step in chosen["steps"].items() if name not in UNTIMED_STEPS}
+    open_site = chosen["steps"].get("open_site")
+    if chosen[RESULT_TIMEOUT] or chosen[RESULT_FALSE_FAILURE]:
+        notes.append("Step durations at the chosen level were cut short by timeouts, the timeouts may still be low")
+    if chosen[RESULT_FALSE_FAILURE]:
+        notes.append(f"{chosen[RESULT_FALSE_FAILURE]} purchases were paid but not reported as successful")
+
+    return {
+        "pool_size": chosen["concurrency"] if healthy else None,
+        "timeout": max(step_timeouts.values()) if step_timeouts else None,
+        "element_timeout": _round_up(max(open_site["p99"] * margin, 1.0)) if open_site else None,
+        "step_timeouts": step_timeouts,
+        "notes": notes,
+    }
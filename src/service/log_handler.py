@@ -1,18 +1,27 @@
 # src.service.log_handler
 
 import logging
+from PySide6.QtCore import QObject, Signal
 from PySide6.QtWidgets import QStatusBar
 
 
 DEFAULT_TIMEOUT = 5000
 
+
+class _StatusBarBridge(QObject):
+    # queued to the status bar's thread when emitted from a worker thread
+    message = Signal(str, int)
+
+
 class LogHandler(logging.Handler):
-    """A custom logging handler that displays messages in QStatusBar"""
+    """A custom logging handler that displays messages in QStatusBar, from any thread"""
     def __init__(self, status_bar: QStatusBar, default_timeout: int = DEFAULT_TIMEOUT):
         super().__init__()
         self.status_bar = status_bar
         self.default_timeout = default_timeout
+        self._bridge = _StatusBarBridge()
+        self._bridge.message.connect(status_bar.showMessage)
 
     def emit(self, record: logging.LogRecord):
         msg = self.format(record)
-        self.status_bar.showMessage(msg, self.default_timeout)
+        self._bridge.message.emit(msg, self.default_timeout)
@@ -0,0 +1,94 @@
+# src.service.metrics
+
+import itertools
+import statistics
+import threading
+import time
+from collections import deque
+
+
+# timed samples kept for the dashboard
+EVENT_BUFFER_SIZE = 10000
+
+
+class Metrics:
+    """
+    Thread-safe in-process instrumentation surface.
+    Holds named gauges (last value wins) and counters (monotonic totals) that services
+    update and that the GUI, CLI or daemon read through snapshot(), plus a ring buffer of
+    timed samples (step and purchase latencies) that readers consume with events_since().
+    Writers only append under the lock; aggregation is left to the readers.
+    """
+    def __init__(self, buffer_size: int = EVENT_BUFFER_SIZE):
+        self._lock = threading.Lock()
+        self._gauges = {}
+        self._counters = {}
+        self._events = deque(maxlen=buffer_size)
+        self._sequence = 0
+
+    def set_gauge(self, name: str, value: float):
+        with self._lock:
+            self._gauges[name] = (value, time.time())
+
+    def incr(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def observe(self, name: str, value: float, label=None):
+        """
+        Records a sample in the ring buffer.
+        :param name: (str) e.g. "step.click_next_button" or "purchase"
+        :param value: (float) Usually a duration in seconds
+        :param label: Extra detail for the reader, e.g. (status, stage) of a purchase
+        """
+        with self._lock:
+            self._sequence += 1
+            self._events.append((self._sequence, time.time(), name, value, label))
+
+    def events_since(self, sequence: int):
+        """
+        Returns the samples recorded after sequence. Samples that already dropped out of the
+        ring buffer are skipped.
+        :return: (tuple) (list of (sequence, time, name, value, label), latest sequence)
+        """
+        with self._lock:
+            if not self._events or self._events[-1][0] <= sequence:
+                return [], self._sequence
+            start = max(0, sequence - self._events[0][0] + 1)
+            return list(itertools.islice(self._events, start, None)), self._sequence
+
+    def gauge(self, name: str, default=None):
+        with self._lock:
+            entry = self._gauges.get(name)
+        return entry[0] if entry else default
+
+    def counter(self, name: str) -> int:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self) -> dict:
+        """
+        Returns a copy of every metric.
+        :return: (dict) {"gauges": {name: value}, "counters": {name: total}}
+        """
+        with self._lock:
+            return {
+                "gauges": {name: value for name, (value, _) in self._gauges.items()},
+                "counters": dict(self._counters),
+            }
+
+
+def percentile(values, percent):
+    """
+    :param values: (list) Sorted samples
+    :return: (float) The percentile rounded to milliseconds, None without samples
+    """
+    if not values:
+        return None
+    if len(values) == 1:
+        return round(values[0], 3)
+    return round(statistics.quantiles(values, n=100, method="inclusive")[percent - 1], 3)
+
+
+# shared instance used across the application
+metrics = Metrics()
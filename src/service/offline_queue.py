@@ -0,0 +1,269 @@
+# src.service.offline_queue
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+import requests
+
+from model.purchase import STAGE_SETUP
+from .metrics import metrics
+
+
+# job states
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class OfflineQueue:
+    """
+    Durable SQLite queue of purchases that failed to start because the portal was unreachable.
+    Only purchases that never got past opening the payment page belong here; anything that may
+    have reached confirm_payment must never be queued or replayed.
+    A purchase queued from an interactive session keeps needing the user's confirmation when it
+    is replayed; only a process that can ask for it claims such jobs.
+    """
+    def __init__(self, path: str, max_attempts: int = 10, logger=None):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.logger = logger or logging.getLogger("INFO Logger")
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, meter TEXT, amount REAL, created REAL, state TEXT, attempts INTEGER, "
+            "owner INTEGER, message TEXT, updated REAL, confirm INTEGER NOT NULL DEFAULT 1)"
+        )
+        if "confirm" not in [row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")]:
+            # jobs queued before confirmations were recorded may have been confirmed, so they ask again
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN confirm INTEGER NOT NULL DEFAULT 1")
+        self._conn.commit()
+        self._recover()
+
+    def _recover(self):
+        """
+        Jobs left running by a process that died may have reached the payment step,
+        so they are marked failed for a person to check instead of being replayed.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT id, owner FROM jobs WHERE state = ?", (RUNNING,)).fetchall()
+            for job_id, owner in rows:
+                if owner and psutil.pid_exists(owner) and owner != os.getpid():
+                    continue
+                self._conn.execute(
+                    "UPDATE jobs SET state = ?, message = ?, updated = ? WHERE id = ?",
+                    (FAILED, "Interrupted while running, check the portal before retrying", time.time(), job_id)
+                )
+            self._conn.commit()
+
+    def enqueue(self, meter: str, amount: float, confirm: bool = True) -> str:
+        """
+        Queues a purchase. A purchase already pending for the same meter and amount is not queued twice.
+        :param confirm: (bool) The replay must ask the user to confirm before the payment is submitted
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE meter = ? AND amount = ? AND state IN (?, ?)",
+                (meter, round(amount, 2), PENDING, RUNNING)
+            ).fetchone()
+            if row:
+                return row[0]
+            job_id = uuid.uuid4().hex
+            now = time.time()
+            self._conn.execute(
+                "INSERT INTO jobs (id, meter, amount, created, state, attempts, owner, message, updated, confirm) "
+                "VALUES (?, ?, ?, ?, ?, 0, NULL, NULL, ?, ?)",
+                (job_id, meter, round(amount, 2), now, PENDING, now, int(confirm))
+            )
+            self._conn.commit()
+        self.logger.info(f"Purchase for meter {meter} queued until the portal is available")
+        return job_id
+
+    def pending_count(self, with_confirm: bool = True) -> int:
+        """:param with_confirm: (bool) Count jobs that need the user's confirmation"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE state = ? AND confirm <= ?", (PENDING, int(with_confirm))
+            ).fetchone()[0]
+
+    def claim(self, limit: int, with_confirm: bool = True):
+        """
+        Atomically claims up to limit pending jobs for this process.
+        :param with_confirm: (bool) Claim jobs that need the user's confirmation too
+        :return: (list) (id, meter, amount, confirm) tuples, oldest first
+        """
+        claimed = []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, meter, amount, confirm FROM jobs WHERE state = ? AND confirm <= ? ORDER BY created LIMIT ?",
+                (PENDING, int(with_confirm), limit)
+            ).fetchall()
+            for job_id, meter, amount, confirm in rows:
+                cursor = self._conn.execute(
+                    "UPDATE jobs SET state = ?, owner = ?, attempts = attempts + 1, updated = ? "
+                    "WHERE id = ? AND state = ?",
+                    (RUNNING, os.getpid(), time.time(), job_id, PENDING)
+                )
+                if cursor.rowcount:
+                    claimed.append((job_id, meter, amount, bool(confirm)))
+            self._conn.commit()
+        return claimed
+
+    def finish(self, job_id: str, message: str, failed: bool = False):
+        self._set_state(job_id, FAILED if failed else DONE, message)
+
+    def retry_later(self, job_id: str, message: str):
+        """Puts a job that again failed to start back in the queue, up to max_attempts."""
+        with self._lock:
+            attempts = self._conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if attempts and attempts[0] >= self.max_attempts:
+            self._set_state(job_id, FAILED, f"Gave up after {attempts[0]} attempts: {message}")
+        else:
+            self._set_state(job_id, PENDING, message)
+
+    def _set_state(self, job_id, state, message):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, message = ?, owner = NULL, updated = ? WHERE id = ?",
+                (state, message, time.time(), job_id)
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class PortalHealthProbe:
+    """Cheap portal availability check: a HEAD request (GET if HEAD is refused), no browser."""
+    def __init__(self, url: str, timeout: float = 5.0):
+        self.url = url
+        self.timeout = timeout
+
+    def healthy(self) -> bool:
+        try:
+            response = requests.head(self.url, timeout=self.timeout, allow_redirects=True)
+            if response.status_code in (405, 501):
+                response = requests.get(self.url, timeout=self.timeout, stream=True)
+                response.close()
+            return response.status_code < 500
+        except requests.RequestException:
+            return False
+
+
+class QueueDrainer:
+    """
+    Background thread that replays queued purchases once the portal is reachable again.
+    The portal is probed every interval seconds while jobs are pending; when it answers,
+    up to concurrency jobs are replayed at a time through the purchase callable. Jobs that need
+    the user's confirmation are left for a drainer that can ask for it.
+    """
+    def __init__(self, offline_queue, probe, purchase, concurrency: int = 2, interval: float = 30.0,
+                 can_confirm: bool = False, on_change=None, logger=None):
+        """
+        :param offline_queue: (OfflineQueue)
+        :param probe: (PortalHealthProbe)
+        :param purchase: (callable) purchase(meter, amount, confirm) -> PurchaseResult or None, confirm (bool)
+                         being whether the user must confirm the payment
+        :param can_confirm: (bool) purchase can ask the user, so jobs that need a confirmation are replayed too
+        :param concurrency: (int) Jobs replayed at the same time
+        :param interval: (float) Seconds between health probes
+        :param on_change: (callable) on_change(pending_count) after the queue changes
+        """
+        self.queue = offline_queue
+        self.probe = probe
+        self.purchase = purchase
+        self.concurrency = concurrency
+        self.interval = interval
+        self.can_confirm = can_confirm
+        self.on_change = on_change
+        self.logger = logger or logging.getLogger("INFO Logger")
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="QueueDrainer", daemon=True)
+        self._thread.start()
+        self._notify()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def refresh(self):
+        """Publishes the pending count, e.g. after a new job was queued."""
+        self._notify()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.drain()
+            except Exception as e:
+                self.logger.warning(f"Offline queue drain failed: {e}")
+
+    def drain(self):
+        """Replays pending jobs while the portal stays healthy."""
+        if not self.queue.pending_count(self.can_confirm):
+            return
+        if not self.probe.healthy():
+            metrics.set_gauge("offline_queue.portal_up", 0)
+            return
+        metrics.set_gauge("offline_queue.portal_up", 1)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            while not self._stop.is_set():
+                jobs = self.queue.claim(self.concurrency, self.can_confirm)
+                if not jobs:
+                    break
+                outcomes = list(pool.map(self._replay, jobs))
+                self._notify()
+                # stop as soon as the portal drops again; the rest waits for the next probe
+                if not all(outcomes):
+                    break
+
+    def _replay(self, job) -> bool:
+        job_id, meter, amount, confirm = job
+        self.logger.info(f"Replaying queued purchase for meter {meter}")
+        try:
+            result = self.purchase(meter, amount, confirm)
+        except Exception as e:
+            # the purchase may have reached the payment step, never replay it
+            self.logger.error(f"Queued purchase for meter {meter} failed: {e}")
+            self.queue.finish(job_id, str(e), failed=True)
+            return True
+
+        if result is None:
+            self.queue.retry_later(job_id, "Purchase did not start")
+            return False
+        if result.stage == STAGE_SETUP:
+            self.queue.retry_later(job_id, result.message)
+            return False
+
+        self.queue.finish(job_id, result.message, failed=not result.success)
+        metrics.incr(f"offline_queue.{result.status}")
+        self.logger.info(f"Queued purchase for meter {meter}: {result.status} {result.message}")
+        return True
+
+    def _notify(self):
+        count = self.queue.pending_count()
+        metrics.set_gauge("offline_queue.pending", count)
+        if self.on_change:
+            self.on_change(count)
@@ -0,0 +1,70 @@
+# src.service.outbox
+
+import json
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+from .metrics import metrics
+
+
+CHANNEL_EMAIL = "email"
+CHANNEL_SMS = "sms"
+
+
+def channel_for(recipient: str) -> str:
+    """:return: (str) CHANNEL_EMAIL for an email address, otherwise CHANNEL_SMS"""
+    return CHANNEL_EMAIL if "@" in recipient else CHANNEL_SMS
+
+
+class Outbox(ABC):
+    """
+    Delivers receipts.
+    send() gets a whole batch of OutboxMessage so an SMS or email gateway can use its bulk
+    API; it returns the number of messages accepted. An SMTP or SMS gateway outbox plugs in
+    by implementing send().
+    """
+    @abstractmethod
+    def send(self, messages) -> int:
+        """:return: (int) Messages accepted"""
+
+    def close(self):
+        pass
+
+
+class FileOutbox(Outbox):
+    """
+    Local stand-in for an SMS or email gateway.
+    Each batch is written as one JSON lines file per channel:
+        <directory>/<channel>/<stamp>-<n>.jsonl
+    """
+    def __init__(self, directory: str, logger=None):
+        self.directory = directory
+        self.logger = logger or logging.getLogger("INFO Logger")
+        self._lock = threading.Lock()
+        self._batches = 0
+
+    def send(self, messages) -> int:
+        by_channel = {}
+        for message in messages:
+            by_channel.setdefault(message.channel, []).append(message)
+
+        with self._lock:
+            self._batches += 1
+            batch = self._batches
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+
+        sent = 0
+        for channel, channel_messages in by_channel.items():
+            directory = os.path.join(self.directory, channel)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{stamp}-{batch}.jsonl")
+            with open(path, "a", encoding="utf-8") as f:
+                for message in channel_messages:
+                    f.write(json.dumps(message.to_dict()) + "\n")
+            sent += len(channel_messages)
+            self.logger.info(f"{len(channel_messages)} {channel} receipt(s) written to {path}")
+        metrics.incr("outbox.sent", sent)
+        return sent
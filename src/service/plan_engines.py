@@ -0,0 +1,184 @@
+# src.service.plan_engines
+
+import logging
+from abc import ABC, abstractmethod
+
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.wait import WebDriverWait
+
+from .flow_plan import CARD_PARAMS, DETAIL_TIMEOUT, StepFailed
+
+
+# returns the elements for all ids in one round-trip, or null until every one is visible and enabled
+FIND_READY_JS = (
+    "const els = arguments[0].map(id => document.getElementById(id));"
+    "return els.every(el => el && el.offsetParent !== null && !el.disabled) ? els : null;"
+)
+# returns the trimmed text of all ids in one round-trip, or null until every one is visible
+READ_TEXT_JS = (
+    "const els = arguments[0].map(id => document.getElementById(id));"
+    "return els.every(el => el && el.offsetParent !== null) ? els.map(el => el.innerText.trim()) : null;"
+)
+
+
+class PlanEngine(ABC):
+    """
+    Executes the steps of a compiled plan (see service.flow_plan) against one session.
+    run() returns the step output (a dict of variables for "read", (status, message) for
+    "outcome") and raises StepFailed when the step does not reach its expected outcome.
+    A direct-HTTP engine for portals that do not need a browser plugs in the same way.
+    """
+    @abstractmethod
+    def open(self, url: str, ready) -> bool:
+        """
+        Loads a plan's start page, e.g. open(plan.url, plan.ready).
+        :param url: (str) Start page
+        :param ready: (tuple) Locator of the element that shows the page loaded
+        :return: (bool) True when the ready element is shown
+        """
+
+    @abstractmethod
+    def run(self, compiled, variables: dict):
+        """Runs one compiled step. :raises StepFailed: when the step does not reach its expected outcome"""
+
+    def after_step(self, compiled):
+        """Runs after every step, whether it failed or not."""
+
+    def close(self):
+        pass
+
+
+class SeleniumEngine(PlanEngine):
+    """
+    Runs plans on a BrowserAutomator session, keeping its recorder, profiler and failure artifact hooks.
+    Fields located by id are looked up and read in a single script call instead of one call per element.
+    """
+    def __init__(self, automator, logger=None):
+        self.automator = automator
+        self.logger = logger or automator.logger or logging.getLogger("INFO Logger")
+        self._held = None
+
+    @property
+    def driver(self):
+        return self.automator.driver
+
+    def _wait(self, timeout):
+        return WebDriverWait(self.driver, timeout)
+
+    def _fail(self, step, message=None):
+        # the flow goes on after an optional step, so its page is not captured while the flow drives it
+        if not step.optional:
+            self.automator._capture_failure(step.name)
+        return StepFailed(message)
+
+    def open(self, url: str, ready) -> bool:
+        return bool(self.automator.open_site(url, ready))
+
+    def run(self, compiled, variables: dict):
+        step = compiled.step
+        handler = getattr(self, f"_{step.action}")
+        try:
+            return handler(compiled, variables)
+        except StepFailed:
+            raise
+        except Exception as e:
+            self.logger.error(f"Step {step.name} failed: {e}")
+            raise self._fail(step)
+
+    def after_step(self, compiled):
+        self.automator._after_step(compiled.step.name)
+
+    def _find_ready(self, compiled):
+        """Waits until every field is usable and returns the elements."""
+        step = compiled.step
+        if compiled.field_ids:
+            return self._wait(step.timeout).until(lambda d: d.execute_script(FIND_READY_JS, list(compiled.field_ids)))
+        return [self._wait(step.timeout).until(EC.element_to_be_clickable(locator)) for locator, _ in step.fields]
+
+    def _fill(self, compiled, variables):
+        step = compiled.step
+        inputs = [locator for locator, name in step.fields if name in CARD_PARAMS]
+        if inputs:
+            self.automator.register_card_secrets(*(variables.get(name) for name in CARD_PARAMS), inputs=inputs)
+        for element, (_, name) in zip(self._find_ready(compiled), step.fields):
+            element.clear()
+            element.send_keys(str(variables[name]))
+
+    def _pick_expiry(self, compiled, variables):
+        step = compiled.step
+        self.automator.select_expiry_date(int(variables["exp_month"]), int(variables["exp_year"]), step.locator,
+                                          step.picker)
+
+    def _click(self, compiled, variables):
+        self._wait(compiled.step.timeout).until(EC.element_to_be_clickable(compiled.step.locator)).click()
+
+    def _check(self, compiled, variables):
+        step = compiled.step
+
+        def settled(driver):
+            # either the fail message or the next page shows up, so a valid input does not wait out the timeout
+            for element in driver.find_elements(*step.fail):
+                if element.is_displayed() and element.text.strip():
+                    return [element.text.strip()]
+            return any(e.is_displayed() for e in driver.find_elements(*step.proceed)) and [""]
+
+        message = self._wait(step.timeout).until(settled)[0]
+        if message:
+            raise self._fail(step, message)
+
+    def _read(self, compiled, variables):
+        step = compiled.step
+        if compiled.field_ids:
+            texts = self._wait(step.timeout).until(lambda d: d.execute_script(READ_TEXT_JS, list(compiled.field_ids)))
+        else:
+            texts = [self._wait(step.timeout).until(EC.visibility_of_element_located(locator)).text.strip()
+                     for locator, _ in step.fields]
+        return {name: text for (_, name), text in zip(step.fields, texts)}
+
+    def _await_clickable(self, compiled, variables):
+        self._held = self._wait(compiled.step.timeout).until(EC.element_to_be_clickable(compiled.step.locator))
+
+    def _press(self, compiled, variables):
+        element, self._held = self._held, None
+        element.click()
+        self.logger.info("Payment submitted.")
+
+    def _outcome(self, compiled, variables):
+        step = compiled.step
+        self.logger.info("Please be patient as we process the payment.")
+        try:
+            self._wait(step.timeout).until(EC.any_of(
+                EC.visibility_of_element_located(step.success),
+                EC.visibility_of_element_located(step.fail),
+            ))
+        except Exception as e:
+            self.automator._capture_failure(step.name)
+            return None, f"Automation error during result check: {e}"
+
+        token = self._text(step.success)
+        if token:
+            self.logger.info("Payment successful. Token received")
+            return True, token
+
+        title = self._text(step.fail)
+        if title and (not step.fail_text or step.fail_text in title):
+            # the detail may render after the title; without it the title is the message
+            detail = (self._text(step.detail, DETAIL_TIMEOUT) if step.detail else "") or title
+            self.logger.critical(f"Payment failed: {detail}")
+            self.automator._capture_failure(step.name)
+            return False, detail
+
+        self.automator._capture_failure(step.name)
+        return None, "Unknown outcome: Neither token nor explicit error found."
+
+    def _text(self, locator, timeout: float = 0):
+        """Trimmed text of the element if it is shown, waiting up to timeout seconds for it to show."""
+        if timeout:
+            try:
+                return self._wait(timeout).until(EC.visibility_of_element_located(locator)).text.strip()
+            except TimeoutException:
+                return ""
+        elements = self.driver.find_elements(*locator)
+        return elements[0].text.strip() if elements and elements[0].is_displayed() else ""
+
@@ -0,0 +1,71 @@
+# src.service.plans
+
+from dataclasses import replace
+
+from selenium.webdriver.common.by import By
+
+from model.purchase import *
+from static.constants import URL
+from .flow_plan import ExpiryPicker, Plan, Step, compile_plan, with_timeouts
+from .locators import (FirstPageLocators, DatePickerLocators, SecondPageLocators, ConfirmationPopupLocators,
+                       ResultPageLocators)
+
+
+PUC_PLAN = Plan(
+    name="puc",
+    url=URL,
+    ready=FirstPageLocators.METER_INPUT,
+    steps=(
+        Step("enter_payment_details", "fill", STAGE_DETAILS, fields=(
+            (FirstPageLocators.METER_INPUT, "meter"),
+            (FirstPageLocators.CC_NUMBER_INPUT, "card_number"),
+            (FirstPageLocators.CC_NAME_INPUT, "card_name"),
+            (FirstPageLocators.CC_CODE_INPUT, "card_code"),
+        ), error="Error entering payment details"),
+        Step("select_expiry_date", "pick_expiry", STAGE_DETAILS, locator=FirstPageLocators.EXPIRY_POPUP_BUTTON,
+             picker=ExpiryPicker(DatePickerLocators.MONTH_XPATH_TEMPLATE, DatePickerLocators.YEAR_XPATH_TEMPLATE,
+                                 DatePickerLocators.VISIBLE_YEARS_XPATH, DatePickerLocators.NEXT_YEAR_BUTTON,
+                                 DatePickerLocators.OK_BUTTON),
+             error="Error entering payment details"),
+        Step("click_next_button", "click", STAGE_DETAILS, locator=FirstPageLocators.NEXT_BUTTON,
+             error="Error clicking next button"),
+        Step("check_meter_message", "check", STAGE_METER, fail=FirstPageLocators.METER_ERROR_LABEL,
+             proceed=SecondPageLocators.OTHER_AMOUNT_RADIO, status=STATUS_FAILED,
+             error="Unable to continue with payment. Check meter number."),
+        Step("select_other_amount", "click", STAGE_AMOUNT, locator=SecondPageLocators.OTHER_AMOUNT_RADIO,
+             error="Unable to continue with payment. Check meter number."),
+        Step("enter_purchase_amount", "fill", STAGE_AMOUNT, fields=((SecondPageLocators.AMOUNT_INPUT, "amount"),),
+             error="Unable to continue with payment. Check meter number."),
+        Step("get_customer_name_parts", "read", STAGE_AMOUNT, fields=(
+            (SecondPageLocators.CUSTOMER_NAME_FIRST, "first_name"),
+            (SecondPageLocators.CUSTOMER_NAME_LAST, "last_name"),
+        ), optional=True),
+        Step("click_next_button", "click", STAGE_AMOUNT, locator=SecondPageLocators.NEXT_BUTTON,
+             error="Error clicking next button"),
+        Step("load_payment_popup", "await_clickable", STAGE_CONFIRM, locator=ConfirmationPopupLocators.SUBMIT_BUTTON,
+             error="Error loading payment confirmation"),
+        Step("confirm", "confirm", STAGE_CONFIRM),
+        # the click may still have reached the portal
+        Step("confirm_payment", "press", STAGE_SUBMITTED, error="Payment submission failed."),
+        Step("get_token_or_error", "outcome", STAGE_RESULT, success=ResultPageLocators.TOKEN_LABEL,
+             fail=ResultPageLocators.ERROR_TITLE, fail_text="Error Message",
+             detail=(By.XPATH, ResultPageLocators.ERROR_DETAIL_XPATH), status=STATUS_UNKNOWN),
+    ),
+)
+
+# plans are validated and compiled once, when the module is imported
+PLAN_SOURCES = {plan.name: plan for plan in (PUC_PLAN,)}
+PLANS = {name: compile_plan(plan) for name, plan in PLAN_SOURCES.items()}
+DEFAULT_PLAN = "puc"
+
+
+def build_plan(url: str = None, timeout: float = None, timeouts: dict = None, name: str = DEFAULT_PLAN):
+    """
+    Compiles a registered plan for another portal URL or other step timeouts, e.g. after the
+    settings changed. Callers keep the result; compiling is not meant for every purchase.
+    :return: (CompiledPlan)
+    """
+    plan = PLAN_SOURCES[name]
+    if url:
+        plan = replace(plan, url=url)
+    return compile_plan(with_timeouts(plan, timeout, timeouts))
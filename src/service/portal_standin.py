@@ -0,0 +1,306 @@
+# src.service.portal_standin
+
+import argparse
+import hashlib
+import html
+import logging
+import random
+import threading
+import time
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+STEP1_PATH = "/ADR/PaymentADR_Step1.aspx"
+STEP2_PATH = "/ADR/PaymentADR_Step2.aspx"
+
+# what the stand-in did with each meter, the ground truth a load test checks results against
+OUTCOME_PENDING = "pending"            # the purchase never reached a final page
+OUTCOME_METER_ERROR = "meter_error"    # injected meter error on the first page
+OUTCOME_SERVER_ERROR = "server_error"  # injected HTTP 500 on a postback
+OUTCOME_DECLINED = "declined"          # injected payment error on the result page
+OUTCOME_TOKEN = "token"                # payment accepted, token shown
+
+INJECTED_FAILURES = (OUTCOME_METER_ERROR, OUTCOME_SERVER_ERROR, OUTCOME_DECLINED)
+
+MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+PAGE = """<!DOCTYPE html>
+<html><head><title>Prepaid Purchase</title></head>
+<body>{body}</body></html>"""
+
+# expiry picker with the ids and markup the automation navigates (RadMonthYearPicker)
+PICKER = """
+<a id="ctl00_ContentPlaceHolder1_dtpExpirationDate_popupButton" href="#"
+   onclick="document.getElementById('picker').style.display = 'block'; return false;">Expiry</a>
+<input type="hidden" name="expiry" id="expiry">
+<div id="picker" style="display: none">
+  <table><tr>{months}</tr><tr id="years"></tr></table>
+  <a id="ctl00_ContentPlaceHolder1_dtpExpirationDate_dtpExpirationDate_NavigationPrevLink" href="#"
+     onclick="showYears(firstYear - 10); return false;">&lt;&lt;</a>
+  <a id="ctl00_ContentPlaceHolder1_dtpExpirationDate_dtpExpirationDate_NavigationNextLink" href="#"
+     onclick="showYears(firstYear + 10); return false;">&gt;&gt;</a>
+  <input type="button" id="rcMView_OK" value="OK"
+         onclick="document.getElementById('expiry').value = month + '/' + year;
+                  document.getElementById('picker').style.display = 'none';">
+</div>
+<script>
+  var month = null, year = null, firstYear = {first_year};
+  function showYears(start) {{
+    firstYear = start;
+    var row = document.getElementById('years');
+    row.innerHTML = '';
+    for (var y = start; y < start + 10; y++) {{
+      row.innerHTML += '<td id="rcMView_' + y + '"><a href="#" onclick="year = ' + y + '; return false;">' + y + '</a></td>';
+    }}
+  }}
+  showYears(firstYear);
+</script>"""
+
+STEP1 = """
+<form method="post" action="{path}">
+  <span id="ContentPlaceHolder1_lblmeter" style="color: red">{meter_error}</span>
+  <input id="ctl00_ContentPlaceHolder1_radTxtMeter" name="meter">
+  <input id="ctl00_ContentPlaceHolder1_rtxtCreditCardNumber" name="card_number">
+  <input id="ctl00_ContentPlaceHolder1_txtCardholderName" name="card_name">
+  <input id="ctl00_ContentPlaceHolder1_txtCardCode" name="card_code">
+  {picker}
+  <input type="submit" id="ctl00_ContentPlaceHolder1_btnNext_input" value="Next">
+</form>"""
+
+STEP2 = """
+<form method="post" action="{path}">
+  <input type="hidden" name="meter" value="{meter}">
+  <span id="ctl00_ContentPlaceHolder1_radLblConsumerFirstName">{first_name}</span>
+  <span id="ctl00_ContentPlaceHolder1_radLblConsumerSurname">{last_name}</span>
+  <input type="radio" name="choice" value="20">20
+  <input type="radio" name="choice" value="other" id="ctl00_ContentPlaceHolder1_radlAmount_ctl04"
+         onclick="document.getElementById('ctl00_ContentPlaceHolder1_radNumericTxtAmount').disabled = false;">Other
+  <input id="ctl00_ContentPlaceHolder1_radNumericTxtAmount" name="amount" disabled>
+  <input type="submit" id="ctl00_ContentPlaceHolder1_btnNext_input" value="Next">
+</form>"""
+
+POPUP = """
+<form method="post" action="{path}">
+  <input type="hidden" name="meter" value="{meter}">
+  <input type="hidden" name="amount" value="{amount}">
+  <input type="hidden" name="submit" value="1">
+  <div id="RadWindow1">
+    <p>Pay ${amount} for meter {meter}?</p>
+    <input type="submit" id="ctl00_ContentPlaceHolder1_RadWindow1_C_rbtnSave_input" value="Submit">
+  </div>
+</form>"""
+
+TOKEN = """<span id="ctl00_ContentPlaceHolder1_radLblVouchers">{token}</span>"""
+
+ERROR = """<div id="LeftTitle">Error Message</div>
+<div style="font-size: 14px; text-align: left; word-break: break-all;">{detail}</div>"""
+
+
+class PortalStandIn:
+    """
+    Local stand-in for the payment portal, for load tests.
+    Serves the purchase pages with the element ids the automation uses, and injects latency
+    (latency plus up to jitter seconds on every response), slow postbacks (slow_rate of the
+    postbacks take slow_seconds longer) and failures: meter errors, HTTP 500s and declined
+    payments at the given rates. What happened to each meter is kept in outcome() so the
+    results the automation reports can be checked against it.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.2, jitter: float = 0.1,
+                 slow_rate: float = 0.0, slow_seconds: float = 5.0, meter_error_rate: float = 0.0,
+                 server_error_rate: float = 0.0, decline_rate: float = 0.0, seed: int = None, logger=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.slow_rate = slow_rate
+        self.slow_seconds = slow_seconds
+        self.meter_error_rate = meter_error_rate
+        self.server_error_rate = server_error_rate
+        self.decline_rate = decline_rate
+        self.logger = logger or logging.getLogger("INFO Logger")
+
+        self._random = random.Random(seed)
+        self._cond = threading.Condition()
+        self._outcomes = {}
+        self._in_flight = 0
+        self.requests = 0
+
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def start_url(self) -> str:
+        return self.base_url + STEP1_PATH
+
+    def outcome(self, meter: str):
+        """:return: (str) One of the OUTCOME_* values, None if the meter was never submitted"""
+        with self._cond:
+            return self._outcomes.get(meter)
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        """Waits for requests still being answered, e.g. slow postbacks the client gave up on."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._in_flight, timeout)
+
+    def reset(self):
+        with self._cond:
+            self._outcomes.clear()
+            self.requests = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="PortalStandIn", daemon=True)
+        self._thread.start()
+        self.logger.info(f"Portal stand-in on {self.start_url}")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ------------------------- simulated portal -------------------------
+
+    def _roll(self, rate: float) -> bool:
+        if not rate:
+            return False
+        with self._cond:
+            return self._random.random() < rate
+
+    def _delay(self, postback: bool):
+        with self._cond:
+            self.requests += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            if postback and self.slow_rate and self._random.random() < self.slow_rate:
+                delay += self.slow_seconds
+        if delay > 0:
+            time.sleep(delay)
+
+    def _record(self, meter: str, outcome: str):
+        with self._cond:
+            self._outcomes[meter] = outcome
+
+    def respond(self, method: str, path: str, form: dict):
+        """
+        :return: (tuple) (status code, html) for a request
+        """
+        with self._cond:
+            self._in_flight += 1
+        try:
+            return self._respond(method, path, form)
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+
+    def _respond(self, method: str, path: str, form: dict):
+        path = urlsplit(path).path
+        meter = form.get("meter", "")
+        self._delay(postback=method == "POST")
+
+        if path == STEP1_PATH and method == "GET":
+            return 200, self._step1()
+        if method != "POST" or path not in (STEP1_PATH, STEP2_PATH):
+            return 404, PAGE.format(body="Not found")
+
+        if meter and self._roll(self.server_error_rate):
+            self._record(meter, OUTCOME_SERVER_ERROR)
+            return 500, PAGE.format(body="Server Error in '/' Application.")
+
+        if path == STEP1_PATH:
+            if not meter or self._roll(self.meter_error_rate):
+                if meter:
+                    self._record(meter, OUTCOME_METER_ERROR)
+                return 200, self._step1("Meter number not found")
+            self._record(meter, OUTCOME_PENDING)
+            return 200, PAGE.format(body=STEP2.format(path=STEP2_PATH, meter=html.escape(meter),
+                                                      first_name="Load", last_name=f"Test {meter[-4:]}"))
+
+        amount = html.escape(form.get("amount", ""))
+        if not form.get("submit"):
+            return 200, PAGE.format(body=POPUP.format(path=STEP2_PATH, meter=html.escape(meter), amount=amount))
+
+        if self._roll(self.decline_rate):
+            self._record(meter, OUTCOME_DECLINED)
+            return 200, PAGE.format(body=ERROR.format(detail="Transaction declined by the card issuer"))
+        self._record(meter, OUTCOME_TOKEN)
+        return 200, PAGE.format(body=TOKEN.format(token=self._token(meter, amount)))
+
+    def _step1(self, meter_error: str = ""):
+        months = "".join(f'<td id="rcMView_{name}"><a href="#" onclick="month = {number}; return false;">{name}</a></td>'
+                         for number, name in enumerate(MONTHS, start=1))
+        picker = PICKER.format(months=months, first_year=date.today().year)
+        return PAGE.format(body=STEP1.format(path=STEP1_PATH, meter_error=meter_error, picker=picker))
+
+    @staticmethod
+    def _token(meter: str, amount: str) -> str:
+        digits = str(int(hashlib.sha256(f"{meter}:{amount}".encode()).hexdigest(), 16))[:20]
+        return " ".join(digits[i:i + 4] for i in range(0, 20, 4))
+
+    def _handler_class(self):
+        portal = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _serve(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length).decode("utf-8", "replace") if length else ""
+                form = {name: values[0] for name, values in parse_qs(body).items()}
+
+                status, page = portal.respond(self.command, self.path, form)
+                content = page.encode("utf-8")
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "text/html; charset=utf-8")
+                    self.send_header("Content-Length", str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+                except (BrokenPipeError, ConnectionResetError):
+                    # the browser gave up waiting or navigated away
+                    portal.logger.debug(f"Client went away before {self.command} {self.path} was answered")
+
+            do_GET = do_POST = _serve
+
+            def log_message(self, format, *args):
+                portal.logger.debug(format % args)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a stand-in payment portal locally")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Up to this many more seconds at random")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Share of postbacks that are slow")
+    parser.add_argument("--slow-seconds", type=float, default=5.0, help="Extra seconds for a slow postback")
+    parser.add_argument("--meter-error-rate", type=float, default=0.0)
+    parser.add_argument("--server-error-rate", type=float, default=0.0)
+    parser.add_argument("--decline-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    portal = PortalStandIn(port=args.port, latency=args.latency, jitter=args.jitter, slow_rate=args.slow_rate,
+                           slow_seconds=args.slow_seconds, meter_error_rate=args.meter_error_rate,
+                           server_error_rate=args.server_error_rate, decline_rate=args.decline_rate,
+                           logger=logging.getLogger())
+    portal.start()
+    print(f"Start URL: {portal.start_url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        portal.stop()
+
+
+if __name__ == '__main__':
+    main()
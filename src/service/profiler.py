@@ -0,0 +1,134 @@
+# src.service.profiler
+
+import cProfile
+import contextlib
+import functools
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+from datetime import datetime
+
+
+# trace categories collected from the browser while profiling
+TRACE_CATEGORIES = "devtools.timeline,blink.user_timing,loading,v8.execute,disabled-by-default-devtools.timeline"
+
+
+class ProfileSession:
+    """
+    Profiles one purchase or a whole batch.
+    Python code is profiled with cProfile in one thread at a time: cProfile cannot be enabled in
+    two threads at once (Python 3.12+ raises), so while one thread is profiled, others entering
+    profile_thread() run unprofiled. Time spent waiting for the user is left out, see unprofiled().
+    Browser trace events are collected from the Chromium performance log. stop() writes
+    timestamped files that standard viewers open:
+        <stamp>-<label>.prof        pstats / snakeviz
+        <stamp>-<label>.trace.json  chrome://tracing / Perfetto
+    """
+    def __init__(self, output_dir: str, label: str = "purchase", logger=None):
+        self.output_dir = output_dir
+        self.label = label
+        self.logger = logger or logging.getLogger("INFO Logger")
+        self._lock = threading.Lock()
+        self._profiles = []
+        self._trace_events = []
+        self._active = None
+        self._local = threading.local()
+        self._paused = 0.0
+        self._started = None
+        self.files = []
+
+    def start(self):
+        self._started = time.perf_counter()
+        self.logger.info(f"Profiling {self.label}")
+        return self
+
+    @contextlib.contextmanager
+    def profile_thread(self):
+        """Profiles the calling thread for the duration of the block, unless another thread is profiled."""
+        with self._lock:
+            busy = self._active is not None
+            if not busy:
+                profile = cProfile.Profile()
+                self._active = threading.get_ident()
+                self._profiles.append(profile)
+        if busy:
+            yield
+            return
+
+        self._local.profile = profile
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self._local.profile = None
+            with self._lock:
+                self._active = None
+
+    def unprofiled(self, func):
+        """Wraps func so profiling of the calling thread pauses while it runs, e.g. a confirmation dialog."""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = getattr(self._local, "profile", None)
+            if not profile:
+                return func(*args, **kwargs)
+            profile.disable()
+            paused = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._paused += time.perf_counter() - paused
+                profile.enable()
+        return wrapper
+
+    def collect_performance_log(self, entries):
+        """
+        Keeps the trace events from a batch of performance log entries.
+        :param entries: (list) Entries returned by driver.get_log("performance")
+        """
+        events = []
+        for item in entries:
+            message = json.loads(item["message"])["message"]
+            if message.get("method") == "Tracing.dataCollected":
+                events.append(message["params"])
+        with self._lock:
+            self._trace_events.extend(events)
+
+    def stop(self):
+        """Writes the profile and trace files. Returns the list of files written."""
+        wall = time.perf_counter() - (self._started or time.perf_counter()) - self._paused
+        os.makedirs(self.output_dir, exist_ok=True)
+        prefix = os.path.join(self.output_dir, f"{datetime.now():%Y%m%d-%H%M%S}-{self.label}")
+
+        with self._lock:
+            profiles = [p for p in self._profiles if p.getstats()]
+            trace_events = list(self._trace_events)
+
+        if profiles:
+            stats = pstats.Stats(*profiles)
+            stats.dump_stats(f"{prefix}.prof")
+            self.files.append(f"{prefix}.prof")
+            self._log_breakdown(stats, wall)
+
+        if trace_events:
+            with open(f"{prefix}.trace.json", "w", encoding="utf-8") as f:
+                json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+            self.files.append(f"{prefix}.trace.json")
+
+        self.logger.info(f"Profile saved: {', '.join(os.path.basename(p) for p in self.files) or 'nothing captured'}")
+        return self.files
+
+    def _log_breakdown(self, stats, wall):
+        """Logs how much of the wall time went to WebDriver round-trips versus our own code."""
+        webdriver_time = 0.0
+        for (filename, _, function), (_, _, _, cumtime, _) in stats.stats.items():
+            if function == "execute" and filename.replace("\\", "/").endswith("selenium/webdriver/remote/webdriver.py"):
+                webdriver_time += cumtime
+        self.logger.info(
+            f"Profile {self.label}: wall {wall:.2f}s, WebDriver round-trips {webdriver_time:.2f}s "
+            f"({webdriver_time / wall * 100 if wall else 0:.0f}%)"
+        )
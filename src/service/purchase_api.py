@@ -0,0 +1,126 @@
+# src.service.purchase_api
+
+import hmac
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from .purchase_service import DuplicatePurchaseError, QueueFullError
+from .validate import Validate
+
+
+# longest long-poll a client may ask for, in seconds
+MAX_WAIT = 120
+
+
+class PurchaseApiServer(ThreadingHTTPServer):
+    """
+    Localhost HTTP/JSON API in front of a PurchaseService.
+
+        POST /purchases            {"meter": "...", "amount": 20, "priority": 10}
+                                   202 new job, 200 attached to an existing job, 429 queue full
+        GET  /purchases/<id>       job state and, once done, the token; ?wait=<seconds> long-polls
+        GET  /status               queue depth, latency percentiles and metrics
+    """
+    daemon_threads = True
+
+    def __init__(self, service, host: str = "127.0.0.1", port: int = 8787, token: str = None, logger=None):
+        self.service = service
+        self.token = token
+        self.logger = logger or logging.getLogger("INFO Logger")
+        super().__init__((host, port), PurchaseApiHandler)
+
+
+class PurchaseApiHandler(BaseHTTPRequestHandler):
+    server: PurchaseApiServer
+
+    def _send_json(self, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self) -> bool:
+        if not self.server.token:
+            return True
+        supplied = self.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+        if hmac.compare_digest(supplied, self.server.token):
+            return True
+        self._send_json(401, {"error": "Unauthorized"})
+        return False
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        parts = urlsplit(self.path)
+        path = parts.path.rstrip("/")
+
+        if path == "/status":
+            self._send_json(200, self.server.service.status())
+            return
+
+        if path.startswith("/purchases/"):
+            query = parse_qs(parts.query)
+            try:
+                wait = min(float(query.get("wait", ["0"])[0]), MAX_WAIT)
+            except ValueError:
+                self._send_json(400, {"error": "wait must be a number"})
+                return
+            job = self.server.service.get(path.split("/")[-1], wait=wait)
+            if not job:
+                self._send_json(404, {"error": "Unknown purchase"})
+                return
+            self._send_json(200, job.to_dict())
+            return
+
+        self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        if urlsplit(self.path).path.rstrip("/") != "/purchases":
+            self._send_json(404, {"error": "Not found"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            meter = str(payload.get("meter", "")).strip()
+            amount_str = str(payload.get("amount", ""))
+            priority = int(payload.get("priority", 10))
+        except (ValueError, TypeError, AttributeError):
+            self._send_json(400, {"error": "Invalid JSON body"})
+            return
+        if priority < 0:
+            # negative priorities are reserved for the workers' stop and retire sentinels
+            self._send_json(400, {"error": "Priority must be 0 or more"})
+            return
+
+        validate = Validate()
+        valid, msg = validate.meterNo(meter)
+        if not valid:
+            self._send_json(400, {"error": msg})
+            return
+        valid, amount, msg = validate.amount(amount_str)
+        if not valid:
+            self._send_json(400, {"error": msg})
+            return
+
+        try:
+            job, created = self.server.service.submit(meter, amount, priority)
+        except QueueFullError as e:
+            self._send_json(429, {"error": str(e)}, headers={"Retry-After": "5"})
+            return
+        except DuplicatePurchaseError as e:
+            self._send_json(409, {"error": str(e)})
+            return
+
+        self._send_json(202 if created else 200, job.to_dict())
+
+    def log_message(self, format, *args):
+        self.server.logger.debug(format % args)
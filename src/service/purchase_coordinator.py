@@ -0,0 +1,150 @@
+# src.service.purchase_coordinator
+
+import logging
+import os
+import threading
+from concurrent.futures import Future
+
+import psutil
+
+from .metrics import metrics
+
+
+class PurchaseJob:
+    """An in-flight purchase. Duplicate requests attach to it instead of starting a new one."""
+    def __init__(self, meter: str, amount: float):
+        self.meter = meter
+        self.amount = amount
+        self.future = Future()
+        self.attached = 0
+
+    @property
+    def key(self):
+        return purchase_key(self.meter, self.amount)
+
+    def add_done_callback(self, callback):
+        """callback(result) runs when the purchase completes, immediately if it already has."""
+        self.future.add_done_callback(lambda future: callback(future.result() if not future.exception() else None))
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+
+def purchase_key(meter: str, amount: float):
+    return meter.strip(), round(float(amount), 2)
+
+
+class PurchaseCoordinator:
+    """
+    Deduplicates purchases for the same meter and amount.
+    Within a process, a duplicate attaches to the job already running. Across processes
+    (GUI, CLI and daemon running side by side) an exclusive lock file per key makes the
+    second process refuse the duplicate, so a customer is never charged twice.
+    """
+    def __init__(self, lock_dir: str, logger=None):
+        self.lock_dir = lock_dir
+        self.logger = logger or logging.getLogger("INFO Logger")
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def submit(self, meter: str, amount: float):
+        """
+        Registers a purchase.
+        :return: (tuple) (job, created). created is False when the request attached to a job already
+                 in flight, in which case the caller must not start a browser session.
+                 job is None when the same purchase is in flight in another process.
+        """
+        key = purchase_key(meter, amount)
+        with self._lock:
+            job = self._inflight.get(key)
+            if job:
+                job.attached += 1
+                self.logger.info(f"Purchase for meter {key[0]} (${key[1]:.2f}) already in progress")
+                return job, False
+            if not self._acquire_lock_file(key):
+                self.logger.warning(f"Purchase for meter {key[0]} (${key[1]:.2f}) in progress in another process")
+                return None, False
+            job = PurchaseJob(*key)
+            self._inflight[key] = job
+            metrics.set_gauge("purchases.in_flight", len(self._inflight))
+            return job, True
+
+    def complete(self, job, result):
+        """Finishes a job and hands the result to every attached request."""
+        self._release(job)
+        if not job.future.done():
+            job.future.set_result(result)
+
+    def fail(self, job, error):
+        self._release(job)
+        if not job.future.done():
+            job.future.set_exception(error if isinstance(error, BaseException) else RuntimeError(str(error)))
+
+    def run(self, meter: str, amount: float, purchase):
+        """
+        Blocking helper for CLI and batch callers.
+        :param purchase: (callable) Runs the purchase and returns its result; only called when the
+                         request is not a duplicate.
+        :return: The purchase result, shared with duplicates. None if another process owns the purchase.
+        """
+        job, created = self.submit(meter, amount)
+        if job is None:
+            return None
+        if created:
+            try:
+                self.complete(job, purchase())
+            except Exception as e:
+                self.fail(job, e)
+        return job.result()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._inflight)
+
+    def _release(self, job):
+        with self._lock:
+            if self._inflight.get(job.key) is job:
+                del self._inflight[job.key]
+            metrics.set_gauge("purchases.in_flight", len(self._inflight))
+        self._release_lock_file(job.key)
+
+    # ------------------------- cross-process lock files -------------------------
+
+    def _lock_path(self, key):
+        meter, amount = key
+        return os.path.join(self.lock_dir, f"{meter}-{amount:.2f}.lock")
+
+    def _acquire_lock_file(self, key) -> bool:
+        os.makedirs(self.lock_dir, exist_ok=True)
+        path = self._lock_path(key)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._is_stale(path):
+                    return False
+                try:
+                    os.remove(path)
+                except OSError:
+                    return False
+                continue
+            with os.fdopen(fd, "w") as f:
+                f.write(str(os.getpid()))
+            return True
+        return False
+
+    @staticmethod
+    def _is_stale(path) -> bool:
+        """A lock file is stale when the process that wrote it is gone."""
+        try:
+            with open(path) as f:
+                pid = int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return True
+        return not pid or not psutil.pid_exists(pid)
+
+    def _release_lock_file(self, key):
+        try:
+            os.remove(self._lock_path(key))
+        except OSError:
+            pass
@@ -0,0 +1,75 @@
+# src.service.purchase_flow
+
+import logging
+import time
+import uuid
+
+from model.purchase import *
+from .browser_automator import BrowserAutomator
+from .flow_plan import execute_plan
+from .metrics import metrics
+from .plan_engines import SeleniumEngine
+from .plans import DEFAULT_PLAN, PLANS
+
+
+def run_purchase(automator, meter: str, amount: float, card, confirm=None, customer_cache=None, logger=None,
+                 purchase_id: str = None, plan=None, engine=None):
+    """
+    Runs the purchase plan on an automator whose browser is on the payment page.
+    The automator is not closed; the caller owns the session.
+    :param automator: (BrowserAutomator) Automator on the plan's start page
+    :param meter: (str) Meter number
+    :param amount: (float) Purchase amount
+    :param card: (Card) Payment card
+    :param confirm: (callable) confirm(customer_name, meter, amount) -> bool, called before the payment
+                    is submitted. None submits without asking.
+    :param customer_cache: (CustomerCache) Filled with the customer name when found
+    :param logger: (logging.Logger)
+    :param purchase_id: (str) Id that failure artifacts are indexed by, generated if not given
+    :param plan: (CompiledPlan) Purchase plan, the default portal's plan if not given
+    :param engine: (PlanEngine) Engine to run the plan on instead of a SeleniumEngine for the automator
+    :return: (PurchaseResult)
+    """
+    logger = logger or logging.getLogger("INFO Logger")
+    purchase_id = purchase_id or uuid.uuid4().hex
+    if automator:
+        automator.purchase_id = purchase_id
+
+    params = {
+        "meter": meter, "amount": amount, "card_number": card.number, "card_name": card.name,
+        "card_code": card.code, "exp_month": card.exp_month, "exp_year": card.exp_year,
+    }
+    started = time.perf_counter()
+    result = execute_plan(plan or PLANS[DEFAULT_PLAN], engine or SeleniumEngine(automator, logger=logger), params,
+                          confirm=confirm, customer_cache=customer_cache, purchase_id=purchase_id, logger=logger)
+    metrics.observe("purchase", time.perf_counter() - started, (result.status, result.stage))
+    return result
+
+
+def purchase_in_new_session(meter: str, amount: float, card, headless: bool = True, confirm=None,
+                            customer_cache=None, logger=None, plan=None, **automator_options):
+    """
+    Starts a browser, runs one purchase and closes the browser.
+    A session that cannot be started returns a STAGE_SETUP result, which is safe to retry.
+    :param plan: (CompiledPlan) Purchase plan, the default portal's plan if not given
+    :param automator_options: Passed to BrowserAutomator (governor, profiler, artifacts, timeout, ...)
+    :return: (PurchaseResult)
+    """
+    logger = logger or logging.getLogger("INFO Logger")
+    plan = plan or PLANS[DEFAULT_PLAN]
+    automator = BrowserAutomator(url=plan.url, headless=headless, logger=logger, skip_setup=True, **automator_options)
+    engine = SeleniumEngine(automator, logger=logger)
+    try:
+        automator.setup_driver()
+        if not engine.open(plan.url, plan.ready):
+            raise RuntimeError("Unable to load payment page")
+    except Exception as e:
+        automator.close()
+        metrics.observe("purchase", 0, (STATUS_ERROR, STAGE_SETUP))
+        return PurchaseResult(meter, amount, STATUS_ERROR, str(e), STAGE_SETUP)
+
+    try:
+        return run_purchase(automator, meter, amount, card, confirm=confirm, customer_cache=customer_cache,
+                            logger=logger, plan=plan, engine=engine)
+    finally:
+        automator.close()
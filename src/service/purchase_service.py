@@ -0,0 +1,298 @@
+# src.service.purchase_service
+
+import itertools
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+
+from model.purchase import PurchaseResult, STAGE_SETUP, STAGE_SUBMITTED, STATUS_ERROR
+from model.receipt import Receipt
+from .card_router import NoCardAvailableError
+from .metrics import metrics, percentile
+from .purchase_flow import run_purchase
+
+
+# job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+
+# latency samples kept for the status report
+LATENCY_WINDOW = 500
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue is at capacity; clients should retry later."""
+
+
+class DuplicatePurchaseError(Exception):
+    """Raised when the same purchase is in flight in another process."""
+
+
+class ServiceJob:
+    """A purchase job accepted by the service."""
+    def __init__(self, meter: str, amount: float, priority: int):
+        self.id = uuid.uuid4().hex
+        self.meter = meter
+        self.amount = amount
+        self.priority = priority
+        self.state = QUEUED
+        self.result = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.coordinated = None
+        self.done = threading.Event()
+
+    def to_dict(self) -> dict:
+        data = {
+            "id": self.id,
+            "meter": self.meter,
+            "amount": self.amount,
+            "priority": self.priority,
+            "state": self.state,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+        if self.result:
+            data.update({
+                "status": self.result.status,
+                "message": self.result.message,
+                "token": self.result.token,
+                "customer_name": self.result.customer_name,
+            })
+        return data
+
+
+class PurchaseService:
+    """
+    Long-running purchase service.
+    Jobs are queued by priority (lower runs first) with a bounded queue for backpressure and run
+    concurrently by worker threads, each on a warm session from the SessionPool and a card from
+    the CardRouter. Duplicate jobs for the same meter and amount attach to the job already
+    queued or running. Successful jobs are handed to the ReceiptPipeline, if one is given, and jobs
+    that got no browser session to on_setup_failed, e.g. to queue them until the portal is back.
+    plan and resize() can be changed while the service runs, e.g. when the settings change.
+    """
+    def __init__(self, pool, coordinator, card_router, workers: int, max_queue: int,
+                 customer_cache=None, receipts=None, plan=None, on_setup_failed=None, keep_finished: int = 1000,
+                 logger=None):
+        """:param on_setup_failed: (callable) on_setup_failed(result) for jobs whose session could not start"""
+        self.pool = pool
+        self.coordinator = coordinator
+        self.card_router = card_router
+        self.workers = workers
+        self.plan = plan
+        self.customer_cache = customer_cache
+        self.receipts = receipts
+        self.on_setup_failed = on_setup_failed
+        self.keep_finished = keep_finished
+        self.logger = logger or logging.getLogger("INFO Logger")
+
+        self._queue = queue.PriorityQueue(maxsize=max_queue)
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._by_key = {}
+        self._finished = deque()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._waits = deque(maxlen=LATENCY_WINDOW)
+        self._threads = []
+        self._thread_ids = itertools.count()
+        self._retiring = 0
+        self._stop = threading.Event()
+
+    def start(self):
+        self.pool.warm()
+        for _ in range(self.workers):
+            self._start_worker()
+        self.logger.info(f"Purchase service started with {self.workers} worker(s)")
+
+    def _start_worker(self):
+        thread = threading.Thread(target=self._work, name=f"PurchaseWorker-{next(self._thread_ids)}", daemon=True)
+        thread.start()
+        with self._lock:
+            # forget retired workers, so stop() only wakes and waits for live ones
+            self._threads = [worker for worker in self._threads if worker.is_alive()]
+            self._threads.append(thread)
+
+    def resize(self, workers: int):
+        """
+        Changes the number of workers and sessions. Surplus workers finish their current job
+        first; new sessions are started on demand, see SessionPool.resize().
+        """
+        with self._lock:
+            added = workers - self.workers
+            self.workers = workers
+            if added < 0:
+                self._retiring -= added
+            else:
+                # workers that have not retired yet stay on instead of starting new ones
+                kept = min(added, self._retiring)
+                self._retiring -= kept
+                added -= kept
+        self.pool.resize(workers)
+        for _ in range(added):
+            self._start_worker()
+        for _ in range(-added):
+            # wake an idle worker to retire; busy ones retire after their job
+            try:
+                self._queue.put_nowait((-1, next(self._sequence), None))
+            except queue.Full:
+                break
+        self.logger.info(f"Purchase service resized to {workers} worker(s)")
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            threads = [thread for thread in self._threads if thread.is_alive()]
+        for _ in threads:
+            # wake idle workers
+            try:
+                self._queue.put_nowait((-1, next(self._sequence), None))
+            except queue.Full:
+                break
+        for thread in threads:
+            thread.join(timeout=30)
+        self.pool.close()
+
+    # ------------------------- client API -------------------------
+
+    def submit(self, meter: str, amount: float, priority: int = 10):
+        """
+        Queues a purchase.
+        :return: (tuple) (ServiceJob, created). created is False when the request attached to an
+                 existing job for the same meter and amount.
+        :raises QueueFullError: when the queue is at capacity
+        :raises DuplicatePurchaseError: when another process is running the same purchase
+        """
+        with self._lock:
+            coordinated, created = self.coordinator.submit(meter, amount)
+            if coordinated is None:
+                raise DuplicatePurchaseError(f"Purchase for meter {meter} is in progress in another process")
+            if not created:
+                return self._by_key[coordinated.key], False
+            job = ServiceJob(coordinated.meter, coordinated.amount, priority)
+            job.coordinated = coordinated
+            try:
+                self._queue.put_nowait((priority, next(self._sequence), job))
+            except queue.Full:
+                self.coordinator.fail(coordinated, QueueFullError("Queue full"))
+                raise QueueFullError(f"Queue is full ({self._queue.maxsize} jobs)")
+            self._jobs[job.id] = job
+            self._by_key[coordinated.key] = job
+        metrics.set_gauge("service.queue_depth", self._queue.qsize())
+        return job, True
+
+    def get(self, job_id: str, wait: float = 0):
+        """
+        Returns a job, optionally long-polling until it is done.
+        :param wait: (float) Seconds to wait for the job to finish
+        :return: (ServiceJob) or None if unknown
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job and wait > 0:
+            job.done.wait(wait)
+        return job
+
+    def status(self) -> dict:
+        latencies = sorted(self._latencies)
+        waits = sorted(self._waits)
+        with self._lock:
+            states = [job.state for job in self._jobs.values()]
+        return {
+            "workers": self.workers,
+            "queue_depth": self._queue.qsize(),
+            "queue_capacity": self._queue.maxsize,
+            "running": states.count(RUNNING),
+            "latency_p50": percentile(latencies, 50),
+            "latency_p95": percentile(latencies, 95),
+            "queue_wait_p50": percentile(waits, 50),
+            "queue_wait_p95": percentile(waits, 95),
+            "cards": self.card_router.usage(),
+            "metrics": metrics.snapshot(),
+        }
+
+    # ------------------------- workers -------------------------
+
+    def _work(self):
+        while not self._stop.is_set() and not self._retire():
+            _, _, job = self._queue.get()
+            if job is None:
+                continue
+            metrics.set_gauge("service.queue_depth", self._queue.qsize())
+            self._run(job)
+
+    def _retire(self) -> bool:
+        with self._lock:
+            if self._retiring:
+                self._retiring -= 1
+                return True
+        return False
+
+    def _run(self, job):
+        job.state = RUNNING
+        job.started = time.time()
+        self._waits.append(job.started - job.created)
+
+        try:
+            lease = self.card_router.acquire(job.amount, timeout=300)
+        except NoCardAvailableError as e:
+            self.logger.error(f"No card for meter {job.meter}: {e}")
+            self._finish(job, PurchaseResult(job.meter, job.amount, STATUS_ERROR, str(e), STAGE_SETUP,
+                                             purchase_id=job.id))
+            return
+
+        try:
+            automator = self.pool.acquire(timeout=300)
+        except Exception as e:
+            self.logger.error(f"No browser session for meter {job.meter}: {e}")
+            metrics.observe("purchase", 0, (STATUS_ERROR, STAGE_SETUP))
+            result = PurchaseResult(job.meter, job.amount, STATUS_ERROR, str(e), STAGE_SETUP, purchase_id=job.id)
+            self.card_router.release(lease, result)
+            if self.on_setup_failed:
+                self.on_setup_failed(result)
+            self._finish(job, result)
+            return
+
+        result = None
+        reusable = False
+        try:
+            result = run_purchase(automator, job.meter, job.amount, lease.card, customer_cache=self.customer_cache,
+                                  logger=self.logger, purchase_id=job.id, plan=self.plan)
+            reusable = True
+        except Exception as e:
+            # an unexpected error may have happened after the payment was submitted
+            self.logger.error(f"Purchase for meter {job.meter} failed: {e}")
+            result = PurchaseResult(job.meter, job.amount, STATUS_ERROR, str(e), STAGE_SUBMITTED,
+                                    purchase_id=job.id)
+        finally:
+            self.card_router.release(lease, result)
+            # the caller gets its result before the session is reset, which may wait for a failure capture
+            self._finish(job, result)
+            self.pool.release(automator, reusable=reusable)
+
+    def _finish(self, job, result):
+        job.result = result
+        job.state = DONE
+        job.finished = time.time()
+        self._latencies.append(job.finished - job.started)
+        metrics.incr(f"service.{result.status}")
+        if self.receipts:
+            self.receipts.submit(Receipt.from_result(result))
+
+        with self._lock:
+            self._by_key.pop(job.coordinated.key, None)
+            # under the same lock as submit(), so no submit sees the coordinator job without its ServiceJob
+            self.coordinator.complete(job.coordinated, result)
+            self._finished.append(job.id)
+            # forget old jobs so a long-running service does not grow without bound
+            while len(self._finished) > self.keep_finished:
+                self._jobs.pop(self._finished.popleft(), None)
+        job.done.set()
+
@@ -0,0 +1,271 @@
+# src.service.receipts
+
+import logging
+import os
+import queue
+import string
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PySide6 import QtCore, QtGui
+
+from model.receipt import OutboxMessage
+from .metrics import metrics
+from .outbox import CHANNEL_EMAIL, channel_for
+
+
+FORMATS = ("txt", "pdf", "png")
+
+PDF_FONT_SIZE = 10
+PDF_LEADING = 13
+PDF_MARGIN = 24
+PNG_PADDING = 16
+# Qt enums are looked up once here: PySide resolves them lazily, which is not safe from several threads at once
+PNG_IMAGE_FORMAT = QtGui.QImage.Format.Format_Grayscale8  # black on white, a third of the encoding time of RGB
+PNG_FONT_HINT = QtGui.QFont.StyleHint.Monospace
+PNG_BACKGROUND = QtCore.Qt.GlobalColor.white
+PNG_INK = QtCore.Qt.GlobalColor.black
+WRITE_ONLY = QtCore.QIODevice.OpenModeFlag.WriteOnly
+
+_offscreen_app = None
+
+
+class ReceiptError(Exception):
+    """Raised when a receipt cannot be rendered in the requested format."""
+
+
+def enable_images():
+    """
+    Starts an offscreen Qt application so png receipts can be rendered without the GUI.
+    Call from the main thread; does nothing when a Qt application is already running.
+    """
+    global _offscreen_app
+    if not QtGui.QGuiApplication.instance():
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        _offscreen_app = QtGui.QGuiApplication([sys.argv[0]])
+
+
+def _pdf_escape(line: str) -> str:
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+class ReceiptRenderer:
+    """
+    Renders receipts from the string.Template files in template_dir:
+        receipt.txt  the receipt, also the text of pdf and png receipts
+        sms.txt      the short message sent to phone numbers
+    Templates are read once and cached; rendering is thread safe.
+    """
+    def __init__(self, template_dir: str):
+        self.template_dir = template_dir
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def template(self, name: str) -> string.Template:
+        with self._lock:
+            template = self._templates.get(name)
+            if template is None:
+                with open(os.path.join(self.template_dir, name), encoding="utf-8") as f:
+                    template = self._templates[name] = string.Template(f.read())
+            return template
+
+    @staticmethod
+    def fields(receipt) -> dict:
+        return {
+            "date": f"{receipt.issued_at:%Y-%m-%d %H:%M}",
+            "receipt_id": receipt.purchase_id[:8] or "-",
+            "customer": receipt.customer_name or "-",
+            "meter": receipt.meter,
+            "amount": f"{receipt.amount:.2f}",
+            "token": receipt.token,
+        }
+
+    def text(self, receipt, template: str = "receipt.txt") -> str:
+        return self.template(template).safe_substitute(self.fields(receipt))
+
+    def render(self, receipt, fmt: str) -> bytes:
+        """
+        :param fmt: (str) One of FORMATS
+        :raises ReceiptError: for an unknown format, or png without a Qt application
+        """
+        if fmt == "txt":
+            return self.text(receipt).encode("utf-8")
+        if fmt == "pdf":
+            return self.pdf(receipt)
+        if fmt == "png":
+            return self.png(receipt)
+        raise ReceiptError(f"Unknown receipt format {fmt!r}")
+
+    def pdf(self, receipt) -> bytes:
+        """Single page PDF sized to the receipt, set in the built-in Courier font."""
+        lines = self.text(receipt).splitlines()
+        width = PDF_MARGIN * 2 + int(max(len(line) for line in lines) * PDF_FONT_SIZE * 0.6)
+        height = PDF_MARGIN * 2 + PDF_LEADING * len(lines)
+        content = (f"BT /F1 {PDF_FONT_SIZE} Tf {PDF_LEADING} TL {PDF_MARGIN} {height - PDF_MARGIN} Td "
+                   + " ".join(f"({_pdf_escape(line)}) '" for line in lines) + " ET").encode("latin-1", "replace")
+
+        objects = [
+            b"<< /Type /Catalog /Pages 2 0 R >>",
+            b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width} {height}] "
+            f"/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>".encode(),
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>",
+            b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content),
+        ]
+        out = bytearray(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(len(out))
+            out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+        xref = len(out)
+        out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+        out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+        out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+        return bytes(out)
+
+    def png(self, receipt) -> bytes:
+        """Receipt image; needs a Qt application (the GUI, or see enable_images())."""
+        if not QtGui.QGuiApplication.instance():
+            raise ReceiptError("png receipts need a Qt application, see enable_images()")
+        lines = self.text(receipt).splitlines()
+        font = QtGui.QFont("Courier New", 12)
+        font.setStyleHint(PNG_FONT_HINT)
+        font_metrics = QtGui.QFontMetrics(font)
+
+        width = PNG_PADDING * 2 + max(font_metrics.horizontalAdvance(line) for line in lines)
+        height = PNG_PADDING * 2 + font_metrics.lineSpacing() * len(lines)
+        image = QtGui.QImage(width, height, PNG_IMAGE_FORMAT)
+        image.fill(PNG_BACKGROUND)
+        painter = QtGui.QPainter(image)
+        painter.setFont(font)
+        painter.setPen(PNG_INK)
+        for index, line in enumerate(lines):
+            painter.drawText(PNG_PADDING, PNG_PADDING + font_metrics.ascent() + index * font_metrics.lineSpacing(), line)
+        painter.end()
+
+        buffer = QtCore.QBuffer()
+        buffer.open(WRITE_ONLY)
+        image.save(buffer, "PNG")
+        return bytes(buffer.data())
+
+    def save(self, receipt, formats, directory: str) -> list:
+        """
+        Renders the receipt in each format into directory.
+        :return: (list) Paths written
+        """
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for fmt in formats:
+            path = os.path.join(directory, f"{receipt.name}.{fmt}")
+            with open(path, "wb") as f:
+                f.write(self.render(receipt, fmt))
+            paths.append(path)
+        return paths
+
+
+class ReceiptPipeline:
+    """
+    Renders receipts and hands them to the outbox on a background thread.
+    submit() only queues the receipt, so purchase workers and the GUI thread never wait on
+    rendering or delivery. Queued receipts are taken in batches of up to batch_size, rendered
+    in parallel into output_dir/<date>/ and the receipts that have a recipient are sent to the
+    outbox as one batch.
+    :param recipient: (str) Phone number or email address receipts are sent to unless submit() names another
+    """
+    def __init__(self, renderer: ReceiptRenderer, output_dir: str, formats=("txt", "pdf"), outbox=None,
+                 recipient: str = None, batch_size: int = 100, workers: int = 4, logger=None):
+        self.renderer = renderer
+        self.output_dir = output_dir
+        self.formats = tuple(fmt for fmt in formats if fmt)
+        self.outbox = outbox
+        self.recipient = recipient
+        self.batch_size = batch_size
+        self.logger = logger or logging.getLogger("INFO Logger")
+
+        unknown = set(self.formats) - set(FORMATS)
+        if unknown:
+            raise ReceiptError(f"Unknown receipt formats: {', '.join(sorted(unknown))}. Use {', '.join(FORMATS)}")
+
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ReceiptRenderer")
+        self._thread = threading.Thread(target=self._run, name="ReceiptPipeline", daemon=True)
+        self._thread.start()
+
+    def submit(self, receipt, recipient: str = None):
+        """
+        Queues a receipt to be rendered, and sent when there is a recipient.
+        :param receipt: (Receipt) None is ignored, so failed results can be passed through
+        :param recipient: (str) Phone number or email address, the pipeline's recipient if not given
+        """
+        if receipt is not None:
+            self._queue.put((receipt, recipient or self.recipient))
+
+    def close(self, timeout: float = 30):
+        """Renders and sends everything queued, then stops."""
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._executor.shutdown(wait=True)
+        if self.outbox:
+            self.outbox.close()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch = []
+            stopping = item is None
+            if not stopping:
+                batch.append(item)
+            # take whatever else is already queued, up to a batch
+            while not stopping and len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                else:
+                    batch.append(item)
+
+            if batch:
+                try:
+                    self._process(batch)
+                except Exception as e:
+                    self.logger.error(f"Unable to process {len(batch)} receipt(s): {e}")
+            if stopping:
+                return
+
+    def _process(self, batch):
+        started = time.perf_counter()
+        paths = list(self._executor.map(self._save, (receipt for receipt, _ in batch)))
+
+        messages = []
+        for (receipt, recipient), files in zip(batch, paths):
+            if recipient and files is not None:
+                messages.append(self._message(receipt, recipient, files))
+        if messages and self.outbox:
+            try:
+                self.outbox.send(messages)
+            except Exception as e:
+                metrics.incr("outbox.failed", len(messages))
+                self.logger.error(f"Unable to send {len(messages)} receipt(s): {e}")
+
+        metrics.incr("receipts.rendered", sum(1 for files in paths if files is not None))
+        metrics.observe("receipts.batch", time.perf_counter() - started, len(batch))
+
+    def _save(self, receipt):
+        directory = os.path.join(self.output_dir, f"{receipt.issued_at:%Y-%m-%d}")
+        try:
+            return self.renderer.save(receipt, self.formats, directory)
+        except Exception as e:
+            self.logger.error(f"Unable to render the receipt for meter {receipt.meter}: {e}")
+            return None
+
+    def _message(self, receipt, recipient, files) -> OutboxMessage:
+        channel = channel_for(recipient)
+        if channel == CHANNEL_EMAIL:
+            return OutboxMessage(recipient, channel, f"Token receipt for meter {receipt.meter}",
+                                 self.renderer.text(receipt), tuple(files), receipt.purchase_id)
+        return OutboxMessage(recipient, channel, "", self.renderer.text(receipt, "sms.txt").strip(), (),
+                             receipt.purchase_id)
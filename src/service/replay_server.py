@@ -0,0 +1,165 @@
+# src.service.replay_server
+
+import argparse
+import base64
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+
+# hop-by-hop and encoding headers that no longer match the decoded body
+SKIPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection", "keep-alive"}
+
+
+class ReplayServer:
+    """
+    Serves a recorded portal session (see SessionRecorder) on localhost, byte for byte.
+    Requests are matched on method + path + query; repeated requests to the same URL
+    (WebForms postbacks) are answered with the recorded responses in order.
+    With realtime=True every response is delayed by its originally recorded wait time,
+    otherwise responses are served as fast as possible.
+    """
+    def __init__(self, recording_dir: str, host: str = "127.0.0.1", port: int = 0,
+                 realtime: bool = False, logger=None):
+        self.recording_dir = recording_dir
+        self.realtime = realtime
+        self.logger = logger or logging.getLogger("INFO Logger")
+
+        with open(os.path.join(recording_dir, "session.har"), encoding="utf-8") as f:
+            entries = json.load(f)["log"]["entries"]
+        with open(os.path.join(recording_dir, "steps.json"), encoding="utf-8") as f:
+            self.steps = json.load(f)
+
+        self._lock = threading.Lock()
+        self._routes = defaultdict(list)
+        for entry in entries:
+            self._routes[self._key(entry["request"]["method"], entry["request"]["url"])].append(entry)
+        self._cursor = defaultdict(int)
+        self.misses = []
+
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @staticmethod
+    def _key(method: str, url: str):
+        parts = urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+        return method.upper(), path
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url_for(self, original_url: str) -> str:
+        """Maps a recorded portal URL to the same path on this server."""
+        parts = urlsplit(original_url)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        return self.base_url + path
+
+    @property
+    def start_url(self) -> str:
+        return self.url_for(self.steps["url"])
+
+    def next_entry(self, method: str, path: str):
+        key = (method.upper(), path)
+        with self._lock:
+            entries = self._routes.get(key)
+            if not entries:
+                self.misses.append(key)
+                return None
+            index = min(self._cursor[key], len(entries) - 1)
+            self._cursor[key] += 1
+            return entries[index]
+
+    def reset(self):
+        """Rewinds every route so the session can be replayed again."""
+        with self._lock:
+            self._cursor.clear()
+            self.misses.clear()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="ReplayServer", daemon=True)
+        self._thread.start()
+        self.logger.info(f"Replaying {self.recording_dir} on {self.base_url}")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler_class(self):
+        replay = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _serve(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+
+                entry = replay.next_entry(self.command, self.path)
+                if not entry:
+                    self.send_error(404, "Not recorded")
+                    return
+
+                if replay.realtime:
+                    time.sleep(entry["timings"]["wait"] / 1000)
+
+                response = entry["response"]
+                content = response["content"]
+                body = content.get("text", "")
+                body = base64.b64decode(body) if content.get("encoding") == "base64" else body.encode("utf-8")
+
+                self.send_response(response["status"], response.get("statusText") or None)
+                for header in response["headers"]:
+                    if header["name"].lower() in SKIPPED_HEADERS:
+                        continue
+                    # a header value can hold several lines (e.g. Set-Cookie)
+                    for value in str(header["value"]).split("\n"):
+                        self.send_header(header["name"], value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+
+            do_GET = do_POST = do_HEAD = _serve
+
+            def log_message(self, format, *args):
+                replay.logger.debug(format % args)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a recorded portal session locally")
+    parser.add_argument("recording", help="Recording directory containing session.har")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--realtime", action="store_true", help="Replay with the original timing")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = ReplayServer(args.recording, port=args.port, realtime=args.realtime, logger=logging.getLogger())
+    server.start()
+    print(f"Start URL: {server.start_url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
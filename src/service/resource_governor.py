@@ -0,0 +1,278 @@
+# src.service.resource_governor
+
+import glob
+import json
+import logging
+import os
+import threading
+
+import psutil
+
+from .metrics import metrics
+
+
+# process names owned by our WebDriver sessions
+DRIVER_PROCESS_NAMES = ("chromedriver", "chrome", "msedgedriver", "msedge")
+
+
+class ResourceGovernor:
+    """
+    Tracks the process tree (driver + browser processes) behind each BrowserAutomator,
+    samples RSS and CPU in a background thread and marks sessions that go over budget, to be
+    recycled between purchases. Each process records its driver PIDs in its own pid file in
+    pid_dir, so the GUI, CLI and daemon can run side by side; orphans in the pid files of
+    processes that have exited are reaped on startup, and every tracked tree is killed on shutdown.
+    """
+    def __init__(self, pid_dir: str, max_rss_mb: float, max_cpu_percent: float,
+                 hard_rss_mb: float = None, interval: float = 5.0, logger=None):
+        self.pid_dir = pid_dir
+        self.pid_file = os.path.join(pid_dir, f"driver-{os.getpid()}.json")
+        self.max_rss_mb = max_rss_mb
+        self.max_cpu_percent = max_cpu_percent
+        self.hard_rss_mb = hard_rss_mb or max_rss_mb * 2
+        self.interval = interval
+        self.logger = logger or logging.getLogger("INFO Logger")
+
+        self._lock = threading.Lock()
+        self._sessions = {}  # id(automator) -> session state
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ------------------------- lifecycle -------------------------
+
+    def start(self):
+        """Reaps orphans from a previous run and starts the sampling thread."""
+        self.reap_orphans()
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample_loop, name="ResourceGovernor", daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        """Stops sampling and kills every process tree still being tracked."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval)
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            self._kill_tree(session["root"])
+        try:
+            os.remove(self.pid_file)
+        except OSError:
+            pass
+
+    # ------------------------- registration -------------------------
+
+    def register(self, automator):
+        """
+        Starts tracking the driver process tree of an automator.
+        :param automator: (BrowserAutomator) Automator with an active driver
+        """
+        pid = self._driver_pid(automator)
+        if not pid:
+            return
+        try:
+            root = psutil.Process(pid)
+        except psutil.Error:
+            return
+        with self._lock:
+            self._sessions[id(automator)] = {
+                "automator": automator,
+                "root": root,
+                "procs": {},
+                "rss_mb": 0.0,
+                "cpu_percent": 0.0,
+                "over_budget": False,
+            }
+        self._write_pid_file()
+        metrics.set_gauge("browser.sessions", len(self._sessions))
+
+    def unregister(self, automator):
+        """Stops tracking an automator. Any process left behind is killed."""
+        with self._lock:
+            session = self._sessions.pop(id(automator), None)
+        if session:
+            self._kill_tree(session["root"])
+            self._write_pid_file()
+        metrics.set_gauge("browser.sessions", len(self._sessions))
+
+    # ------------------------- sampling -------------------------
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                self.logger.warning(f"Resource sampling failed: {e}")
+
+    def sample(self):
+        """Samples RSS and CPU of every tracked tree and updates the metrics."""
+        with self._lock:
+            sessions = list(self._sessions.values())
+
+        total_rss = 0.0
+        total_cpu = 0.0
+        for session in sessions:
+            rss, cpu = self._sample_tree(session)
+            session["rss_mb"] = rss
+            session["cpu_percent"] = cpu
+            session["over_budget"] = rss > self.max_rss_mb or cpu > self.max_cpu_percent
+            total_rss += rss
+            total_cpu += cpu
+
+            # never killed here: the session may be in the middle of a payment
+            if rss > self.hard_rss_mb and not session.get("hard_limit"):
+                session["hard_limit"] = True
+                self.logger.warning(f"Browser session using {rss:.0f} MB, recycling it after its purchase")
+                metrics.incr("browser.hard_limit")
+
+        metrics.set_gauge("browser.rss_mb", round(total_rss, 1))
+        metrics.set_gauge("browser.cpu_percent", round(total_cpu, 1))
+        metrics.set_gauge("browser.sessions", len(sessions))
+
+    def _sample_tree(self, session):
+        root = session["root"]
+        try:
+            procs = [root] + root.children(recursive=True)
+        except psutil.Error:
+            return 0.0, 0.0
+
+        # keep Process objects between samples so cpu_percent measures the interval
+        known = session["procs"]
+        current = {}
+        rss = 0
+        cpu = 0.0
+        for proc in procs:
+            proc = known.get(proc.pid, proc)
+            try:
+                rss += proc.memory_info().rss
+                cpu += proc.cpu_percent(None)
+                current[proc.pid] = proc
+            except psutil.Error:
+                continue
+        session["procs"] = current
+        return rss / (1024 * 1024), cpu
+
+    # ------------------------- recycling -------------------------
+
+    def usage(self, automator):
+        """
+        Returns the last sampled usage of an automator.
+        :return: (dict) {"rss_mb", "cpu_percent", "over_budget"} or None if not tracked
+        """
+        with self._lock:
+            session = self._sessions.get(id(automator))
+        if not session:
+            return None
+        return {key: session[key] for key in ("rss_mb", "cpu_percent", "over_budget")}
+
+    def maybe_recycle(self, automator) -> bool:
+        """
+        Replaces the automator's browser if it went over budget.
+        Call only between purchases, never while a purchase is in progress.
+        :return: (bool) True if the session was recycled
+        """
+        usage = self.usage(automator)
+        if not usage or not usage["over_budget"]:
+            return False
+
+        self.logger.info(f"Recycling browser session ({usage['rss_mb']:.0f} MB, {usage['cpu_percent']:.0f}% CPU)")
+        automator.close()
+        automator.setup_driver()
+        automator.open_site()
+        metrics.incr("browser.recycled")
+        return True
+
+    # ------------------------- process helpers -------------------------
+
+    @staticmethod
+    def _driver_pid(automator):
+        try:
+            return automator.driver.service.process.pid
+        except AttributeError:
+            # browsers driven without WebDriver (AsyncBrowser) expose the browser pid directly
+            return getattr(automator, "browser_pid", None)
+
+    def _kill_tree(self, root):
+        try:
+            procs = root.children(recursive=True) + [root]
+        except psutil.Error:
+            procs = [root]
+        alive = [proc for proc in procs if proc.is_running()]
+        if not alive:
+            return
+        for proc in alive:
+            try:
+                proc.kill()
+            except psutil.Error:
+                pass
+        psutil.wait_procs(alive, timeout=3)
+
+    @staticmethod
+    def _is_alive(pid, created) -> bool:
+        """True if pid is still the process that was started at created, not a reused pid."""
+        if not pid:
+            return False
+        try:
+            return abs(psutil.Process(pid).create_time() - created) <= 1
+        except psutil.Error:
+            return False
+
+    def _write_pid_file(self):
+        entries = []
+        with self._lock:
+            for session in self._sessions.values():
+                try:
+                    entries.append({"pid": session["root"].pid, "created": session["root"].create_time()})
+                except psutil.Error:
+                    continue
+        try:
+            owner = {"pid": os.getpid(), "created": psutil.Process().create_time()}
+            os.makedirs(self.pid_dir, exist_ok=True)
+            with open(self.pid_file, "w") as f:
+                json.dump({"owner": owner, "drivers": entries}, f)
+        except (OSError, psutil.Error) as e:
+            self.logger.warning(f"Unable to write driver pid file: {e}")
+
+    def reap_orphans(self) -> int:
+        """
+        Kills driver process trees recorded by processes that are no longer running.
+        Pid files of running processes, including this one, are left alone.
+        :return: (int) Number of process trees reaped
+        """
+        reaped = 0
+        for path in glob.glob(os.path.join(self.pid_dir, "driver-*.json")):
+            if path == self.pid_file:
+                continue
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+                owner = data["owner"]
+                if self._is_alive(owner["pid"], owner["created"]):
+                    continue
+            except (OSError, ValueError, KeyError, TypeError):
+                continue
+
+            for entry in data.get("drivers", []):
+                if not self._is_alive(entry.get("pid"), entry.get("created", 0)):
+                    continue
+                try:
+                    proc = psutil.Process(entry["pid"])
+                    if not proc.name().lower().startswith(DRIVER_PROCESS_NAMES):
+                        continue
+                except psutil.Error:
+                    continue
+                self._kill_tree(proc)
+                reaped += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+        if reaped:
+            self.logger.info(f"Reaped {reaped} orphaned browser session(s)")
+            metrics.incr("browser.orphans_reaped", reaped)
+        return reaped
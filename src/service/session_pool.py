@@ -0,0 +1,175 @@
+# src.service.session_pool
+
+import logging
+import queue
+import threading
+
+from .browser_automator import BrowserAutomator
+from .metrics import metrics
+from .plan_engines import SeleniumEngine
+
+
+class SessionPool:
+    """
+    Pool of warm BrowserAutomator sessions parked on the plan's start page.
+    Driver startup and the first page load are paid once per session instead of once per
+    purchase. A released session is navigated back to the payment page (and recycled by the
+    resource governor if it went over budget) before it is handed out again. configure() and
+    resize() change the pool while it runs without dropping warm sessions.
+    """
+    def __init__(self, plan, size: int, headless: bool = True, governor=None, artifacts=None, logger=None,
+                 **automator_options):
+        """
+        :param plan: (CompiledPlan) Plan whose start page sessions are opened on
+        :param automator_options: Passed to BrowserAutomator (timeout, element_timeout, ...)
+        """
+        self.plan = plan
+        self.size = size
+        self.headless = headless
+        self.governor = governor
+        self.artifacts = artifacts
+        self.logger = logger or logging.getLogger("INFO Logger")
+        self.automator_options = automator_options
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+
+    def _open(self, automator):
+        return SeleniumEngine(automator, logger=self.logger).open(self.plan.url, self.plan.ready)
+
+    def _new_session(self):
+        automator = BrowserAutomator(url=self.plan.url, headless=self.headless, logger=self.logger, skip_setup=True,
+                                     governor=self.governor, artifacts=self.artifacts, **self.automator_options)
+        automator.setup_driver()
+        if not self._open(automator):
+            automator.close()
+            raise RuntimeError("Unable to load payment page")
+        return automator
+
+    def warm(self, count: int = None):
+        """Starts sessions ahead of the first purchase."""
+        for _ in range(min(count or self.size, self.size)):
+            with self._lock:
+                if self._created >= self.size:
+                    return
+                self._created += 1
+            try:
+                self._idle.put(self._new_session())
+            except Exception as e:
+                with self._lock:
+                    self._created -= 1
+                self.logger.warning(f"Unable to warm browser session: {e}")
+                return
+        self._publish()
+
+    def acquire(self, timeout: float = None):
+        """
+        Returns a session on the payment page, creating one if the pool is not full.
+        :raises queue.Empty: when every session is busy for longer than timeout
+        """
+        try:
+            return self._refresh(self._idle.get_nowait())
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if create:
+            try:
+                return self._new_session()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+            finally:
+                self._publish()
+        return self._refresh(self._idle.get(timeout=timeout))
+
+    def _refresh(self, automator):
+        """Brings a warm session up to date with configure() before it is handed out."""
+        automator.set_timeouts(self.automator_options.get("timeout"), self.automator_options.get("element_timeout"))
+        if (automator.url, automator.ready) != (self.plan.url, self.plan.ready):
+            if not self._open(automator):
+                # a session that did not load the new page is replaced, in its place in the pool
+                automator.close()
+                try:
+                    return self._new_session()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    self._publish()
+                    raise
+        return automator
+
+    def release(self, automator, reusable: bool = True):
+        """
+        Returns a session to the pool.
+        :param reusable: (bool) False discards the session, e.g. after an automation error
+        """
+        with self._lock:
+            # surplus sessions after a resize are closed instead of parked
+            reusable = reusable and not self._closed and self._created <= self.size
+        if reusable:
+            try:
+                if self.governor:
+                    self.governor.maybe_recycle(automator)
+                # park it on the payment page again for the next purchase
+                if self._open(automator):
+                    self._idle.put(automator)
+                    self._publish()
+                    return
+            except Exception as e:
+                self.logger.warning(f"Unable to reset browser session: {e}")
+
+        automator.close()
+        with self._lock:
+            self._created -= 1
+        self._publish()
+
+    def configure(self, plan=None, headless: bool = None, **automator_options):
+        """
+        Changes the plan and the options sessions are started with. Warm sessions get the new
+        start page and timeouts when they are next handed out. A browser, headless or profile
+        change applies to the sessions started from now on; warm sessions keep their browser.
+        """
+        with self._lock:
+            self.plan = plan or self.plan
+            self.headless = self.headless if headless is None else headless
+            self.automator_options = {**self.automator_options, **automator_options}
+
+    def resize(self, size: int):
+        """Changes the pool size. Surplus idle sessions are closed, busy ones are kept."""
+        with self._lock:
+            self.size = size
+        while True:
+            with self._lock:
+                if self._created <= self.size:
+                    break
+            try:
+                automator = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            automator.close()
+            with self._lock:
+                self._created -= 1
+        self._publish()
+
+    def close(self):
+        """Closes idle sessions. Busy sessions are closed when they are released."""
+        self._closed = True
+        while True:
+            try:
+                automator = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            automator.close()
+            with self._lock:
+                self._created -= 1
+        self._publish()
+
+    def _publish(self):
+        metrics.set_gauge("pool.sessions", self._created)
+        metrics.set_gauge("pool.idle", self._idle.qsize())
@@ -0,0 +1,201 @@
+# src.service.session_recorder
+
+import base64
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from urllib.parse import quote, quote_plus
+
+
+REDACTED = "[REDACTED]"
+
+
+class SessionRecorder:
+    """
+    Records a portal session as offline fixtures.
+    HTTP exchanges are read from the browser performance log and written as a HAR 1.2 file
+    (response bodies included, base64 encoded), and a DOM snapshot is saved after every
+    automation step. Card data registered through add_secrets() is scrubbed from everything
+    written to disk.
+    """
+    def __init__(self, base_dir: str, logger=None):
+        self.base_dir = base_dir
+        self.logger = logger or logging.getLogger("INFO Logger")
+        self.session_dir = None
+        self._url = None
+        self._secrets = set()
+        self._started = None
+        self._requests = {}
+        self._entries = []
+        self._steps = []
+
+    def start(self, url: str):
+        """Starts a new recording in a timestamped directory."""
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        self.session_dir = os.path.join(self.base_dir, stamp)
+        os.makedirs(os.path.join(self.session_dir, "dom"), exist_ok=True)
+        self._started = time.time()
+        self._requests = {}
+        self._entries = []
+        self._steps = []
+        self._url = url
+        self.logger.info(f"Recording session to {self.session_dir}")
+
+    def add_secrets(self, *values):
+        """Registers values (card number, CVV, name) that must never reach disk."""
+        for value in values:
+            if value is None:
+                continue
+            value = str(value)
+            if len(value) < 3:
+                continue
+            self._secrets.update({value, quote(value), quote_plus(value)})
+
+    def scrub(self, text: str) -> str:
+        if not text:
+            return text
+        for secret in sorted(self._secrets, key=len, reverse=True):
+            text = text.replace(secret, REDACTED)
+        return text
+
+    def _scrub_bytes(self, data: bytes) -> bytes:
+        for secret in sorted(self._secrets, key=len, reverse=True):
+            data = data.replace(secret.encode(), REDACTED.encode())
+        return data
+
+    # ------------------------- capture -------------------------
+
+    def record_step(self, driver, step: str, log_entries):
+        """
+        Captures the HTTP exchanges since the last step and a DOM snapshot.
+        :param driver: (WebDriver) Active Chromium based driver
+        :param step: (str) Name of the automation step that just ran
+        :param log_entries: (list) Performance log entries read since the last step
+        """
+        if not self.session_dir or not driver:
+            return
+        try:
+            self._read_network_events(driver, step, log_entries)
+        except Exception as e:
+            self.logger.warning(f"Unable to read network log: {e}")
+
+        index = len(self._steps)
+        dom_file = os.path.join("dom", f"{index:02d}_{step}.html")
+        try:
+            with open(os.path.join(self.session_dir, dom_file), "w", encoding="utf-8") as f:
+                f.write(self.scrub(driver.page_source))
+        except Exception as e:
+            self.logger.warning(f"Unable to save DOM snapshot: {e}")
+            dom_file = None
+
+        self._steps.append({
+            "name": step,
+            "offset": round(time.time() - self._started, 3),
+            "url": driver.current_url if dom_file else None,
+            "dom": dom_file,
+        })
+
+    def _read_network_events(self, driver, step, log_entries):
+        for item in log_entries:
+            message = json.loads(item["message"])["message"]
+            method = message.get("method")
+            params = message.get("params", {})
+            request_id = params.get("requestId")
+
+            if method == "Network.requestWillBeSent":
+                self._requests[request_id] = {
+                    "step": step,
+                    "request": params["request"],
+                    "wall_time": params.get("wallTime", time.time()),
+                    "start": params.get("timestamp", 0),
+                }
+            elif method == "Network.responseReceived" and request_id in self._requests:
+                self._requests[request_id]["response"] = params["response"]
+            elif method == "Network.loadingFinished" and request_id in self._requests:
+                pending = self._requests.pop(request_id)
+                if "response" not in pending:
+                    continue
+                pending["end"] = params.get("timestamp", pending["start"])
+                pending["body"] = self._response_body(driver, request_id)
+                self._entries.append(self._har_entry(pending))
+
+    @staticmethod
+    def _response_body(driver, request_id) -> bytes:
+        try:
+            result = driver.execute_cdp_cmd("Network.getResponseBody", {"requestId": request_id})
+        except Exception:
+            return b""
+        if result.get("base64Encoded"):
+            return base64.b64decode(result["body"])
+        return result.get("body", "").encode("utf-8")
+
+    def _har_entry(self, pending) -> dict:
+        request = pending["request"]
+        response = pending["response"]
+        body = self._scrub_bytes(pending["body"])
+        elapsed_ms = max(0.0, (pending["end"] - pending["start"]) * 1000)
+
+        entry = {
+            "startedDateTime": datetime.fromtimestamp(pending["wall_time"]).astimezone().isoformat(),
+            "time": round(elapsed_ms, 3),
+            "request": {
+                "method": request["method"],
+                "url": self.scrub(request["url"]),
+                "httpVersion": response.get("protocol", "http/1.1"),
+                "headers": [{"name": k, "value": self.scrub(str(v))} for k, v in request.get("headers", {}).items()],
+                "queryString": [],
+                "cookies": [],
+                "headersSize": -1,
+                "bodySize": len(request.get("postData", "")),
+            },
+            "response": {
+                "status": response["status"],
+                "statusText": response.get("statusText", ""),
+                "httpVersion": response.get("protocol", "http/1.1"),
+                "headers": [{"name": k, "value": str(v)} for k, v in response.get("headers", {}).items()],
+                "cookies": [],
+                "content": {
+                    "size": len(body),
+                    "mimeType": response.get("mimeType", ""),
+                    "text": base64.b64encode(body).decode("ascii"),
+                    "encoding": "base64",
+                },
+                "redirectURL": "",
+                "headersSize": -1,
+                "bodySize": len(body),
+            },
+            "cache": {},
+            "timings": {"send": 0, "wait": round(elapsed_ms, 3), "receive": 0},
+            "_step": pending["step"],
+        }
+        if "postData" in request:
+            entry["request"]["postData"] = {
+                "mimeType": request.get("headers", {}).get("Content-Type", ""),
+                "text": self.scrub(request["postData"]),
+            }
+        return entry
+
+    def finish(self):
+        """Writes the HAR file and step index. Returns the recording directory."""
+        if not self.session_dir:
+            return None
+        har = {
+            "log": {
+                "version": "1.2",
+                "creator": {"name": "utility-token-automator", "version": "1"},
+                "pages": [],
+                "entries": self._entries,
+            }
+        }
+        with open(os.path.join(self.session_dir, "session.har"), "w", encoding="utf-8") as f:
+            json.dump(har, f, indent=1)
+        with open(os.path.join(self.session_dir, "steps.json"), "w", encoding="utf-8") as f:
+            json.dump({"url": self.scrub(self._url), "steps": self._steps}, f, indent=1)
+
+        session_dir = self.session_dir
+        self.session_dir = None
+        self._secrets.clear()
+        self.logger.info(f"Session recording saved to {session_dir}")
+        return session_dir
@@ -0,0 +1,226 @@
+# src.service.settings
+
+import json
+import logging
+import os
+import threading
+from dataclasses import fields
+
+from model.settings import Settings
+from .metrics import metrics
+from .plans import DEFAULT_PLAN, PLANS, build_plan
+
+
+ENV_PREFIX = "UTA_"
+TRUE_VALUES = ("1", "true", "yes", "on")
+FALSE_VALUES = ("0", "false", "no", "off")
+
+SETTING_FIELDS = {setting.name: setting for setting in fields(Settings)}
+
+
+class SettingsError(Exception):
+    """Raised when the settings file or a UTA_* variable holds an invalid value."""
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in TRUE_VALUES + FALSE_VALUES:
+        return value.strip().lower() in TRUE_VALUES
+    raise ValueError("expected true or false")
+
+
+def _parse_number(kind, value):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError("expected a number")
+    number = float(value)
+    if kind is int:
+        if not number.is_integer():
+            raise ValueError("expected a whole number")
+        return int(number)
+    return number
+
+
+def _parse_step_timeouts(value) -> dict:
+    # the environment variable form is name=seconds,name=seconds
+    if isinstance(value, str):
+        items = [item.partition("=") for item in value.split(",") if item.strip()]
+        if not all(separator for _, separator, _ in items):
+            raise ValueError("expected name=seconds,name=seconds")
+        value = {name: seconds for name, _, seconds in items}
+    if not isinstance(value, dict):
+        raise ValueError("expected {step name: seconds}")
+    steps = {compiled.step.name for compiled in PLANS[DEFAULT_PLAN].steps}
+    unknown = set(name.strip() for name in value) - steps
+    if unknown:
+        raise ValueError(f"unknown step {', '.join(sorted(unknown))}")
+    return {name.strip(): _parse_number(float, seconds) for name, seconds in value.items()}
+
+
+def parse_value(name: str, value):
+    """
+    Converts a value from the settings file or the environment to the setting's type.
+    :raises ValueError: when the value does not fit the setting
+    """
+    setting = SETTING_FIELDS[name]
+    if value is None or value == "":
+        if setting.default is None:
+            return None
+        raise ValueError("a value is required")
+
+    if setting.type is bool:
+        value = _parse_bool(value)
+    elif setting.type in (int, float):
+        value = _parse_number(setting.type, value)
+    elif setting.type is dict:
+        value = _parse_step_timeouts(value)
+    else:
+        value = str(value).strip()
+
+    choices = setting.metadata.get("choices")
+    if choices and value not in choices:
+        raise ValueError(f"expected one of {', '.join(choices)}")
+    minimum = setting.metadata.get("min")
+    if minimum is not None:
+        for number in (value.values() if isinstance(value, dict) else (value,)):
+            if number < minimum:
+                raise ValueError(f"must be at least {minimum}")
+    if name == "url" and not value.startswith(("http://", "https://")):
+        raise ValueError("expected an http(s) URL")
+    return value
+
+
+def purchase_plan(settings: Settings):
+    """:return: (CompiledPlan) The default plan with the settings' portal URL and step timeouts"""
+    return build_plan(settings.url, settings.timeout, settings.step_timeouts)
+
+
+class SettingsStore:
+    """
+    Settings from the defaults, the JSON settings file and UTA_<NAME> environment variables, each
+    overriding the one before. current is a Settings snapshot swapped as a whole on reload, so the
+    hot path reads a plain attribute and never parses or locks. Since the environment cannot change
+    under a running process, a setting given there stays fixed; the file is what is tuned live.
+    watch() reloads the file when it changes and subscribers are called with the new snapshot and
+    the names that changed. An invalid file is reported and the last good settings are kept.
+    """
+    def __init__(self, path: str, environ=None, strict: bool = True, logger=None):
+        """
+        :param environ: (dict) Environment to read, os.environ if not given
+        :param strict: (bool) False starts with the defaults when the settings are invalid instead of raising
+        :raises SettingsError: when strict and the settings file or a variable is invalid
+        """
+        self.path = path
+        self.environ = os.environ if environ is None else environ
+        self.logger = logger or logging.getLogger("INFO Logger")
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._stamp = self._file_stamp()
+        try:
+            self.current = self.load()
+        except SettingsError as e:
+            if strict:
+                raise
+            self.logger.error(f"{e}. Using the default settings")
+            self.current = Settings()
+
+    def load(self) -> Settings:
+        """
+        Reads and validates the settings without applying them.
+        :raises SettingsError: listing every invalid value
+        """
+        values, errors = {}, []
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            if not isinstance(data, dict):
+                raise ValueError("expected a JSON object")
+        except FileNotFoundError:
+            data = {}
+        except (OSError, ValueError) as e:
+            raise SettingsError(f"Unable to read {self.path}: {e}") from e
+
+        for name, value in data.items():
+            if name not in SETTING_FIELDS:
+                errors.append(f"{self.path}: unknown setting {name!r}")
+                continue
+            try:
+                values[name] = parse_value(name, value)
+            except (TypeError, ValueError) as e:
+                errors.append(f"{self.path}: {name}: {e}")
+
+        for name in SETTING_FIELDS:
+            variable = ENV_PREFIX + name.upper()
+            if variable not in self.environ:
+                continue
+            try:
+                values[name] = parse_value(name, self.environ[variable])
+            except (TypeError, ValueError) as e:
+                errors.append(f"{variable}: {e}")
+
+        if errors:
+            raise SettingsError("Invalid settings: " + "; ".join(errors))
+        return Settings(**values)
+
+    def reload(self, raise_errors: bool = False) -> set:
+        """
+        Re-reads the settings and tells subscribers what changed.
+        :param raise_errors: (bool) Raise when the settings are invalid instead of logging the error
+        :return: (set) Names of the settings that changed, empty when nothing changed or the file is invalid
+        :raises SettingsError: when raise_errors and the settings are invalid; the current settings are kept
+        """
+        with self._lock:
+            self._stamp = self._file_stamp()
+            try:
+                settings = self.load()
+            except SettingsError as e:
+                metrics.incr("settings.invalid")
+                if raise_errors:
+                    raise
+                self.logger.error(f"{e}. Keeping the current settings")
+                return set()
+            previous = self.current
+            changed = {name for name in SETTING_FIELDS if getattr(settings, name) != getattr(previous, name)}
+            if not changed:
+                return changed
+            self.current = settings
+            subscribers = list(self._subscribers)
+
+        metrics.incr("settings.reloaded")
+        self.logger.info(f"Settings changed: {', '.join(sorted(changed))}")
+        for callback in subscribers:
+            try:
+                callback(settings, changed)
+            except Exception as e:
+                self.logger.error(f"Unable to apply the settings: {e}")
+        return changed
+
+    def subscribe(self, callback):
+        """:param callback: (callable) callback(settings, changed) after a reload changed something"""
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def watch(self, interval: float = 2.0):
+        """Starts a thread that reloads the settings whenever the file is written."""
+        self._thread = threading.Thread(target=self._poll, args=(interval,), name="SettingsWatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _poll(self, interval):
+        while not self._stop.wait(interval):
+            if self._file_stamp() != self._stamp:
+                self.reload()
+
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
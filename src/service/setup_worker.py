@@ -1,22 +1,80 @@
 from PySide6.QtCore import QObject, Signal, Slot
 
+from model.purchase import PurchaseResult, STAGE_SETUP, STATUS_ERROR
 from .browser_automator import BrowserAutomator
+from .card_router import NoCardAvailableError
+from .plan_engines import SeleniumEngine
+from .session_recorder import SessionRecorder
+
+
+class PageUnavailableError(RuntimeError):
+    """Raised when the browser started but the payment page did not load."""
 
 
 class SetupWorker(QObject):
-    finished = Signal(object)
+    finished = Signal(object, object, object)
     error = Signal(str)
+    # (job, page_unavailable): only a page that did not load is worth retrying later
+    failed = Signal(object, bool)
+    no_card = Signal(object, str)
 
-    def __init__(self, url, logger):
+    def __init__(self, plan, logger, governor=None, record_dir=None, profiler=None, job=None, artifacts=None,
+                 headless=False, automator_options=None, card_router=None, card_timeout=0):
+        """
+        :param plan: (CompiledPlan) The browser is started on its start page
+        :param card_router: (CardRouter) The card for the job is taken here, waiting up to card_timeout
+                            seconds for one under its limits, before a browser is started
+        """
         super().__init__()
-        self.url = url
+        self.plan = plan
+        self.headless = headless
+        self.automator_options = automator_options or {}
         self.logger = logger
+        self.governor = governor
+        self.record_dir = record_dir
+        self.profiler = profiler
+        self.job = job
+        self.artifacts = artifacts
+        self.card_router = card_router
+        self.card_timeout = card_timeout
 
     def run(self):
+        lease = None
+        if self.card_router:
+            try:
+                lease = self.card_router.acquire(self.job.amount, timeout=self.card_timeout)
+            except NoCardAvailableError as e:
+                self.no_card.emit(self.job, str(e))
+                return
         try:
-            automator = BrowserAutomator(url=self.url, headless=False, logger=self.logger, skip_setup=True)
-            automator.setup_driver()
-            automator.open_site()
-            self.finished.emit(automator)
+            if not self.profiler:
+                automator = self.setup()
+            else:
+                with self.profiler.profile_thread():
+                    automator = self.setup()
         except Exception as e:
+            if lease:
+                # nothing was submitted, so the card is not charged
+                self.card_router.release(lease, PurchaseResult(self.job.meter, self.job.amount, STATUS_ERROR,
+                                                               str(e), STAGE_SETUP))
             self.error.emit(str(e))
+            self.failed.emit(self.job, isinstance(e, PageUnavailableError))
+            return
+        # emitted once profiling stopped here, so the GUI thread can profile the purchase
+        self.finished.emit(automator, self.job, lease)
+
+    def setup(self):
+        """
+        Starts the browser on the payment page.
+        :raises PageUnavailableError: when the page does not load
+        :raises RuntimeError: when the browser does not start
+        """
+        recorder = SessionRecorder(self.record_dir, logger=self.logger) if self.record_dir else None
+        automator = BrowserAutomator(url=self.plan.url, headless=self.headless, logger=self.logger, skip_setup=True,
+                                     governor=self.governor, recorder=recorder, profiler=self.profiler,
+                                     artifacts=self.artifacts, **self.automator_options)
+        automator.setup_driver()
+        if not SeleniumEngine(automator, logger=self.logger).open(self.plan.url, self.plan.ready):
+            automator.close()
+            raise PageUnavailableError("Unable to load payment page")
+        return automator
@@ -32,4 +32,24 @@ class Validate:
     def cc_details(self, name, number, code, month, year):
         if not all ([name, number, code, month, year]):
             return False, "Missing CC environment variables"
-        return True, "CC environment variables set"
\ No newline at end of file
+        return True, "CC environment variables set"
+
+    def card(self, number, name, code, month, year):
+        """
+        Validate card details entered for the wallet.
+        :return: (bool), (str) message
+        """
+        number = (number or "").replace(" ", "").replace("-", "")
+        if not all([number, name, code, month, year]):
+            return False, "All card details are required"
+        if not number.isdigit() or not 12 <= len(number) <= 19:
+            return False, "Invalid card number"
+        if not str(code).isdigit() or len(str(code)) not in (3, 4):
+            return False, "Invalid card code"
+        try:
+            month, year = int(month), int(year)
+        except (TypeError, ValueError):
+            return False, "Invalid expiry date"
+        if not 1 <= month <= 12 or year < 2000:
+            return False, "Invalid expiry date"
+        return True, "Valid card"
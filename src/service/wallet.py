@@ -0,0 +1,116 @@
+# src.service.wallet
+
+import json
+import logging
+import os
+import threading
+import uuid
+from dataclasses import asdict
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from model.card import Card, WalletCard
+
+
+class WalletError(Exception):
+    """Raised when the wallet cannot be read or written."""
+
+
+class Wallet:
+    """
+    Local wallet of payment cards, stored as a single Fernet-encrypted file.
+    The key is taken from UTA_WALLET_KEY when set, otherwise from a key file readable only by
+    the current user that is created on first use. Keep the key file out of backups that hold
+    the wallet file.
+    """
+    def __init__(self, path: str, key_file: str, key: str = None, logger=None):
+        self.path = path
+        self.key_file = key_file
+        self.logger = logger or logging.getLogger("INFO Logger")
+        self._lock = threading.Lock()
+        try:
+            self._fernet = Fernet(key or os.getenv("UTA_WALLET_KEY") or self._load_key())
+        except (ValueError, TypeError) as e:
+            raise WalletError("Invalid wallet key") from e
+        self._cards = self._load()
+
+    def _load_key(self) -> bytes:
+        if os.path.exists(self.key_file):
+            with open(self.key_file, "rb") as f:
+                return f.read().strip()
+
+        os.makedirs(os.path.dirname(self.key_file) or ".", exist_ok=True)
+        key = Fernet.generate_key()
+        fd = os.open(self.key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(key)
+        self.logger.info(f"Wallet key created: {self.key_file}")
+        return key
+
+    def _load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "rb") as f:
+                entries = json.loads(self._fernet.decrypt(f.read()))
+        except InvalidToken as e:
+            raise WalletError("Unable to decrypt the wallet, check the wallet key") from e
+        except (OSError, ValueError) as e:
+            raise WalletError(f"Unable to read the wallet: {e}") from e
+
+        cards = {}
+        for entry in entries:
+            entry["card"] = Card(**entry["card"])
+            cards[entry["id"]] = WalletCard(**entry)
+        return cards
+
+    def _save(self):
+        data = json.dumps([asdict(card) for card in self._cards.values()]).encode()
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        tmp = self.path + ".tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(self._fernet.encrypt(data))
+        os.replace(tmp, self.path)
+
+    def cards(self, enabled_only: bool = False):
+        """:return: (list) WalletCard entries in the order they were added"""
+        with self._lock:
+            return [card for card in self._cards.values() if card.enabled or not enabled_only]
+
+    def get(self, card_id: str):
+        with self._lock:
+            return self._cards.get(card_id)
+
+    def add(self, card: Card, label: str = "", max_per_hour: int = None, max_amount: float = None,
+            max_daily_amount: float = None, max_concurrent: int = 1) -> WalletCard:
+        """
+        Adds a card. A card with the same number replaces the one already stored.
+        :return: (WalletCard)
+        """
+        with self._lock:
+            for existing in self._cards.values():
+                if existing.card.number == card.number:
+                    card_id = existing.id
+                    break
+            else:
+                card_id = uuid.uuid4().hex
+            entry = WalletCard(card_id, card, label, max_per_hour, max_amount, max_daily_amount, max_concurrent)
+            self._cards[card_id] = entry
+            self._save()
+        self.logger.info(f"Card {entry.display_name} saved to wallet")
+        return entry
+
+    def remove(self, card_id: str) -> bool:
+        with self._lock:
+            if not self._cards.pop(card_id, None):
+                return False
+            self._save()
+        return True
+
+    def set_enabled(self, card_id: str, enabled: bool):
+        with self._lock:
+            if card_id in self._cards:
+                self._cards[card_id].enabled = enabled
+                self._save()
@@ -1,10 +1,76 @@
 import os
 
 
+# default payment portal; the running value is the "url" setting
 URL = "https://puc.able-soft.com:10131/ADR/PaymentADR_Step1.aspx"
 
-CC_NAME = os.getenv("CC_NAME")
-CC_NUMBER = os.getenv("CC_NUMBER")
-CC_CODE = os.getenv("CC_CODE")
-CC_EXP_MONTH = os.getenv("CC_EXP_MONTH")
-CC_EXP_YEAR = os.getenv("CC_EXP_YEAR")
\ No newline at end of file
+# local storage for caches and queues
+DATA_DIR = os.getenv("UTA_DATA_DIR", os.path.join(os.path.expanduser("~"), ".utility-token-automator"))
+
+# customer name lookup cache
+CUSTOMER_CACHE_FILE = os.path.join(DATA_DIR, "customer_cache.sqlite3")
+CUSTOMER_CACHE_TTL = 30 * 24 * 60 * 60  # seconds
+
+# browser resource governor
+DRIVER_PID_DIR = os.path.join(DATA_DIR, "drivers")  # one pid file per running process
+BROWSER_MAX_RSS_MB = 1024
+BROWSER_MAX_CPU_PERCENT = 200
+
+# session recording (set UTA_RECORD_DIR to record every purchase as an offline fixture)
+RECORD_DIR = os.getenv("UTA_RECORD_DIR")
+
+# profiling (UTA_PROFILE=1 or --profile profiles every purchase)
+PROFILE_ENABLED = os.getenv("UTA_PROFILE") == "1"
+PROFILE_DIR = os.getenv("UTA_PROFILE_DIR", os.path.join(DATA_DIR, "profiles"))
+
+# in-flight purchase lock files, shared by the GUI, CLI and batch runs
+PURCHASE_LOCK_DIR = os.path.join(DATA_DIR, "inflight")
+
+# local purchase service (daemon.py)
+SERVICE_PORT = 8787
+SERVICE_MAX_QUEUE = 100
+
+# failure artifacts (screenshots, page source, console logs)
+ARTIFACT_DIR = os.path.join(DATA_DIR, "failures")
+ARTIFACT_MAX_COUNT = 200
+ARTIFACT_MAX_BYTES = 200 * 1024 * 1024
+
+# offline purchase queue, replayed when the portal is reachable again
+OFFLINE_QUEUE_FILE = os.path.join(DATA_DIR, "offline_queue.sqlite3")
+PORTAL_PROBE_INTERVAL = 30  # seconds
+
+# encrypted card wallet (UTA_WALLET_KEY overrides the local key file)
+WALLET_FILE = os.path.join(DATA_DIR, "wallet.enc")
+WALLET_KEY_FILE = os.path.join(DATA_DIR, "wallet.key")
+CARD_CHARGES_FILE = os.path.join(DATA_DIR, "card_charges.sqlite3")
+# defaults for cards added to the wallet
+CARD_MAX_PER_HOUR = 10
+CARD_MAX_CONCURRENT = 1
+# the card in the CC_* environment variables has no limits unless these are set
+ENV_CARD_MAX_PER_HOUR = int(os.getenv("UTA_CC_MAX_PER_HOUR", 0)) or None
+ENV_CARD_MAX_CONCURRENT = int(os.getenv("UTA_CC_MAX_CONCURRENT", 0)) or None
+CARD_WAIT_TIMEOUT = 120  # seconds the GUI waits for a card to come under its limits
+
+# dashboard (Tools > Dashboard)
+DASHBOARD_REFRESH_MS = 1000
+DASHBOARD_WINDOW = 15 * 60  # seconds of samples shown
+
+# load test against the local portal stand-in (loadtest.py)
+LOADTEST_DIR = os.path.join(DATA_DIR, "loadtest")
+LOADTEST_LEVELS = (1, 2, 4, 8)
+LOADTEST_PURCHASES = 20  # per concurrency level
+
+# receipts for successful purchases; UTA_RECEIPT_TO (phone number or email) receives batch receipts
+RECEIPT_DIR = os.path.join(DATA_DIR, "receipts")
+RECEIPT_TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+# comma separated, any of txt, pdf, png; an unknown format stops the GUI, CLI and daemon from starting
+RECEIPT_FORMATS = tuple(fmt.strip().lower() for fmt in os.getenv("UTA_RECEIPT_FORMATS", "txt,pdf").split(",")
+                        if fmt.strip())
+RECEIPT_RECIPIENT = os.getenv("UTA_RECEIPT_TO")
+RECEIPT_BATCH_SIZE = 100
+OUTBOX_DIR = os.path.join(DATA_DIR, "outbox")
+
+# runtime settings (model/settings.py): this JSON file, then UTA_<NAME> environment variables;
+# the GUI and daemon reload the file when it changes
+SETTINGS_FILE = os.getenv("UTA_SETTINGS_FILE", os.path.join(DATA_DIR, "settings.json"))
+SETTINGS_POLL_INTERVAL = 2  # seconds
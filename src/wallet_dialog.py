@@ -0,0 +1,149 @@
+from PySide6 import QtCore as qtc
+from PySide6 import QtWidgets as qtw
+
+from model.card import Card
+from service.validate import Validate
+from static.constants import CARD_MAX_CONCURRENT, CARD_MAX_PER_HOUR
+
+
+class NewCardDialog(qtw.QDialog):
+    """Asks for the details and limits of a card to add to the wallet."""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("New Card")
+
+        self.le_cardNumber = qtw.QLineEdit()
+        self.le_cardName = qtw.QLineEdit()
+        self.le_cardCode = qtw.QLineEdit()
+        self.le_cardCode.setEchoMode(qtw.QLineEdit.Password)
+        self.le_expiry = qtw.QLineEdit()
+        self.le_expiry.setPlaceholderText("MM/YYYY")
+        self.le_label = qtw.QLineEdit()
+        self.sb_maxPerHour = qtw.QSpinBox()
+        self.sb_maxPerHour.setRange(0, 1000)
+        self.sb_maxPerHour.setValue(CARD_MAX_PER_HOUR)
+        self.sb_maxPerHour.setSpecialValueText("No limit")
+        self.sb_maxAmount = qtw.QDoubleSpinBox()
+        self.sb_maxAmount.setRange(0, 100000)
+        self.sb_maxAmount.setSpecialValueText("No limit")
+        self.sb_maxDaily = qtw.QDoubleSpinBox()
+        self.sb_maxDaily.setRange(0, 1000000)
+        self.sb_maxDaily.setSpecialValueText("No limit")
+        self.lb_cardMessage = qtw.QLabel()
+
+        form = qtw.QFormLayout(self)
+        form.addRow("Card Number", self.le_cardNumber)
+        form.addRow("Cardholder Name", self.le_cardName)
+        form.addRow("Card Code", self.le_cardCode)
+        form.addRow("Expiry", self.le_expiry)
+        form.addRow("Label", self.le_label)
+        form.addRow("Purchases / Hour", self.sb_maxPerHour)
+        form.addRow("Max Purchase", self.sb_maxAmount)
+        form.addRow("Max / Day", self.sb_maxDaily)
+        form.addRow(self.lb_cardMessage)
+
+        buttons = qtw.QDialogButtonBox(qtw.QDialogButtonBox.Save | qtw.QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.validate_input)
+        buttons.rejected.connect(self.reject)
+        form.addRow(buttons)
+
+    def validate_input(self):
+        month, _, year = self.le_expiry.text().strip().partition("/")
+        valid, msg = Validate().card(self.le_cardNumber.text(), self.le_cardName.text().strip(),
+                                     self.le_cardCode.text().strip(), month, year)
+        if not valid:
+            self.lb_cardMessage.setText(msg)
+            return
+        self.accept()
+
+    def card(self) -> Card:
+        month, _, year = self.le_expiry.text().strip().partition("/")
+        number = self.le_cardNumber.text().replace(" ", "").replace("-", "")
+        return Card(number, self.le_cardName.text().strip(), self.le_cardCode.text().strip(), int(month), int(year))
+
+    def limits(self) -> dict:
+        return {
+            "label": self.le_label.text().strip(),
+            "max_per_hour": self.sb_maxPerHour.value() or None,
+            "max_amount": self.sb_maxAmount.value() or None,
+            "max_daily_amount": self.sb_maxDaily.value() or None,
+            "max_concurrent": CARD_MAX_CONCURRENT,
+        }
+
+
+class WalletDialog(qtw.QDialog):
+    """Lists the wallet's cards and adds, enables/disables or removes them."""
+    wallet_changed = qtc.Signal()
+
+    def __init__(self, wallet, card_router, parent=None):
+        super().__init__(parent)
+        self.wallet = wallet
+        self.card_router = card_router
+        self.setWindowTitle("Wallet")
+        self.resize(480, 320)
+
+        self.pb_newCard = qtw.QPushButton("New Card")
+        self.pb_toggleCard = qtw.QPushButton("Enable / Disable")
+        self.pb_removeCard = qtw.QPushButton("Remove")
+        self.lw_walletView = qtw.QListWidget()
+
+        buttons = qtw.QHBoxLayout()
+        buttons.addWidget(self.pb_newCard)
+        buttons.addWidget(self.pb_toggleCard)
+        buttons.addWidget(self.pb_removeCard)
+        layout = qtw.QVBoxLayout(self)
+        layout.addLayout(buttons)
+        layout.addWidget(self.lw_walletView)
+
+        self.pb_newCard.clicked.connect(self.new_card)
+        self.pb_toggleCard.clicked.connect(self.toggle_card)
+        self.pb_removeCard.clicked.connect(self.remove_card)
+        self.show_cards()
+
+    def show_cards(self):
+        self.lw_walletView.clear()
+        usage = {row["id"]: row for row in self.card_router.usage()}
+        for entry in self.wallet.cards():
+            text = f"{entry.display_name}  {entry.card.exp_month:02d}/{entry.card.exp_year}"
+            if not entry.enabled:
+                text += "  (disabled)"
+            elif usage.get(entry.id, {}).get("declined"):
+                text += "  (declined)"
+            item = qtw.QListWidgetItem(text)
+            item.setData(qtc.Qt.UserRole, entry.id)
+            self.lw_walletView.addItem(item)
+
+    def selected_card_id(self):
+        item = self.lw_walletView.currentItem()
+        return item.data(qtc.Qt.UserRole) if item else None
+
+    def new_card(self):
+        dialog = NewCardDialog(self)
+        if dialog.exec() != qtw.QDialog.Accepted:
+            return
+        self.wallet.add(dialog.card(), **dialog.limits())
+        self.cards_changed()
+
+    def toggle_card(self):
+        card_id = self.selected_card_id()
+        if not card_id:
+            return
+        enable = not self.wallet.get(card_id).enabled
+        self.wallet.set_enabled(card_id, enable)
+        if enable:
+            # re-enabling a card also gives a declined card another chance
+            self.card_router.reinstate(card_id)
+        self.cards_changed()
+
+    def remove_card(self):
+        card_id = self.selected_card_id()
+        if not card_id:
+            return
+        answer = qtw.QMessageBox.question(self, "Remove Card", "Remove the selected card from the wallet?")
+        if answer == qtw.QMessageBox.Yes:
+            self.wallet.remove(card_id)
+            self.cards_changed()
+
+    def cards_changed(self):
+        self.wallet_changed.emit()
+        self.show_cards()